@@ -2,6 +2,7 @@ from fastapi import APIRouter, HTTPException, Header
 from pydantic import BaseModel, EmailStr
 from typing import Optional
 from services.supabase_service import supabase_service
+from services.deadline import DeadlineExceeded
 
 router = APIRouter()
 
@@ -27,7 +28,7 @@ class AuthResponse(BaseModel):
 async def sign_up(request: SignUpRequest):
     """用户注册"""
     try:
-        response = supabase_service.client.auth.sign_up({
+        response = await supabase_service.call_auth("auth.sign_up", supabase_service.auth.sign_up, {
             "email": request.email,
             "password": request.password,
             "options": {
@@ -71,7 +72,7 @@ async def sign_up(request: SignUpRequest):
 async def sign_in(request: SignInRequest):
     """用户登录"""
     try:
-        response = supabase_service.client.auth.sign_in_with_password({
+        response = await supabase_service.call_auth("auth.sign_in", supabase_service.auth.sign_in_with_password, {
             "email": request.email,
             "password": request.password
         })
@@ -107,8 +108,11 @@ async def sign_out(authorization: str = Header(None)):
             raise HTTPException(status_code=401, detail="未提供有效的认证信息")
         
         token = authorization.replace("Bearer ", "")
-        supabase_service.client.auth.sign_out()
+        # 按调用者的 token 登出；共享客户端上没有（也不应有）用户 session
+        await supabase_service.call_auth("auth.sign_out", supabase_service.auth.admin.sign_out, token)
         return {"message": "登出成功"}
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
@@ -121,7 +125,7 @@ async def get_current_user(authorization: str = Header(None)):
             raise HTTPException(status_code=401, detail="未提供有效的认证信息")
         
         token = authorization.replace("Bearer ", "")
-        user = supabase_service.client.auth.get_user(token)
+        user = await supabase_service.get_user(token)
         
         if user:
             return {
@@ -131,6 +135,8 @@ async def get_current_user(authorization: str = Header(None)):
             }
         else:
             raise HTTPException(status_code=401, detail="无效的认证信息")
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         raise HTTPException(status_code=401, detail="认证失败")
 
@@ -139,12 +145,16 @@ async def get_current_user(authorization: str = Header(None)):
 async def refresh_token(refresh_token: str):
     """刷新访问令牌"""
     try:
-        response = supabase_service.client.auth.refresh_session(refresh_token)
+        response = await supabase_service.call_auth(
+            "auth.refresh_session", supabase_service.auth.refresh_session, refresh_token
+        )
         
         return {
             "access_token": response.session.access_token,
             "refresh_token": response.session.refresh_token
         }
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         raise HTTPException(status_code=401, detail="刷新令牌失败")
 
@@ -0,0 +1,278 @@
+"""
+数据导入导出 API
+
+导出：按页遍历用户的行程和每个行程的费用，以 NDJSON 流式输出（可选 gzip），
+内存占用与数据总量无关。每行格式：
+    {"type": "trip", "data": {...}}
+    {"type": "expense", "data": {...}}
+费用行总是紧跟在所属行程之后。
+
+导入：流式读取同样格式的 NDJSON（可为 gzip），逐行校验后分批多行插入。
+行程会获得新的 id，费用中的 trip_id 会映射到新 id；
+引用已有行程的费用也可以导入，但只限当前用户自己的行程。
+"""
+import zlib
+import orjson
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, List, Optional
+from fastapi import APIRouter, HTTPException, Header, Query, Request
+from fastapi.responses import StreamingResponse
+from pydantic import ValidationError
+from models.schemas import TripPlan, ExpenseCreate
+from models.serialization import trip_row_to_dict, expense_row_to_dict, trip_plan_to_row
+from services.supabase_service import supabase_service
+from api.trips import get_user_id_from_token
+
+router = APIRouter()
+
+EXPORT_PAGE_SIZE = 100
+IMPORT_BATCH_SIZE = 500
+MAX_LINE_BYTES = 5 * 1024 * 1024
+MAX_REPORTED_ERRORS = 100
+
+
+async def _export_lines(user_id: str) -> AsyncIterator[bytes]:
+    """逐页生成 NDJSON，每页一块"""
+    cursor = None
+    while True:
+        trips, cursor, _ = await supabase_service.get_user_trips(user_id, EXPORT_PAGE_SIZE, cursor)
+        for trip in trips:
+            yield orjson.dumps({"type": "trip", "data": trip_row_to_dict(trip)}) + b"\n"
+
+            expense_cursor = None
+            while True:
+                expenses, expense_cursor, _ = await supabase_service.get_trip_expenses_page(
+                    trip["id"], user_id, EXPORT_PAGE_SIZE, expense_cursor
+                )
+                if expenses:
+                    yield b"".join(
+                        orjson.dumps({"type": "expense", "data": expense_row_to_dict(exp)}) + b"\n"
+                        for exp in expenses
+                    )
+                if not expense_cursor:
+                    break
+        if not cursor:
+            break
+
+
+async def _gzip_stream(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """流式 gzip 压缩"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    async for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+@router.get("/export")
+async def export_data(
+    authorization: str = Header(None),
+    gzip: bool = Query(False, description="是否输出 gzip 压缩的 .ndjson.gz 文件")
+):
+    """流式导出当前用户的全部行程和费用（NDJSON）"""
+    user_id = await get_user_id_from_token(authorization)
+
+    stamp = datetime.utcnow().strftime("%Y%m%d%H%M%S")
+    if gzip:
+        return StreamingResponse(
+            _gzip_stream(_export_lines(user_id)),
+            media_type="application/gzip",
+            headers={"Content-Disposition": f'attachment; filename="travel-export-{stamp}.ndjson.gz"'}
+        )
+    return StreamingResponse(
+        _export_lines(user_id),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="travel-export-{stamp}.ndjson"'}
+    )
+
+
+async def _read_lines(request: Request) -> AsyncIterator[bytes]:
+    """从请求体流中逐行读取，自动识别 gzip"""
+    decompressor = None
+    first = True
+    buffer = b""
+    async for chunk in request.stream():
+        if first and chunk:
+            first = False
+            if chunk[:2] == b"\x1f\x8b":
+                decompressor = zlib.decompressobj(31)
+        if decompressor is not None:
+            chunk = decompressor.decompress(chunk)
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            yield line
+        if len(buffer) > MAX_LINE_BYTES:
+            raise HTTPException(status_code=413, detail="单行数据过大")
+    if decompressor is not None:
+        buffer += decompressor.flush()
+    if buffer:
+        yield buffer
+
+
+class _Importer:
+    """
+    累积校验后的行，按批次写入数据库
+
+    导出文件中每个行程后面紧跟它的费用。属于尚未写入的行程的费用先按旧行程 id 暂存，
+    等该批行程写入、拿到新 id 后再进入费用批次，行程仍按 IMPORT_BATCH_SIZE 成批写入；
+    暂存的费用达到 IMPORT_BATCH_SIZE 条时提前写入当前这批行程，限制内存占用。
+    """
+
+    def __init__(self, user_id: str):
+        self.user_id = user_id
+        self.trip_id_map: Dict[str, str] = {}
+        self.existing_trips: Dict[str, bool] = {}
+        self.pending_trips: List[tuple] = []
+        self.pending_trip_ids: set = set()
+        self.deferred_expenses: Dict[str, List[tuple]] = {}
+        self.deferred_count = 0
+        self.pending_expenses: List[tuple] = []
+        self.trips_imported = 0
+        self.expenses_imported = 0
+        self.errors: List[Dict[str, Any]] = []
+        self.error_count = 0
+
+    def error(self, line_no: int, message: Any) -> None:
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({"line": line_no, "error": message})
+
+    async def add_trip(self, line_no: int, data: Dict[str, Any]) -> None:
+        old_id = data.get("id")
+        trip_plan = TripPlan.model_validate({**data, "user_id": self.user_id})
+        row = trip_plan_to_row(trip_plan)
+        row["updated_at"] = datetime.utcnow().isoformat()
+        if not row.get("created_at"):
+            row["created_at"] = row["updated_at"]
+        self.pending_trips.append((line_no, old_id, row))
+        if old_id:
+            self.pending_trip_ids.add(old_id)
+        if len(self.pending_trips) >= IMPORT_BATCH_SIZE:
+            await self.flush_trips()
+
+    async def add_expense(self, line_no: int, data: Dict[str, Any]) -> None:
+        expense = ExpenseCreate.model_validate(data)
+        row = expense.model_dump(mode="json")
+        row["user_id"] = self.user_id
+        if data.get("created_at"):
+            row["created_at"] = data["created_at"]
+
+        # 行程还在待写入的批次中：暂存，写入行程后再填上新 id
+        if expense.trip_id in self.pending_trip_ids:
+            self.deferred_expenses.setdefault(expense.trip_id, []).append((line_no, row))
+            self.deferred_count += 1
+            if self.deferred_count >= IMPORT_BATCH_SIZE:
+                await self.flush_trips()
+            return
+
+        trip_id = await self._resolve_trip_id(expense.trip_id)
+        if trip_id is None:
+            self.error(line_no, f"行程不存在: {expense.trip_id}")
+            return
+        row["trip_id"] = trip_id
+        await self._queue_expense(line_no, row)
+
+    async def _queue_expense(self, line_no: int, row: Dict[str, Any]) -> None:
+        self.pending_expenses.append((line_no, row))
+        if len(self.pending_expenses) >= IMPORT_BATCH_SIZE:
+            await self.flush_expenses()
+
+    async def _resolve_trip_id(self, trip_id: str) -> Optional[str]:
+        """优先映射到本次导入的新行程，否则确认是否为当前用户已有的行程"""
+        if trip_id in self.trip_id_map:
+            return self.trip_id_map[trip_id]
+        if trip_id not in self.existing_trips:
+            try:
+                version = await supabase_service.get_trip_version(trip_id, self.user_id)
+            except Exception:
+                version = None  # 非法 id 等
+            self.existing_trips[trip_id] = version is not None
+        return trip_id if self.existing_trips[trip_id] else None
+
+    async def flush_trips(self) -> None:
+        batch, self.pending_trips = self.pending_trips, []
+        deferred, self.deferred_expenses = self.deferred_expenses, {}
+        self.pending_trip_ids.clear()
+        self.deferred_count = 0
+        if not batch:
+            return
+        try:
+            created = await supabase_service.create_trips_bulk([row for _, _, row in batch])
+        except Exception as e:
+            for line_no, _, _ in batch:
+                self.error(line_no, f"写入失败: {str(e)}")
+            for old_id, expenses in deferred.items():
+                for line_no, _ in expenses:
+                    self.error(line_no, f"所属行程写入失败: {old_id}")
+            return
+        for (_, old_id, _), new_row in zip(batch, created):
+            if old_id:
+                self.trip_id_map[old_id] = new_row["id"]
+        self.trips_imported += len(created)
+
+        # 暂存的费用填上新的行程 id，进入费用批次
+        for old_id, expenses in deferred.items():
+            new_id = self.trip_id_map.get(old_id)
+            for line_no, row in expenses:
+                if new_id is None:
+                    self.error(line_no, f"行程不存在: {old_id}")
+                    continue
+                row["trip_id"] = new_id
+                await self._queue_expense(line_no, row)
+
+    async def flush_expenses(self) -> None:
+        batch, self.pending_expenses = self.pending_expenses, []
+        if not batch:
+            return
+        try:
+            created = await supabase_service.create_expenses_bulk([row for _, row in batch])
+        except Exception as e:
+            for line_no, _ in batch:
+                self.error(line_no, f"写入失败: {str(e)}")
+            return
+        self.expenses_imported += len(created)
+
+
+@router.post("/import")
+async def import_data(
+    request: Request,
+    authorization: str = Header(None)
+):
+    """
+    流式导入 NDJSON（格式同导出，可为 gzip）
+    逐行校验，分批写入；返回导入数量和每行的错误
+    """
+    user_id = await get_user_id_from_token(authorization)
+    importer = _Importer(user_id)
+
+    line_no = 0
+    async for line in _read_lines(request):
+        line_no += 1
+        if not line.strip():
+            continue
+        try:
+            record = orjson.loads(line)
+            record_type, data = record["type"], record["data"]
+            if record_type == "trip":
+                await importer.add_trip(line_no, data)
+            elif record_type == "expense":
+                await importer.add_expense(line_no, data)
+            else:
+                importer.error(line_no, f"未知类型: {record_type}")
+        except ValidationError as e:
+            importer.error(line_no, e.errors(include_url=False, include_context=False))
+        except (orjson.JSONDecodeError, KeyError, TypeError):
+            importer.error(line_no, "无法解析的行")
+
+    await importer.flush_trips()
+    await importer.flush_expenses()
+
+    return {
+        "success": importer.error_count == 0,
+        "trips_imported": importer.trips_imported,
+        "expenses_imported": importer.expenses_imported,
+        "error_count": importer.error_count,
+        "errors": importer.errors,
+    }
@@ -0,0 +1,111 @@
+"""
+ETag / 条件 GET 工具
+
+ETag 由数据版本（updated_at、费用条数等）而不是响应体计算，
+因此可以先用轻量查询取版本号，命中 If-None-Match 时直接返回 304，
+既不加载完整数据也不序列化响应体。
+"""
+import hashlib
+from typing import Any, Dict, List, Optional, Tuple
+from fastapi import Response
+
+# 允许浏览器缓存，但每次使用前都要带 If-None-Match 回源校验
+CACHE_CONTROL = "private, no-cache"
+
+
+def _digest(*parts: Any) -> str:
+    raw = "|".join("" if part is None else str(part) for part in parts)
+    return hashlib.blake2b(raw.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def make_etag(*parts: Any) -> str:
+    """由版本信息生成强 ETag"""
+    return '"' + _digest(*parts) + '"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """判断 If-None-Match 是否命中（按 RFC 9110 使用弱比较，忽略 W/ 前缀）"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(
+        candidate.strip().removeprefix("W/") == etag
+        for candidate in if_none_match.split(",")
+    )
+
+
+def etag_headers(etag: str) -> Dict[str, str]:
+    """响应中携带的缓存相关头"""
+    return {"ETag": etag, "Cache-Control": CACHE_CONTROL}
+
+
+def not_modified(etag: str) -> Response:
+    """304 响应，不含响应体"""
+    return Response(status_code=304, headers=etag_headers(etag))
+
+
+def expenses_version(expenses: List[Dict[str, Any]]) -> Tuple[int, Optional[str]]:
+    """从已加载的费用行计算版本，与 SupabaseService.get_expenses_version 结果一致"""
+    latest = max((exp.get("updated_at") or "" for exp in expenses), default=None)
+    return len(expenses), latest or None
+
+
+def _trip_row_part(trip_id: str, updated_at: Optional[str], fields: Optional[str]) -> str:
+    # 稀疏字段是不同的表示，ETag 也要区分
+    if fields:
+        return _digest("trip", trip_id, updated_at, fields)
+    return _digest("trip", trip_id, updated_at)
+
+
+def _trip_etag_parts(candidate: str) -> Tuple[str, str]:
+    content, _, row = candidate.strip().removeprefix("W/").strip('"').partition(".")
+    return content, row
+
+
+def trip_etag(
+    trip_id: str, edited_at: Optional[str], updated_at: Optional[str], fields: Optional[str] = None
+) -> str:
+    """
+    行程的 ETag："<内容版本>.<行版本>"
+
+    内容版本由 edited_at 计算，只随用户的修改变化，PATCH 的 If-Match 只比较这一部分；
+    行版本由 updated_at 计算，后台写回路线时也会变化，条件 GET 比较这一部分，
+    路线算好后客户端能取到新的表示，手中的 If-Match 仍然有效。
+    """
+    return '"' + _digest("trip-content", trip_id, edited_at) + "." + _trip_row_part(trip_id, updated_at, fields) + '"'
+
+
+def trip_not_modified_etag(
+    if_none_match: Optional[str], trip_id: str, updated_at: Optional[str], fields: Optional[str] = None
+) -> Optional[str]:
+    """If-None-Match 中行版本与当前一致的 ETag（行版本相同则内容版本必然相同，可直接用于 304）"""
+    if not if_none_match:
+        return None
+    row = _trip_row_part(trip_id, updated_at, fields)
+    for candidate in if_none_match.split(","):
+        content, candidate_row = _trip_etag_parts(candidate)
+        if content and candidate_row == row:
+            return f'"{content}.{row}"'
+    return None
+
+
+def trip_content_matches(if_match: str, trip_id: str, edited_at: Optional[str]) -> bool:
+    """If-Match 是否与行程当前的内容版本一致（不比较行版本）"""
+    if if_match.strip() == "*":
+        return True
+    content = _digest("trip-content", trip_id, edited_at)
+    return any(_trip_etag_parts(candidate)[0] == content for candidate in if_match.split(","))
+
+
+def expenses_etag(trip_id: str, version: Tuple[int, Optional[str]], *extra: Any) -> str:
+    return make_etag("expenses", trip_id, *version, *extra)
+
+
+def summary_etag(trip_id: str, trip_updated_at: Optional[str], version: Tuple[int, Optional[str]]) -> str:
+    return make_etag("summary", trip_id, trip_updated_at, *version)
+
+
+def analytics_etag(trip_id: str, trip_updated_at: Optional[str], version: Tuple[int, Optional[str]], as_of: Any) -> str:
+    # 分析结果还取决于"今天"是哪一天
+    return make_etag("analytics", trip_id, trip_updated_at, *version, as_of)
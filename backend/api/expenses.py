@@ -1,25 +1,51 @@
-from fastapi import APIRouter, HTTPException, Header
-from typing import List
-from models.schemas import ExpenseCreate, Expense, ExpenseSummary, ApiResponse
+from fastapi import APIRouter, HTTPException, Header, Query, Request
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from pydantic import ValidationError
+from typing import Any, AsyncIterator, Dict, List, Optional
+from models.schemas import (
+    ExpenseCreate, Expense, ExpenseSummary, ExpenseAnalytics, ApiResponse, BulkExpenseResponse
+)
 from services.supabase_service import supabase_service
 from services.ai_service import ai_service
-from datetime import datetime
-import json
+from services.pagination import CountMethod, InvalidCursorError
+from services.dataloader import RequestLoaders
+from services.expense_analytics import compute_expense_analytics
+from services.expense_events import expense_events
+from services.idempotency import idempotency_store, IDEMPOTENCY_KEY_DESCRIPTION
+from services.disconnect import cancel_on_disconnect
+from services.deadline import DeadlineExceeded
+from config import settings
+from models.serialization import expense_row_to_dict, construct_trip_plan
+from api.etag import (
+    etag_matches, etag_headers, not_modified, expenses_version, expenses_etag, summary_etag,
+    analytics_etag
+)
+from datetime import date, datetime
+import asyncio
+import codecs
+import csv
+import orjson
 
 router = APIRouter()
 
+BULK_INSERT_CHUNK_SIZE = 1000
+MAX_BULK_ERRORS = 200
+CSV_COLUMNS = ("trip_id", "category", "amount", "description", "date", "location", "notes")
 
-def get_user_id_from_token(authorization: str) -> str:
+
+async def get_user_id_from_token(authorization: str) -> str:
     """从 token 中提取用户 ID"""
     if not authorization or not authorization.startswith("Bearer "):
         raise HTTPException(status_code=401, detail="未提供有效的认证信息")
     
     token = authorization.replace("Bearer ", "")
     try:
-        user = supabase_service.client.auth.get_user(token)
+        user = await supabase_service.get_user(token)
         if user and user.user:
             return user.user.id
         raise HTTPException(status_code=401, detail="无效的认证信息")
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         raise HTTPException(status_code=401, detail="认证失败")
 
@@ -27,11 +53,18 @@ def get_user_id_from_token(authorization: str) -> str:
 @router.post("/", response_model=Expense)
 async def create_expense(
     expense: ExpenseCreate,
-    authorization: str = Header(None)
+    request: Request,
+    authorization: str = Header(None),
+    idempotency_key: Optional[str] = Header(None, description=IDEMPOTENCY_KEY_DESCRIPTION)
 ):
     """创建费用记录"""
-    user_id = get_user_id_from_token(authorization)
-    
+    user_id = await get_user_id_from_token(authorization)
+    return await idempotency_store.run(
+        request, user_id, idempotency_key, lambda: _create_expense(expense, user_id)
+    )
+
+
+async def _create_expense(expense: ExpenseCreate, user_id: str):
     try:
         expense_data = expense.model_dump()
         expense_data["user_id"] = user_id
@@ -40,28 +73,214 @@ async def create_expense(
         created_expense = await supabase_service.create_expense(expense_data)
         
         if created_expense:
-            return Expense(**created_expense)
+            await expense_events.publish_change("expense.created", None, created_expense)
+            return ORJSONResponse(expense_row_to_dict(created_expense))
         else:
             raise HTTPException(status_code=500, detail="创建费用记录失败")
     
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"创建费用记录失败: {str(e)}")
 
 
+async def _iter_csv_rows(request: Request) -> AsyncIterator[Dict[str, str]]:
+    """
+    流式解析 CSV 请求体（UTF-8，可带 BOM），首行为表头
+    引号内的换行会被拼回同一条记录
+    """
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    header = None
+    text = ""
+    record = ""
+    
+    async def records(final: bool):
+        nonlocal text, record
+        *lines, text = text.split("\n")
+        if final and text:
+            lines.append(text)
+            text = ""
+        for line in lines:
+            record += line + "\n"
+            if record.count('"') % 2 == 0:
+                row, record = next(csv.reader([record]), []), ""
+                yield row
+    
+    async def to_dicts(final: bool):
+        nonlocal header
+        async for row in records(final):
+            if not any(cell.strip() for cell in row):
+                continue
+            if header is None:
+                header = [name.strip().lower() for name in row]
+                continue
+            yield dict(zip(header, row))
+    
+    async for chunk in request.stream():
+        text += decoder.decode(chunk)
+        async for row in to_dicts(False):
+            yield row
+    text += decoder.decode(b"", final=True)
+    async for row in to_dicts(True):
+        yield row
+
+
+@router.post("/bulk", response_model=BulkExpenseResponse)
+async def create_expenses_bulk(
+    request: Request,
+    authorization: str = Header(None),
+    trip_id: Optional[str] = Query(None, description="未指定 trip_id 的行归入该行程")
+):
+    """
+    批量创建费用记录
+    
+    请求体为 JSON 数组，或 Content-Type 为 text/csv 的 CSV（表头包含
+    category, amount, description, date，可选 trip_id, location, notes）。
+    每行用 ExpenseCreate 校验，每个行程只校验一次归属，按批次多行插入；
+    不合法的行不会阻止其余行写入，错误按行号返回。
+    """
+    user_id = await get_user_id_from_token(authorization)
+    
+    content_type = request.headers.get("content-type", "")
+    is_csv = "csv" in content_type
+    if not is_csv:
+        try:
+            items = orjson.loads(await request.body())
+        except orjson.JSONDecodeError:
+            raise HTTPException(status_code=400, detail="请求体不是合法的 JSON")
+        if not isinstance(items, list):
+            raise HTTPException(status_code=400, detail="请求体必须是 JSON 数组")
+    
+    loaders = RequestLoaders(user_id)
+    pending: List[Dict[str, Any]] = []
+    errors: List[Dict[str, Any]] = []
+    error_count = 0
+    inserted = 0
+    
+    def add_error(row_no: int, message: Any) -> None:
+        nonlocal error_count
+        error_count += 1
+        if len(errors) < MAX_BULK_ERRORS:
+            errors.append({"row": row_no, "error": message})
+    
+    async def flush() -> None:
+        nonlocal pending, inserted
+        batch, pending = pending, []
+        if not batch:
+            return
+        try:
+            created = await supabase_service.create_expenses_bulk([row for _, row in batch])
+            inserted += len(created)
+        except Exception as e:
+            for row_no, _ in batch:
+                add_error(row_no, f"写入失败: {str(e)}")
+            return
+        await expense_events.publish_bulk(created)
+    
+    async def add(row_no: int, item: Any) -> None:
+        if not isinstance(item, dict):
+            add_error(row_no, "每一行必须是对象")
+            return
+        if not item.get("trip_id"):
+            item = {**item, "trip_id": trip_id}
+        if is_csv:
+            # CSV 中的空单元格视为未填写
+            item = {key: value for key, value in item.items() if value not in ("", None)}
+        try:
+            expense = ExpenseCreate.model_validate(item)
+        except ValidationError as e:
+            add_error(row_no, e.errors(include_url=False, include_context=False))
+            return
+        
+        # 每个行程只查询一次归属
+        try:
+            version = await loaders.trip_version.load(expense.trip_id)
+        except Exception:
+            version = None
+        if version is None:
+            add_error(row_no, f"行程不存在: {expense.trip_id}")
+            return
+        
+        row = expense.model_dump(mode="json")
+        row["user_id"] = user_id
+        pending.append((row_no, row))
+        if len(pending) >= BULK_INSERT_CHUNK_SIZE:
+            await flush()
+    
+    if is_csv:
+        row_no = 0
+        async for item in _iter_csv_rows(request):
+            row_no += 1
+            await add(row_no, {key: item.get(key) for key in CSV_COLUMNS if key in item})
+    else:
+        # JSON 数组事先知道全部行程，一次 in_() 查询完成归属校验
+        trip_ids = {
+            item.get("trip_id") or trip_id for item in items if isinstance(item, dict)
+        }
+        try:
+            await loaders.trip_version.load_many([t for t in trip_ids if isinstance(t, str)])
+        except Exception:
+            pass  # 逐行校验时会重新查询
+        for row_no, item in enumerate(items, start=1):
+            await add(row_no, item)
+    await flush()
+    
+    return BulkExpenseResponse(
+        success=error_count == 0,
+        inserted=inserted,
+        error_count=error_count,
+        errors=errors
+    )
+
+
 @router.get("/trip/{trip_id}", response_model=List[Expense])
 async def get_trip_expenses(
     trip_id: str,
-    authorization: str = Header(None)
+    authorization: str = Header(None),
+    limit: Optional[int] = Query(None, ge=1, le=500, description="分页大小，不传则返回全部"),
+    cursor: Optional[str] = Query(None, description="上一页返回的 X-Next-Cursor"),
+    count: Optional[CountMethod] = Query(None, description="返回总数：exact / planned / estimated"),
+    if_none_match: Optional[str] = Header(None)
 ):
-    """获取指定行程的所有费用记录"""
-    user_id = get_user_id_from_token(authorization)
+    """
+    获取指定行程的所有费用记录
+    传入 limit 时按 (created_at, id) 游标分页，下一页游标和总数通过
+    X-Next-Cursor / X-Total-Count 响应头返回；支持 ETag 条件请求
+    """
+    user_id = await get_user_id_from_token(authorization)
     
     try:
-        expenses_data = await supabase_service.get_trip_expenses(trip_id, user_id)
+        # 分页结果的 ETag 同时取决于费用版本和分页参数
+        etag = None
+        if if_none_match or limit is not None:
+            version = await supabase_service.get_expenses_version(trip_id, user_id)
+            etag = expenses_etag(trip_id, version, limit, cursor, count)
+            if etag_matches(if_none_match, etag):
+                return not_modified(etag)
+        
+        headers = {}
+        if limit is None:
+            expenses_data = await supabase_service.get_trip_expenses(trip_id, user_id)
+            etag = etag or expenses_etag(trip_id, expenses_version(expenses_data), None, None, None)
+        else:
+            expenses_data, next_cursor, total = await supabase_service.get_trip_expenses_page(
+                trip_id, user_id, limit, cursor, count
+            )
+            if next_cursor:
+                headers["X-Next-Cursor"] = next_cursor
+            if total is not None:
+                headers["X-Total-Count"] = str(total)
+        headers.update(etag_headers(etag))
         
-        expenses = [Expense(**exp_data) for exp_data in expenses_data]
-        return expenses
+        return ORJSONResponse(
+            [expense_row_to_dict(exp_data) for exp_data in expenses_data],
+            headers=headers
+        )
     
+    except InvalidCursorError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"获取费用记录失败: {str(e)}")
 
@@ -69,31 +288,38 @@ async def get_trip_expenses(
 @router.get("/trip/{trip_id}/summary", response_model=ExpenseSummary)
 async def get_expense_summary(
     trip_id: str,
-    authorization: str = Header(None)
+    authorization: str = Header(None),
+    if_none_match: Optional[str] = Header(None)
 ):
-    """获取行程费用统计"""
-    user_id = get_user_id_from_token(authorization)
+    """获取行程费用统计（支持 ETag 条件请求）"""
+    user_id = await get_user_id_from_token(authorization)
+    loaders = RequestLoaders(user_id)
     
     try:
-        # 获取行程信息
-        trip_data = await supabase_service.get_trip(trip_id, user_id)
+        # 统计结果只取决于行程（预算、天数）和费用的版本
+        if if_none_match:
+            trip_updated_at, version = await asyncio.gather(
+                loaders.trip_version.load(trip_id),
+                loaders.expenses_version.load(trip_id)
+            )
+            if trip_updated_at is None:
+                raise HTTPException(status_code=404, detail="行程不存在")
+            etag = summary_etag(trip_id, trip_updated_at, version)
+            if etag_matches(if_none_match, etag):
+                return not_modified(etag)
+        
+        # 行程信息和统计数据并发读取；统计由数据库汇总表给出，不再加载费用明细
+        trip_data, totals = await asyncio.gather(
+            loaders.trip.load(trip_id),
+            loaders.expense_totals.load(trip_id)
+        )
         if not trip_data:
             raise HTTPException(status_code=404, detail="行程不存在")
         
-        # 获取所有费用记录
-        expenses_data = await supabase_service.get_trip_expenses(trip_id, user_id)
-        
-        # 计算统计数据
-        total_spent = sum(exp["amount"] for exp in expenses_data)
+        total_spent = totals["total_spent"]
         budget = trip_data.get("budget", 0)
         remaining = budget - total_spent
         
-        # 按类别统计
-        by_category = {}
-        for exp in expenses_data:
-            category = exp["category"]
-            by_category[category] = by_category.get(category, 0) + exp["amount"]
-        
         # 计算日均花费
         if isinstance(trip_data.get("total_days"), (int, float)):
             total_days = trip_data["total_days"]
@@ -101,14 +327,19 @@ async def get_expense_summary(
             total_days = 1
         daily_average = total_spent / max(total_days, 1)
         
-        return ExpenseSummary(
+        summary = ExpenseSummary(
             trip_id=trip_id,
             total_spent=total_spent,
             budget=budget,
             remaining=remaining,
-            by_category=by_category,
-            daily_average=daily_average
+            by_category=totals["by_category"],
+            daily_average=daily_average,
+            expense_count=totals["expense_count"],
+            by_day=totals["by_day"]
         )
+        version = (totals["expense_count"], totals["last_updated_at"])
+        etag = summary_etag(trip_id, trip_data.get("updated_at"), version)
+        return ORJSONResponse(summary.model_dump(), headers=etag_headers(etag))
     
     except HTTPException:
         raise
@@ -116,6 +347,110 @@ async def get_expense_summary(
         raise HTTPException(status_code=500, detail=f"获取费用统计失败: {str(e)}")
 
 
+@router.get("/trip/{trip_id}/events")
+async def subscribe_expense_events(
+    trip_id: str,
+    authorization: str = Header(None)
+):
+    """
+    订阅行程的费用变更（Server-Sent Events）
+
+    连接后先推送一条 snapshot（当前统计），之后每次费用新增、修改、删除
+    推送变更的费用和统计增量（格式见 services/expense_events.py）；
+    收到 resync 时客户端应重新拉取统计（读快照期间有变更时紧跟快照发送）。空闲时定期发送注释行保持连接。
+    token 只接受 Authorization 头（不放在 URL 中，避免出现在访问日志和浏览器历史里），
+    浏览器端用 fetch 读取事件流。
+    """
+    user_id = await get_user_id_from_token(authorization)
+    
+    try:
+        if await supabase_service.get_trip_version(trip_id, user_id) is None:
+            raise HTTPException(status_code=404, detail="行程不存在")
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"订阅费用变更失败: {str(e)}")
+    
+    async def stream():
+        # 先订阅再读快照，保证快照之后的变更不会丢失
+        async with expense_events.subscribe(trip_id) as queue:
+            yield b"retry: 3000\n\n"
+            totals = await supabase_service.get_expense_totals(trip_id, user_id)
+            yield b"data: " + orjson.dumps({"type": "snapshot", "trip_id": trip_id, "summary": totals}) + b"\n\n"
+            # 读快照期间到达的变更可能已经计入快照，不能再作为增量发出（会重复累加）；
+            # 丢弃这些事件并让客户端重新拉取统计
+            if not queue.empty():
+                while not queue.empty():
+                    queue.get_nowait()
+                yield b"data: " + orjson.dumps({"type": "resync", "trip_id": trip_id}) + b"\n\n"
+            while True:
+                try:
+                    payload = await asyncio.wait_for(
+                        queue.get(), timeout=settings.expense_events_heartbeat_seconds
+                    )
+                except asyncio.TimeoutError:
+                    yield b": ping\n\n"
+                    continue
+                yield b"data: " + payload + b"\n\n"
+    
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@router.get("/trip/{trip_id}/analytics", response_model=ExpenseAnalytics)
+async def get_expense_analytics(
+    trip_id: str,
+    authorization: str = Header(None),
+    as_of: Optional[date] = Query(None, description="以哪一天为今天，默认当天"),
+    if_none_match: Optional[str] = Header(None)
+):
+    """
+    费用时间序列分析：按天、按类别的花费，累计消耗对比折算预算，
+    以及按已过天数日均预测的行程总花费（支持 ETag 条件请求）
+    """
+    user_id = await get_user_id_from_token(authorization)
+    loaders = RequestLoaders(user_id)
+    as_of = as_of or date.today()
+    
+    try:
+        if if_none_match:
+            trip_updated_at, version = await asyncio.gather(
+                loaders.trip_version.load(trip_id),
+                loaders.expenses_version.load(trip_id)
+            )
+            if trip_updated_at is None:
+                raise HTTPException(status_code=404, detail="行程不存在")
+            etag = analytics_etag(trip_id, trip_updated_at, version, as_of)
+            if etag_matches(if_none_match, etag):
+                return not_modified(etag)
+        
+        trip_data, expenses_data = await asyncio.gather(
+            loaders.trip.load(trip_id),
+            loaders.expenses.load(trip_id)
+        )
+        if not trip_data:
+            raise HTTPException(status_code=404, detail="行程不存在")
+        
+        analytics = compute_expense_analytics(
+            expenses_data,
+            trip_data["start_date"],
+            trip_data["end_date"],
+            trip_data.get("budget", 0),
+            as_of
+        )
+        analytics["trip_id"] = trip_id
+        etag = analytics_etag(trip_id, trip_data.get("updated_at"), expenses_version(expenses_data), as_of)
+        return ORJSONResponse(analytics, headers=etag_headers(etag))
+    
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"获取费用分析失败: {str(e)}")
+
+
 @router.put("/{expense_id}", response_model=Expense)
 async def update_expense(
     expense_id: str,
@@ -123,18 +458,23 @@ async def update_expense(
     authorization: str = Header(None)
 ):
     """更新费用记录"""
-    user_id = get_user_id_from_token(authorization)
+    user_id = await get_user_id_from_token(authorization)
     
     try:
         update_data = expense_update.model_dump()
         update_data["date"] = update_data["date"].isoformat()
         
+        # 先读出旧值，用于计算推送给订阅者的统计增量
+        old_expense = await supabase_service.get_expense(expense_id, user_id)
+        if not old_expense:
+            raise HTTPException(status_code=404, detail="费用记录不存在或更新失败")
         updated_expense = await supabase_service.update_expense(expense_id, user_id, update_data)
         
         if not updated_expense:
             raise HTTPException(status_code=404, detail="费用记录不存在或更新失败")
         
-        return Expense(**updated_expense)
+        await expense_events.publish_change("expense.updated", old_expense, updated_expense)
+        return ORJSONResponse(expense_row_to_dict(updated_expense))
     
     except HTTPException:
         raise
@@ -148,12 +488,13 @@ async def delete_expense(
     authorization: str = Header(None)
 ):
     """删除费用记录"""
-    user_id = get_user_id_from_token(authorization)
+    user_id = await get_user_id_from_token(authorization)
     
     try:
-        success = await supabase_service.delete_expense(expense_id, user_id)
+        deleted_expense = await supabase_service.delete_expense(expense_id, user_id)
         
-        if success:
+        if deleted_expense:
+            await expense_events.publish_change("expense.deleted", deleted_expense, None)
             return ApiResponse(success=True, message="费用记录删除成功")
         else:
             raise HTTPException(status_code=404, detail="费用记录不存在")
@@ -167,29 +508,32 @@ async def delete_expense(
 @router.post("/trip/{trip_id}/analyze")
 async def analyze_trip_budget(
     trip_id: str,
-    authorization: str = Header(None)
+    request: Request,
+    authorization: str = Header(None),
+    idempotency_key: Optional[str] = Header(None, description=IDEMPOTENCY_KEY_DESCRIPTION)
 ):
-    """AI 分析行程预算使用情况"""
-    user_id = get_user_id_from_token(authorization)
+    """AI 分析行程预算使用情况（客户端断开时停止分析）"""
+    user_id = await get_user_id_from_token(authorization)
+    return await idempotency_store.run(
+        request, user_id, idempotency_key,
+        lambda: cancel_on_disconnect(request, _analyze_trip_budget(trip_id, user_id))
+    )
+
+
+async def _analyze_trip_budget(trip_id: str, user_id: str):
+    loaders = RequestLoaders(user_id)
     
     try:
-        # 获取行程信息
-        trip_data = await supabase_service.get_trip(trip_id, user_id)
+        # 并发获取行程信息和实际花费
+        trip_data, totals = await asyncio.gather(
+            loaders.trip.load(trip_id),
+            loaders.expense_totals.load(trip_id)
+        )
         if not trip_data:
             raise HTTPException(status_code=404, detail="行程不存在")
         
-        # 解析 JSON 字段
-        if isinstance(trip_data.get("daily_itineraries"), str):
-            trip_data["daily_itineraries"] = json.loads(trip_data["daily_itineraries"])
-        if isinstance(trip_data.get("accommodations"), str):
-            trip_data["accommodations"] = json.loads(trip_data["accommodations"])
-        
-        from models.schemas import TripPlan
-        trip_plan = TripPlan(**trip_data)
-        
-        # 获取实际花费
-        expenses_data = await supabase_service.get_trip_expenses(trip_id, user_id)
-        total_spent = sum(exp["amount"] for exp in expenses_data)
+        trip_plan = construct_trip_plan(trip_data)
+        total_spent = totals["total_spent"]
         
         # 使用 AI 分析
         analysis = await ai_service.analyze_budget(trip_plan, total_spent)
@@ -1,10 +1,12 @@
 """
 地图相关 API
 """
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Request
 from typing import List, Optional
 from pydantic import BaseModel
 from services.map_service import map_service
+from services.poi_index import poi_index
+from services.disconnect import cancel_on_disconnect
 from api.auth import get_current_user
 
 router = APIRouter(prefix="/maps", tags=["maps"])
@@ -52,12 +54,13 @@ class RouteResponse(BaseModel):
 @router.post("/geocode", response_model=GeocodeResponse)
 async def geocode_address(
     request: GeocodeRequest,
+    http_request: Request,
     current_user: dict = Depends(get_current_user)
 ):
     """
     地理编码：地址 -> 经纬度
     """
-    result = await map_service.geocode(request.address, request.city)
+    result = await cancel_on_disconnect(http_request, map_service.geocode(request.address, request.city))
     if not result:
         raise HTTPException(status_code=404, detail="无法找到该地址的坐标")
     return result
@@ -66,28 +69,32 @@ async def geocode_address(
 @router.post("/search", response_model=List[POIResponse])
 async def search_poi(
     request: POISearchRequest,
+    http_request: Request,
     current_user: dict = Depends(get_current_user)
 ):
     """
-    搜索 POI（景点、餐厅等）
+    搜索 POI（景点、餐厅等），指定城市时使用 POI 缓存
     """
-    results = await map_service.search_poi(request.keyword, request.city, request.limit)
+    results = await cancel_on_disconnect(
+        http_request, poi_index.search(request.keyword, request.city, request.limit)
+    )
     return results
 
 
 @router.post("/route", response_model=RouteResponse)
 async def get_route(
     request: RouteRequest,
+    http_request: Request,
     current_user: dict = Depends(get_current_user)
 ):
     """
     路线规划
     """
-    result = await map_service.get_route(
+    result = await cancel_on_disconnect(http_request, map_service.get_route(
         (request.origin_lng, request.origin_lat),
         (request.dest_lng, request.dest_lat),
         request.strategy
-    )
+    ))
     if not result:
         raise HTTPException(status_code=404, detail="无法规划路线")
     return result
@@ -1,81 +1,127 @@
-from fastapi import APIRouter, HTTPException, Header, Query
-from typing import Optional
-from models.schemas import TripPlanRequest, TripPlan, ApiResponse, TripListResponse
+from fastapi import APIRouter, HTTPException, Header, Query, Request
+from pydantic import ValidationError
+from fastapi.responses import ORJSONResponse
+from typing import Optional, List, Dict, Any
+from models.schemas import TripPlanRequest, TripPlan, ApiResponse, TripListResponse, JsonPatchOperation
 from services.supabase_service import supabase_service
 from services.ai_service import ai_service
+from services.pagination import CountMethod, InvalidCursorError
+from services.idempotency import idempotency_store, IDEMPOTENCY_KEY_DESCRIPTION
+from services.disconnect import cancel_on_disconnect
+from services.deadline import DeadlineExceeded
+from services.route_geometry import invalidate_stale_routes, route_geometry, routes_pending
+from models.serialization import (
+    trip_row_to_dict, dumps_json_field, parse_fields, select_fields, TRIP_JSON_FIELDS
+)
+from api.etag import (
+    etag_headers, not_modified, trip_content_matches, trip_etag, trip_not_modified_etag
+)
+from config import settings
+from logging_config import should_sample
 from datetime import datetime
-import json
+import logging
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
 
+# PATCH 可以修改的顶层字段；id、user_id 和时间戳由服务端维护
+PATCHABLE_TRIP_FIELDS = {
+    "title", "destination", "start_date", "end_date", "total_days", "budget", "travelers",
+    "preferences", "has_children", "daily_itineraries", "accommodations",
+    "estimated_costs", "total_estimated_cost",
+}
 
-def get_user_id_from_token(authorization: Optional[str]) -> str:
+
+async def get_user_id_from_token(authorization: Optional[str]) -> str:
     """从 token 中提取用户 ID"""
     if not authorization or not authorization.startswith("Bearer "):
         raise HTTPException(status_code=401, detail="未提供有效的认证信息")
     
     token = authorization.replace("Bearer ", "")
     try:
-        user = supabase_service.client.auth.get_user(token)
+        user = await supabase_service.get_user(token)
         if user and user.user:
             return user.user.id
         raise HTTPException(status_code=401, detail="无效的认证信息")
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         raise HTTPException(status_code=401, detail="认证失败")
 
 
+FIELDS_DESCRIPTION = "只返回指定字段，逗号分隔，支持嵌套，如 id,title,daily_itineraries.attractions.name"
+
+
+def get_field_tree(fields: Optional[str]) -> Dict[str, Any]:
+    """解析并校验 ?fields= 参数"""
+    if not fields:
+        return {}
+    tree = parse_fields(fields)
+    unknown = set(tree) - set(TripPlan.model_fields)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"未知字段: {', '.join(sorted(unknown))}")
+    return tree
+
+
 @router.post("/plan", response_model=TripPlan)
 async def create_trip_plan(
     request: TripPlanRequest,
-    authorization: str = Header(None)
+    http_request: Request,
+    authorization: str = Header(None),
+    idempotency_key: Optional[str] = Header(None, description=IDEMPOTENCY_KEY_DESCRIPTION)
 ):
     """
     创建新的旅行计划
-    使用 AI 根据用户需求自动生成详细的行程规划
+    使用 AI 根据用户需求自动生成详细的行程规划；客户端断开时停止生成，不保存行程
     """
-    user_id = get_user_id_from_token(authorization)
-    
+    user_id = await get_user_id_from_token(authorization)
+    return await idempotency_store.run(
+        http_request, user_id, idempotency_key,
+        lambda: cancel_on_disconnect(http_request, _generate_trip_plan(request, user_id))
+    )
+
+
+async def _generate_trip_plan(request: TripPlanRequest, user_id: str):
+    """生成行程计划并保存"""
     try:
         # 使用 AI 生成行程计划
-        print("=" * 80)
-        print("🤖 开始生成行程计划...")
-        print(f"📍 目的地: {request.destination}")
-        print(f"📅 日期: {request.start_date} ~ {request.end_date}")
-        print(f"💰 预算: ¥{request.budget}")
-        print(f"👥 人数: {request.travelers}")
-        print("=" * 80)
+        logger.info("开始生成行程计划", extra={
+            "destination": request.destination,
+            "start_date": request.start_date,
+            "end_date": request.end_date,
+            "budget": request.budget,
+            "travelers": request.travelers,
+        })
         
         trip_plan = await ai_service.generate_trip_plan(request, user_id)
         
-        # 打印生成的行程计划
-        print("\n" + "=" * 80)
-        print("✅ 行程计划生成成功！")
-        print("=" * 80)
-        print(f"📝 标题: {trip_plan.title}")
-        print(f"📍 目的地: {trip_plan.destination}")
-        print(f"📅 行程天数: {trip_plan.total_days} 天")
-        print(f"💰 总预算: ¥{trip_plan.budget}")
-        print(f"💵 预估花费: ¥{trip_plan.total_estimated_cost}")
-        print("\n📊 费用明细:")
-        for category, cost in trip_plan.estimated_costs.items():
-            print(f"  - {category}: ¥{cost}")
-        
-        print(f"\n🗓️ 每日行程 ({len(trip_plan.daily_itineraries)} 天):")
-        for day in trip_plan.daily_itineraries:
-            print(f"\n  第 {day.day} 天 ({day.date}):")
-            print(f"    🎯 景点数量: {len(day.attractions)}")
-            for attr in day.attractions:
-                print(f"      - {attr.name} (¥{attr.estimated_cost})")
-            print(f"    🍽️ 餐厅数量: {len(day.restaurants)}")
-            for rest in day.restaurants:
-                print(f"      - {rest.name} ({rest.cuisine_type})")
-            print(f"    🚗 交通数量: {len(day.transportation)}")
-        
-        print(f"\n🏨 住宿 ({len(trip_plan.accommodations)} 个):")
-        for acc in trip_plan.accommodations:
-            print(f"  - {acc.name} ({acc.type}): ¥{acc.estimated_cost}")
-        
-        print("=" * 80 + "\n")
+        logger.info("行程计划生成成功", extra={
+            "title": trip_plan.title,
+            "total_days": trip_plan.total_days,
+            "total_estimated_cost": trip_plan.total_estimated_cost,
+            "attractions": sum(len(day.attractions) for day in trip_plan.daily_itineraries),
+            "restaurants": sum(len(day.restaurants) for day in trip_plan.daily_itineraries),
+            "accommodations": len(trip_plan.accommodations),
+        })
+        # 完整明细体积大，只按比例采样输出
+        if logger.isEnabledFor(logging.INFO) and should_sample(settings.log_plan_dump_sample_rate):
+            logger.info("行程计划明细", extra={
+                "estimated_costs": trip_plan.estimated_costs,
+                "days": [
+                    {
+                        "day": day.day,
+                        "date": day.date,
+                        "attractions": [{"name": a.name, "estimated_cost": a.estimated_cost} for a in day.attractions],
+                        "restaurants": [{"name": r.name, "cuisine_type": r.cuisine_type} for r in day.restaurants],
+                        "transportation": len(day.transportation),
+                    }
+                    for day in trip_plan.daily_itineraries
+                ],
+                "accommodations": [
+                    {"name": a.name, "type": a.type, "estimated_cost": a.estimated_cost}
+                    for a in trip_plan.accommodations
+                ],
+            })
         
         # 保存到数据库
         trip_data = trip_plan.model_dump(exclude={'id'})  # 排除 id 字段
@@ -83,21 +129,26 @@ async def create_trip_plan(
         trip_data["updated_at"] = datetime.utcnow().isoformat()
         
         # 将复杂对象转换为 JSON 字符串
-        trip_data["daily_itineraries"] = json.dumps([d.model_dump() for d in trip_plan.daily_itineraries], default=str, ensure_ascii=False)
-        trip_data["accommodations"] = json.dumps([a.model_dump() for a in trip_plan.accommodations], default=str, ensure_ascii=False)
+        trip_data["daily_itineraries"] = dumps_json_field(trip_plan.daily_itineraries)
+        trip_data["accommodations"] = dumps_json_field(trip_plan.accommodations)
         trip_data["preferences"] = [p.value for p in trip_plan.preferences]
         
-        print("💾 正在保存到数据库...")
         saved_trip = await supabase_service.create_trip(trip_data)
         
         if saved_trip:
             trip_plan.id = saved_trip["id"]
-            print(f"✅ 保存成功！行程 ID: {saved_trip['id']}\n")
-            return trip_plan
+            logger.info("行程已保存", extra={"trip_id": saved_trip["id"]})
+            # 每天的路线在后台计算，完成后随行程保存
+            route_geometry.schedule(saved_trip["id"], user_id)
+            # AI 结果在构建 TripPlan 时已校验，直接输出避免二次校验
+            return ORJSONResponse(trip_plan.model_dump(mode="json"))
         else:
             raise HTTPException(status_code=500, detail="保存行程失败")
     
+    except DeadlineExceeded:
+        raise
     except Exception as e:
+        logger.exception("生成行程失败")
         raise HTTPException(status_code=500, detail=f"生成行程失败: {str(e)}")
 
 
@@ -105,27 +156,28 @@ async def create_trip_plan(
 async def get_trips(
     authorization: str = Header(None),
     limit: int = Query(50, ge=1, le=100),
-    offset: int = Query(0, ge=0)
+    cursor: Optional[str] = Query(None, description="上一页返回的 next_cursor"),
+    count: Optional[CountMethod] = Query(None, description="返回总数：exact / planned / estimated"),
+    fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION)
 ):
-    """获取用户的所有旅行计划"""
-    user_id = get_user_id_from_token(authorization)
+    """获取用户的所有旅行计划（游标分页）"""
+    user_id = await get_user_id_from_token(authorization)
+    field_tree = get_field_tree(fields)
     
     try:
-        trips_data = await supabase_service.get_user_trips(user_id, limit, offset)
-        
-        # 解析 JSON 字段
-        trips = []
-        for trip_data in trips_data:
-            # 解析 JSON 字符串字段
-            if isinstance(trip_data.get("daily_itineraries"), str):
-                trip_data["daily_itineraries"] = json.loads(trip_data["daily_itineraries"])
-            if isinstance(trip_data.get("accommodations"), str):
-                trip_data["accommodations"] = json.loads(trip_data["accommodations"])
-            
-            trips.append(TripPlan(**trip_data))
-        
-        return TripListResponse(trips=trips, total=len(trips))
+        trips_data, next_cursor, total = await supabase_service.get_user_trips(user_id, limit, cursor, count)
+        
+        # 数据库中的行是可信数据，跳过模型重建和响应校验
+        return ORJSONResponse({
+            "trips": [select_fields(trip_row_to_dict(trip_data), field_tree) for trip_data in trips_data],
+            "total": total,
+            "next_cursor": next_cursor,
+        })
     
+    except InvalidCursorError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"获取行程列表失败: {str(e)}")
 
@@ -133,24 +185,36 @@ async def get_trips(
 @router.get("/{trip_id}", response_model=TripPlan)
 async def get_trip(
     trip_id: str,
-    authorization: str = Header(None)
+    authorization: str = Header(None),
+    if_none_match: Optional[str] = Header(None),
+    fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION)
 ):
-    """获取单个旅行计划详情"""
-    user_id = get_user_id_from_token(authorization)
+    """获取单个旅行计划详情（支持 ETag 条件请求和稀疏字段）"""
+    user_id = await get_user_id_from_token(authorization)
+    field_tree = get_field_tree(fields)
     
     try:
-        trip_data = await supabase_service.get_trip(trip_id, user_id)
+        # 先只查 updated_at：客户端带了 ETag 且未变化则直接返回 304；
+        # 否则用它校验缓存的行，保证返回的内容和 ETag 都是数据库中的当前版本
+        updated_at = await supabase_service.get_trip_version(trip_id, user_id)
+        if updated_at is None:
+            raise HTTPException(status_code=404, detail="行程不存在")
+        etag = trip_not_modified_etag(if_none_match, trip_id, updated_at, fields)
+        if etag:
+            return not_modified(etag)
+        
+        trip_data = await supabase_service.get_trip(trip_id, user_id, version=updated_at)
         
         if not trip_data:
             raise HTTPException(status_code=404, detail="行程不存在")
+        # 还没有路线（如导入的行程）或有失败路段到了重试时间的天在后台补算
+        if routes_pending(trip_data.get("daily_itineraries") or []):
+            route_geometry.schedule(trip_id, user_id, if_idle=True)
         
-        # 解析 JSON 字符串字段
-        if isinstance(trip_data.get("daily_itineraries"), str):
-            trip_data["daily_itineraries"] = json.loads(trip_data["daily_itineraries"])
-        if isinstance(trip_data.get("accommodations"), str):
-            trip_data["accommodations"] = json.loads(trip_data["accommodations"])
-        
-        return TripPlan(**trip_data)
+        return ORJSONResponse(
+            select_fields(trip_row_to_dict(trip_data), field_tree),
+            headers=etag_headers(trip_etag(trip_id, trip_data.get("edited_at"), trip_data.get("updated_at"), fields))
+        )
     
     except HTTPException:
         raise
@@ -165,27 +229,124 @@ async def update_trip(
     authorization: str = Header(None)
 ):
     """更新旅行计划"""
-    user_id = get_user_id_from_token(authorization)
+    user_id = await get_user_id_from_token(authorization)
     
     try:
+        # 景点变化的那些天路线失效，保存后在后台重新计算
+        needs_routes = invalidate_stale_routes(trip_update.daily_itineraries)
+        
         # 准备更新数据
         update_data = trip_update.model_dump(exclude={"id", "user_id", "created_at"})
-        update_data["daily_itineraries"] = json.dumps([d.model_dump() for d in trip_update.daily_itineraries], default=str, ensure_ascii=False)
-        update_data["accommodations"] = json.dumps([a.model_dump() for a in trip_update.accommodations], default=str, ensure_ascii=False)
+        update_data["daily_itineraries"] = dumps_json_field(trip_update.daily_itineraries)
+        update_data["accommodations"] = dumps_json_field(trip_update.accommodations)
         update_data["preferences"] = [p.value for p in trip_update.preferences]
         
         updated_trip = await supabase_service.update_trip(trip_id, user_id, update_data)
         
         if not updated_trip:
             raise HTTPException(status_code=404, detail="行程不存在或更新失败")
+        if needs_routes:
+            route_geometry.schedule(trip_id, user_id)
         
-        # 解析 JSON 字段
-        if isinstance(updated_trip.get("daily_itineraries"), str):
-            updated_trip["daily_itineraries"] = json.loads(updated_trip["daily_itineraries"])
-        if isinstance(updated_trip.get("accommodations"), str):
-            updated_trip["accommodations"] = json.loads(updated_trip["accommodations"])
+        return ORJSONResponse(
+            trip_row_to_dict(updated_trip),
+            headers=etag_headers(trip_etag(trip_id, updated_trip.get("edited_at"), updated_trip.get("updated_at")))
+        )
+    
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"更新行程失败: {str(e)}")
+
+
+def _patched_field(path: Optional[str]) -> Optional[str]:
+    """取 JSON Pointer 的顶层字段名"""
+    if not path or not path.startswith("/"):
+        return path
+    return path.split("/")[1].replace("~1", "/").replace("~0", "~")
+
+
+@router.patch("/{trip_id}", response_model=TripPlan)
+async def patch_trip(
+    trip_id: str,
+    operations: List[JsonPatchOperation],
+    authorization: str = Header(None),
+    if_match: Optional[str] = Header(None)
+):
+    """
+    局部更新旅行计划（RFC 6902 JSON Patch）
+    
+    修改后的结果会按 TripPlan 校验，只写回被修改的列；
+    可用 If-Match 携带 GET 返回的 ETag，行程已被修改时返回 412
+    """
+    user_id = await get_user_id_from_token(authorization)
+    
+    # 只允许修改白名单内的字段，并记录会被写入的列
+    touched = set()
+    for op in operations:
+        for path in (op.path, op.from_):
+            if path is not None and _patched_field(path) not in PATCHABLE_TRIP_FIELDS:
+                raise HTTPException(status_code=422, detail=f"不允许修改的路径: {path}")
+        if op.op != "test":
+            touched.add(_patched_field(op.path))
+        if op.op == "move":
+            touched.add(_patched_field(op.from_))
+    
+    try:
+        # 补丁和写回条件都基于数据库中的当前版本，不用可能过期的缓存
+        version = await supabase_service.get_trip_version(trip_id, user_id)
+        trip_data = version is not None and await supabase_service.get_trip(trip_id, user_id, version=version)
+        if not trip_data:
+            raise HTTPException(status_code=404, detail="行程不存在")
+        
+        # 只比较内容版本：后台写回路线不会让客户端手中的 ETag 失效
+        current_edited_at = trip_data.get("edited_at")
+        if if_match and not trip_content_matches(if_match, trip_id, current_edited_at):
+            raise HTTPException(status_code=412, detail="行程已被修改，请刷新后重试")
+        
+        # 应用补丁并按模型校验（jsonpatch 只在第一次 PATCH 时导入）
+        import jsonpatch
+
+        document = trip_row_to_dict(trip_data)
+        try:
+            patched = jsonpatch.apply_patch(
+                document,
+                [op.model_dump(by_alias=True, exclude_unset=True) for op in operations]
+            )
+            trip_plan = TripPlan.model_validate(patched)
+        except (jsonpatch.JsonPatchException, jsonpatch.JsonPointerException) as e:
+            raise HTTPException(status_code=422, detail=f"补丁无法应用: {str(e)}")
+        except ValidationError as e:
+            raise HTTPException(status_code=422, detail=e.errors(include_url=False, include_context=False))
+        
+        needs_routes = "daily_itineraries" in touched and invalidate_stale_routes(trip_plan.daily_itineraries)
+        
+        # 只写回被修改的列
+        changes = {}
+        dumped = trip_plan.model_dump(mode="json", include=touched)
+        for field in touched:
+            if field in TRIP_JSON_FIELDS:
+                changes[field] = dumps_json_field(getattr(trip_plan, field))
+            else:
+                changes[field] = dumped[field]
+        if not changes:
+            return ORJSONResponse(document, headers=etag_headers(
+                trip_etag(trip_id, current_edited_at, trip_data.get("updated_at"))
+            ))
+        
+        # 以内容版本为写入条件：期间只有路线被写回时照常写入，路线失效的天会重新计算
+        updated_trip = await supabase_service.update_trip(
+            trip_id, user_id, changes, expected_edited_at=current_edited_at
+        )
+        if not updated_trip:
+            raise HTTPException(status_code=412, detail="行程已被修改，请刷新后重试")
+        if needs_routes:
+            route_geometry.schedule(trip_id, user_id)
         
-        return TripPlan(**updated_trip)
+        return ORJSONResponse(
+            trip_row_to_dict(updated_trip),
+            headers=etag_headers(trip_etag(trip_id, updated_trip.get("edited_at"), updated_trip.get("updated_at")))
+        )
     
     except HTTPException:
         raise
@@ -199,7 +360,7 @@ async def delete_trip(
     authorization: str = Header(None)
 ):
     """删除旅行计划"""
-    user_id = get_user_id_from_token(authorization)
+    user_id = await get_user_id_from_token(authorization)
     
     try:
         success = await supabase_service.delete_trip(trip_id, user_id)
@@ -0,0 +1,50 @@
+"""
+按地理位置分组基准：不同景点数下 cluster_days 的耗时
+
+景点分布在几个城区，大模型式的初始安排把景点轮流分到各天（最差情况）。
+
+运行（在 backend 目录下）：
+    python -m benchmarks.bench_day_clustering
+"""
+import random
+import timeit
+from datetime import date, timedelta
+
+from models.schemas import Attraction, DailyItinerary
+from services.day_clustering import cluster_days
+
+# 城区中心（成都附近）
+DISTRICTS = [(104.06, 30.66), (104.14, 30.63), (103.98, 30.70), (104.08, 30.55), (104.20, 30.72)]
+
+
+def build_days(stops: int, days: int) -> list:
+    rng = random.Random(42)
+    attractions = []
+    for i in range(stops):
+        lng, lat = rng.choice(DISTRICTS)
+        attractions.append(Attraction(
+            name=f"景点{i}",
+            description="",
+            address="",
+            latitude=lat + rng.gauss(0, 0.01),
+            longitude=lng + rng.gauss(0, 0.01),
+            duration=rng.choice([60, 90, 120, 180]),
+            pinned=i % 17 == 0,
+        ))
+    start = date(2024, 6, 1)
+    return [
+        DailyItinerary(day=d + 1, date=start + timedelta(days=d), attractions=attractions[d::days])
+        for d in range(days)
+    ]
+
+
+def main() -> None:
+    for stops, days in ((20, 5), (60, 10), (120, 14), (240, 30)):
+        itineraries = build_days(stops, days)
+        runs = 50
+        seconds = timeit.timeit(lambda: cluster_days(itineraries, 0.2), number=runs)
+        print(f"{stops:>4} 个景点 / {days:>2} 天: {seconds / runs * 1000:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
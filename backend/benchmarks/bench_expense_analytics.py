@@ -0,0 +1,43 @@
+"""
+费用分析基准：不同费用条数下 compute_expense_analytics 的耗时
+
+运行（在 backend 目录下）：
+    python -m benchmarks.bench_expense_analytics
+"""
+import random
+import timeit
+from datetime import date, timedelta
+
+from services.expense_analytics import compute_expense_analytics
+
+CATEGORIES = ["transportation", "accommodation", "food", "attractions", "shopping", "other"]
+
+
+def build_expenses(count: int, start: date, days: int) -> list:
+    """构造与 expenses 表结构一致的费用行，少量落在行程前（预订）"""
+    rng = random.Random(42)
+    return [
+        {
+            "category": rng.choice(CATEGORIES),
+            "amount": round(rng.uniform(5, 800), 2),
+            "date": (start + timedelta(days=rng.randint(-10, days - 1))).isoformat(),
+        }
+        for _ in range(count)
+    ]
+
+
+def main() -> None:
+    start = date(2024, 6, 1)
+    days = 14
+    for count in (100, 1000, 5000, 20000):
+        expenses = build_expenses(count, start, days)
+        runs = 50
+        seconds = timeit.timeit(
+            lambda: compute_expense_analytics(expenses, start, start + timedelta(days=days - 1), 20000, start + timedelta(days=6)),
+            number=runs
+        )
+        print(f"{count:>6} 条费用: {seconds / runs * 1000:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
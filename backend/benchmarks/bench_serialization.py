@@ -0,0 +1,136 @@
+"""
+序列化基准：14 天行程的读取响应
+
+对比旧路径（TripPlan(**row) 重建 + 响应模型再校验 + 标准库 json）与
+可信快速路径（整理字典 + orjson）。
+
+运行（在 backend 目录下）：
+    python -m benchmarks.bench_serialization
+"""
+import json
+import timeit
+from datetime import date, timedelta
+
+import orjson
+from fastapi.encoders import jsonable_encoder
+
+from models.schemas import TripPlan
+from models.serialization import trip_row_to_dict, construct_trip_plan
+
+
+def build_trip_row(days: int = 14) -> dict:
+    """构造一条与 trips 表结构一致的数据库行"""
+    start = date(2024, 6, 1)
+    itineraries = []
+    for i in range(days):
+        itineraries.append({
+            "day": i + 1,
+            "date": (start + timedelta(days=i)).isoformat(),
+            "attractions": [
+                {
+                    "name": f"景点{i}-{j}",
+                    "description": "这是一个非常值得一去的地方，历史悠久，风景优美。" * 3,
+                    "address": f"东京都台东区浅草{j}丁目{i}番地",
+                    "latitude": 35.71 + j * 0.01,
+                    "longitude": 139.79 + i * 0.01,
+                    "duration": 120,
+                    "estimated_cost": 200.0,
+                    "tips": "建议早上前往，避开人流高峰。",
+                }
+                for j in range(4)
+            ],
+            "restaurants": [
+                {
+                    "name": f"餐厅{i}-{j}",
+                    "cuisine_type": "日料",
+                    "address": f"东京都中央区银座{j}丁目",
+                    "latitude": 35.67,
+                    "longitude": 139.76,
+                    "estimated_cost": 150.0,
+                    "recommendations": "寿司、天妇罗、拉面",
+                }
+                for j in range(3)
+            ],
+            "transportation": [
+                {
+                    "type": "subway",
+                    "from_location": "酒店",
+                    "to_location": f"景点{i}-0",
+                    "departure_time": "09:00",
+                    "arrival_time": "09:30",
+                    "estimated_cost": 20.0,
+                    "notes": None,
+                }
+            ],
+            "notes": "当日行程较满，注意休息。",
+            "total_cost": 1270.0,
+        })
+    accommodations = [{
+        "name": "东京站酒店",
+        "type": "hotel",
+        "address": "东京都千代田区丸之内1-9-1",
+        "latitude": 35.68,
+        "longitude": 139.76,
+        "check_in": start.isoformat(),
+        "check_out": (start + timedelta(days=days)).isoformat(),
+        "estimated_cost": 12000.0,
+        "facilities": ["WiFi", "早餐", "健身房"],
+    }]
+    return {
+        "id": "5f1b7c1e-1111-4222-8333-444455556666",
+        "user_id": "0a0b0c0d-1111-4222-8333-444455556666",
+        "title": f"日本东京{days}日游",
+        "destination": "东京",
+        "start_date": start.isoformat(),
+        "end_date": (start + timedelta(days=days - 1)).isoformat(),
+        "total_days": days,
+        "budget": 30000,
+        "travelers": 2,
+        "preferences": ["food", "anime"],
+        "has_children": False,
+        # 与入库格式一致：嵌套结构以 JSON 字符串保存
+        "daily_itineraries": json.dumps(itineraries, ensure_ascii=False),
+        "accommodations": json.dumps(accommodations, ensure_ascii=False),
+        "estimated_costs": {"transportation": 2000, "accommodation": 12000, "food": 6000},
+        "total_estimated_cost": 20000,
+        "created_at": "2024-05-01T08:00:00.000000+00:00",
+        "updated_at": "2024-05-01T08:00:00.000000+00:00",
+    }
+
+
+def legacy_path(row: dict) -> bytes:
+    """旧路径：解析 -> 构建模型 -> 响应模型再校验 -> jsonable_encoder -> json.dumps"""
+    data = dict(row)
+    data["daily_itineraries"] = json.loads(data["daily_itineraries"])
+    data["accommodations"] = json.loads(data["accommodations"])
+    plan = TripPlan(**data)
+    validated = TripPlan.model_validate(plan.model_dump())
+    return json.dumps(jsonable_encoder(validated), ensure_ascii=False).encode("utf-8")
+
+
+def fast_path(row: dict) -> bytes:
+    """快速路径：整理字典 -> orjson"""
+    return orjson.dumps(trip_row_to_dict(row))
+
+
+def construct_path(row: dict) -> TripPlan:
+    """内部使用：不经校验构建 TripPlan"""
+    return construct_trip_plan(row)
+
+
+def main(number: int = 200) -> None:
+    row = build_trip_row(14)
+    # 快速路径的输出仍须符合 TripPlan 结构
+    TripPlan.model_validate(orjson.loads(fast_path(row)))
+
+    print(f"14 天行程，响应体 {len(fast_path(row)) / 1024:.1f} KB，每项运行 {number} 次")
+    results = {}
+    for name, fn in (("legacy", legacy_path), ("fast", fast_path), ("construct", construct_path)):
+        seconds = min(timeit.repeat(lambda: fn(row), number=number, repeat=5))
+        results[name] = seconds / number * 1e6
+        print(f"  {name:<10} {results[name]:>10.1f} µs/次")
+    print(f"  加速比: {results['legacy'] / results['fast']:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+冷启动基准：导入 main 的耗时、进程启动到存活 / 就绪的耗时
+
+- 导入检查：在干净的子进程中导入 main（不提供任何 key），要求不构造任何服务、
+  不导入 openai / supabase / numpy / jsonpatch，并把导入耗时的中位数与预算比较
+- 启动检查：以 uvicorn 启动应用，分别记录 /health（存活）和 /health/ready（就绪）首次成功的时间
+
+超出预算或检查失败时退出码为 1，可在 CI 中使用。在 backend 目录下运行：
+    python -m benchmarks.bench_startup
+    python -m benchmarks.bench_startup --budget-ms 1200 --runs 7
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+import httpx
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 延迟构造后，导入 main 时不应出现的模块
+HEAVY_MODULES = ["openai", "supabase", "numpy", "jsonpatch"]
+
+IMPORT_PROBE = f"""
+import sys, time
+start = time.perf_counter()
+import main
+elapsed = time.perf_counter() - start
+from services.lazy import services_status
+built = [name for name, status in services_status().items() if status["initialized"]]
+loaded = [name for name in {HEAVY_MODULES!r} if name in sys.modules]
+print(elapsed, ",".join(built), ",".join(loaded))
+"""
+
+# 导入检查故意不提供任何 key：缺少配置不应影响导入
+EMPTY_ENV = {"SUPABASE_URL": "", "SUPABASE_KEY": "", "OPENAI_API_KEY": "", "AMAP_API_KEY": "", "LOG_LEVEL": "WARNING"}
+
+# 启动检查用格式合法的占位配置，服务能构造成功但不会真正访问上游
+PLACEHOLDER_ENV = {
+    "SUPABASE_URL": "http://127.0.0.1:9",
+    "SUPABASE_KEY": "bench.placeholder.key",
+    "OPENAI_API_KEY": "bench-placeholder",
+    "AMAP_API_KEY": "bench-placeholder",
+    "LOG_LEVEL": "WARNING",
+}
+
+
+def measure_import(runs: int) -> list:
+    timings = []
+    for _ in range(runs):
+        output = subprocess.check_output(
+            [sys.executable, "-c", IMPORT_PROBE],
+            cwd=BACKEND_DIR,
+            env={**os.environ, **EMPTY_ENV},
+        ).decode().split("\n")[-2]
+        elapsed, built, loaded = (output.split(" ") + ["", ""])[:3]
+        if built or loaded:
+            raise SystemExit(f"导入 main 时构造了服务 [{built}] 或导入了 [{loaded}]")
+        timings.append(float(elapsed) * 1000)
+    return timings
+
+
+def measure_boot(port: int) -> tuple:
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND_DIR,
+        env={**os.environ, **PLACEHOLDER_ENV},
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    live = ready = None
+    try:
+        while ready is None and time.perf_counter() - start < 30:
+            if process.poll() is not None:
+                raise SystemExit("应用启动失败")
+            try:
+                if live is None and httpx.get(f"http://127.0.0.1:{port}/health", timeout=1).status_code == 200:
+                    live = time.perf_counter() - start
+                if live is not None and httpx.get(f"http://127.0.0.1:{port}/health/ready", timeout=1).status_code == 200:
+                    ready = time.perf_counter() - start
+            except httpx.HTTPError:
+                pass
+            time.sleep(0.01)
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
+    if ready is None:
+        raise SystemExit("等待就绪超时")
+    return live * 1000, ready * 1000
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="冷启动基准")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget-ms", type=float, default=1500, help="导入 main 耗时中位数的上限")
+    parser.add_argument("--port", type=int, default=8101)
+    args = parser.parse_args()
+
+    timings = measure_import(args.runs)
+    median = statistics.median(timings)
+    print(f"import main: 中位数 {median:.0f} ms（最小 {min(timings):.0f} ms，{args.runs} 次），预算 {args.budget_ms:.0f} ms")
+    print(f"导入时未构造任何服务，未导入 {', '.join(HEAVY_MODULES)}")
+
+    live, ready = measure_boot(args.port)
+    print(f"进程启动到存活: {live:.0f} ms，到就绪: {ready:.0f} ms")
+
+    if median > args.budget_ms:
+        print("导入耗时超出预算")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
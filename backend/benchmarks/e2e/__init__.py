@@ -0,0 +1 @@
+# End-to-end benchmark harness
@@ -0,0 +1,441 @@
+"""
+端到端基准使用的本地上游替身
+
+一个进程内同时提供三个上游，路径互不冲突：
+- Supabase：GoTrue（/auth/v1/...）和 PostgREST（/rest/v1/...），数据保存在内存中
+- 高德：/v3/geocode/geo、/v3/geocode/regeo、/v3/place/text、/v3/direction/driving
+- OpenAI 兼容接口：/v1/chat/completions，返回固定结构的行程 / 预算分析 JSON；
+  stream=true 时以 SSE 分片返回，延迟分摊到各个分片上（客户端断开即停止发送）
+
+每个上游的延迟可以单独配置（均值 + 抖动），用来模拟真实网络与服务耗时。
+PostgREST 只实现了本项目用到的子集：eq / neq / in / lt / lte / gt / gte 过滤、
+select 列、order、limit、count=exact，以及 get_trip_expense_summary RPC。
+
+运行：
+    python -m benchmarks.e2e.mocks --port 9100 --supabase-latency-ms 5 --llm-latency-ms 800
+"""
+import argparse
+import asyncio
+import math
+import random
+import uuid
+from datetime import date, datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import orjson
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import Response, StreamingResponse
+from starlette.routing import Route
+
+from benchmarks.bench_serialization import build_trip_row
+
+BENCH_USER_ID = "0a0b0c0d-1111-4222-8333-444455556666"
+BENCH_EMAIL = "bench@example.com"
+BENCH_PASSWORD = "bench-password"
+
+
+def json_response(data: Any, status: int = 200, headers: Optional[Dict[str, str]] = None) -> Response:
+    return Response(orjson.dumps(data), status_code=status, media_type="application/json", headers=headers)
+
+
+class Latency:
+    """均值 mean_ms、抖动 ±jitter 比例的延迟"""
+
+    def __init__(self, mean_ms: float, jitter: float = 0.2):
+        self.mean_ms = mean_ms
+        self.jitter = jitter
+
+    def sample(self) -> float:
+        """一次延迟的秒数"""
+        factor = 1 + random.uniform(-self.jitter, self.jitter)
+        return max(0.0, self.mean_ms * factor / 1000)
+
+    async def wait(self) -> None:
+        if self.mean_ms > 0:
+            await asyncio.sleep(self.sample())
+
+
+# ---------------------------------------------------------------- PostgREST
+
+def _parse_filter(value: str) -> Tuple[str, Any]:
+    op, _, operand = value.partition(".")
+    if op == "in":
+        return op, [item.strip('"') for item in operand.strip("()").split(",") if item]
+    return op, operand
+
+
+_OPS: Dict[str, Callable[[Any, Any], bool]] = {
+    "eq": lambda a, b: str(a) == b,
+    "neq": lambda a, b: str(a) != b,
+    "in": lambda a, b: str(a) in b,
+    "lt": lambda a, b: a is not None and str(a) < b,
+    "lte": lambda a, b: a is not None and str(a) <= b,
+    "gt": lambda a, b: a is not None and str(a) > b,
+    "gte": lambda a, b: a is not None and str(a) >= b,
+}
+
+RESERVED_PARAMS = {"select", "order", "limit", "offset", "or", "on_conflict", "columns"}
+
+
+class MemoryDatabase:
+    """按表保存的内存数据"""
+
+    def __init__(self):
+        self.tables: Dict[str, List[Dict[str, Any]]] = {"trips": [], "expenses": []}
+
+    def seed(self, trips: int, expenses_per_trip: int, days: int) -> None:
+        template = build_trip_row(days)
+        start = datetime(2024, 1, 1)
+        for i in range(trips):
+            created = (start + timedelta(minutes=i)).isoformat()
+            trip = {**template, "id": str(uuid.uuid4()), "user_id": BENCH_USER_ID,
+                    "created_at": created, "updated_at": created, "edited_at": created}
+            self.tables["trips"].append(trip)
+            for j in range(expenses_per_trip):
+                self.tables["expenses"].append({
+                    "id": str(uuid.uuid4()),
+                    "user_id": BENCH_USER_ID,
+                    "trip_id": trip["id"],
+                    "category": random.choice(["transportation", "accommodation", "food", "attractions"]),
+                    "amount": round(random.uniform(10, 500), 2),
+                    "description": f"费用 {j}",
+                    "date": (date(2024, 6, 1) + timedelta(days=j % days)).isoformat(),
+                    "location": None,
+                    "notes": None,
+                    "created_at": created,
+                    "updated_at": created,
+                })
+
+    def filter(self, table: str, params) -> List[Dict[str, Any]]:
+        filters = [
+            (column, *_parse_filter(value))
+            for column, value in params.multi_items()
+            if column not in RESERVED_PARAMS
+        ]
+        return [
+            row for row in self.tables[table]
+            if all(_OPS.get(op, lambda a, b: True)(row.get(column), operand) for column, op, operand in filters)
+        ]
+
+    @staticmethod
+    def shape(rows: List[Dict[str, Any]], params) -> List[Dict[str, Any]]:
+        for item in reversed((params.get("order") or "").split(",")):
+            if item:
+                column, _, direction = item.partition(".")
+                rows = sorted(rows, key=lambda r: str(r.get(column) or ""), reverse=direction.startswith("desc"))
+        if params.get("limit"):
+            rows = rows[:int(params["limit"])]
+        select = params.get("select") or "*"
+        if select != "*":
+            columns = [c.strip() for c in select.split(",")]
+            rows = [{c: row.get(c) for c in columns} for row in rows]
+        return rows
+
+
+def build_supabase_routes(db: MemoryDatabase, latency: Latency) -> List[Route]:
+    def user_json() -> Dict[str, Any]:
+        return {
+            "id": BENCH_USER_ID,
+            "aud": "authenticated",
+            "role": "authenticated",
+            "email": BENCH_EMAIL,
+            "app_metadata": {"provider": "email"},
+            "user_metadata": {"full_name": "Bench User"},
+            "created_at": "2024-01-01T00:00:00Z",
+        }
+
+    async def token(request: Request) -> Response:
+        await latency.wait()
+        return json_response({
+            "access_token": f"bench-access-token-{uuid.uuid4().hex}",
+            "refresh_token": "bench-refresh-token",
+            "token_type": "bearer",
+            "expires_in": 3600,
+            "expires_at": int(datetime.utcnow().timestamp()) + 3600,
+            "user": user_json(),
+        })
+
+    async def user(request: Request) -> Response:
+        await latency.wait()
+        return json_response(user_json())
+
+    async def logout(request: Request) -> Response:
+        return Response(status_code=204)
+
+    async def table(request: Request) -> Response:
+        await latency.wait()
+        name = request.path_params["table"]
+        if name not in db.tables:
+            return json_response({"message": f"relation {name} does not exist"}, status=404)
+        prefer = request.headers.get("prefer", "")
+
+        if request.method == "GET" or request.method == "HEAD":
+            matched = db.filter(name, request.query_params)
+            rows = db.shape(matched, request.query_params)
+            headers = {}
+            if "count=" in prefer:
+                headers["Content-Range"] = f"0-{max(len(rows) - 1, 0)}/{len(matched)}"
+            return json_response(rows, headers=headers)
+
+        if request.method == "POST":
+            body = orjson.loads(await request.body())
+            items = body if isinstance(body, list) else [body]
+            now = datetime.utcnow().isoformat()
+            created = []
+            for item in items:
+                row = {"id": str(uuid.uuid4()), "created_at": now, "updated_at": now, **item}
+                db.tables[name].append(row)
+                created.append(row)
+            return json_response(created, status=201)
+
+        matched = db.filter(name, request.query_params)
+        if request.method == "PATCH":
+            changes = orjson.loads(await request.body())
+            for row in matched:
+                row.update(changes)
+                row["updated_at"] = datetime.utcnow().isoformat()
+            return json_response(matched)
+
+        # DELETE
+        ids = {row["id"] for row in matched}
+        db.tables[name] = [row for row in db.tables[name] if row["id"] not in ids]
+        return json_response(matched)
+
+    async def expense_summary(request: Request) -> Response:
+        await latency.wait()
+        args = orjson.loads(await request.body())
+        rows = [
+            e for e in db.tables["expenses"]
+            if e["trip_id"] == args["p_trip_id"] and e["user_id"] == args["p_user_id"]
+        ]
+        by_category: Dict[str, float] = {}
+        by_day: Dict[str, float] = {}
+        for e in rows:
+            by_category[e["category"]] = by_category.get(e["category"], 0) + e["amount"]
+            by_day[e["date"]] = by_day.get(e["date"], 0) + e["amount"]
+        return json_response({
+            "total_spent": round(sum(e["amount"] for e in rows), 2),
+            "expense_count": len(rows),
+            "by_category": by_category,
+            "by_day": by_day,
+            "last_updated_at": max((e["updated_at"] for e in rows), default=None),
+        })
+
+    return [
+        Route("/auth/v1/token", token, methods=["POST"]),
+        Route("/auth/v1/user", user, methods=["GET"]),
+        Route("/auth/v1/logout", logout, methods=["POST"]),
+        Route("/rest/v1/rpc/get_trip_expense_summary", expense_summary, methods=["POST"]),
+        Route("/rest/v1/{table}", table, methods=["GET", "HEAD", "POST", "PATCH", "DELETE"]),
+    ]
+
+
+# ---------------------------------------------------------------- 高德
+
+# 替身路线的点数和分段数，点数与真实城市内驾车路线的量级相当
+DRIVING_PATH_POINTS = 240
+DRIVING_STEPS = 12
+
+
+def _driving_steps(origin: Optional[str], destination: Optional[str]) -> List[Dict[str, str]]:
+    """起终点之间带横向弯曲的路线，按高德格式拆成若干路段，polyline 为 "lng,lat;lng,lat" """
+    try:
+        x0, y0 = (float(v) for v in (origin or "").split(","))
+        x1, y1 = (float(v) for v in (destination or "").split(","))
+    except ValueError:
+        return []
+    points = []
+    for i in range(DRIVING_PATH_POINTS):
+        t = i / (DRIVING_PATH_POINTS - 1)
+        bend = 0.08 * math.sin(t * math.pi * 3)
+        points.append(f"{x0 + (x1 - x0) * t - (y1 - y0) * bend:.6f},{y0 + (y1 - y0) * t + (x1 - x0) * bend:.6f}")
+    size = DRIVING_PATH_POINTS // DRIVING_STEPS
+    return [{"polyline": ";".join(points[i:i + size + 1])} for i in range(0, DRIVING_PATH_POINTS - 1, size)]
+
+
+def build_amap_routes(latency: Latency) -> List[Route]:
+    async def geocode(request: Request) -> Response:
+        await latency.wait()
+        return json_response({"status": "1", "geocodes": [{
+            "location": "139.7967,35.7148",
+            "formatted_address": request.query_params.get("address", ""),
+        }]})
+
+    async def regeo(request: Request) -> Response:
+        await latency.wait()
+        return json_response({"status": "1", "regeocode": {"formatted_address": "东京都台东区浅草2丁目"}})
+
+    async def place_text(request: Request) -> Response:
+        await latency.wait()
+        keyword = request.query_params.get("keywords", "")
+        # 餐饮类关键词返回餐饮服务分类（typecode 05 开头），不同关键词的 id 不重复
+        dining = keyword in ("美食", "特色餐厅")
+        prefix = sum(map(ord, keyword)) % 10000
+        return json_response({"status": "1", "pois": [
+            {
+                "id": f"B0{prefix:04d}{i:04d}",
+                "name": f"{keyword}{i}",
+                "address": f"东京都台东区浅草{i}丁目",
+                "location": f"{139.79 + i * 0.001:.6f},{35.71 + i * 0.001:.6f}",
+                "type": "餐饮服务;中餐厅;中餐厅" if dining else "风景名胜;风景名胜;风景名胜",
+                "typecode": "050100" if dining else "110000",
+                "adname": "台东区",
+                "biz_ext": {"cost": "150.00" if dining else []},
+                "tel": "",
+            }
+            for i in range(int(request.query_params.get("offset", 10)))
+        ]})
+
+    async def driving(request: Request) -> Response:
+        await latency.wait()
+        return json_response({"status": "1", "route": {"paths": [{
+            "distance": "5230", "duration": "960", "strategy": "速度最快",
+            "steps": _driving_steps(request.query_params.get("origin"), request.query_params.get("destination")),
+        }]}})
+
+    return [
+        Route("/v3/geocode/geo", geocode),
+        Route("/v3/geocode/regeo", regeo),
+        Route("/v3/place/text", place_text),
+        Route("/v3/direction/driving", driving),
+    ]
+
+
+# ---------------------------------------------------------------- 大模型
+
+def _trip_plan_content(days: int, with_candidates: bool = False) -> str:
+    """
+    行程生成的回复；with_candidates 时按提示词中的候选编号格式回复
+    （景点 a1、a2 ...，餐厅 r1、r2 ...，与 place_text 返回的条数无关，编号只需依次出现）
+    """
+    row = build_trip_row(days)
+    itineraries = orjson.loads(row["daily_itineraries"])
+    if with_candidates:
+        for day in itineraries:
+            day["attractions"] = [
+                {"poi": f"a{(day['day'] - 1) * 4 + j + 1}", "duration": a["duration"], "tips": a["tips"]}
+                for j, a in enumerate(day["attractions"])
+            ]
+            day["restaurants"] = [
+                {"poi": f"r{j + 1}", "recommendations": r["recommendations"]}
+                for j, r in enumerate(day["restaurants"])
+            ]
+    return orjson.dumps({
+        "title": "基准测试行程",
+        "daily_itineraries": itineraries,
+        "accommodations": orjson.loads(row["accommodations"]),
+        "estimated_costs": row["estimated_costs"],
+    }).decode("utf-8")
+
+
+# 流式响应每个分片的字符数，约等于一个 token
+STREAM_CHUNK_CHARS = 4
+# 首个分片前的等待占总延迟的比例
+STREAM_FIRST_CHUNK_SHARE = 0.1
+
+
+async def _stream_completion(completion_id: str, model: str, content: str, total_seconds: float):
+    chunks = [content[i:i + STREAM_CHUNK_CHARS] for i in range(0, len(content), STREAM_CHUNK_CHARS)]
+    per_chunk = total_seconds * (1 - STREAM_FIRST_CHUNK_SHARE) / max(len(chunks), 1)
+    await asyncio.sleep(total_seconds * STREAM_FIRST_CHUNK_SHARE)
+    created = int(datetime.utcnow().timestamp())
+    # 按累计应发送的时间点睡眠，避免上千次极短的 sleep 累积误差
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    for index, piece in enumerate(chunks + [None]):
+        delay = started + index * per_chunk - loop.time()
+        if delay > 0.001:
+            await asyncio.sleep(delay)
+        delta = {"content": piece} if piece is not None else {}
+        yield b"data: " + orjson.dumps({
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": created,
+            "model": model,
+            "choices": [{
+                "index": 0,
+                "delta": delta,
+                "finish_reason": None if piece is not None else "stop",
+            }],
+        }) + b"\n\n"
+    yield b"data: [DONE]\n\n"
+
+
+def build_llm_routes(latency: Latency, plan_days: int) -> List[Route]:
+    plan_content = _trip_plan_content(plan_days)
+    grounded_plan_content = _trip_plan_content(plan_days, with_candidates=True)
+    analysis_content = orjson.dumps({
+        "analysis": "预算使用正常。",
+        "suggestions": ["继续保持"],
+    }).decode("utf-8")
+
+    async def completions(request: Request) -> Response:
+        body = orjson.loads(await request.body())
+        system = body["messages"][0]["content"]
+        if "预算分析" in system:
+            content = analysis_content
+        elif "候选景点" in body["messages"][-1]["content"]:
+            content = grounded_plan_content
+        else:
+            content = plan_content
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        if body.get("stream"):
+            return StreamingResponse(
+                _stream_completion(completion_id, body.get("model", "mock"), content, latency.sample()),
+                media_type="text/event-stream",
+            )
+        await latency.wait()
+        return json_response({
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": int(datetime.utcnow().timestamp()),
+            "model": body.get("model", "mock"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop",
+            }],
+            "usage": {"prompt_tokens": 800, "completion_tokens": len(content) // 2, "total_tokens": 800 + len(content) // 2},
+        })
+
+    return [Route("/v1/chat/completions", completions, methods=["POST"])]
+
+
+def create_app(
+    supabase_latency_ms: float = 5,
+    amap_latency_ms: float = 20,
+    llm_latency_ms: float = 800,
+    trips: int = 50,
+    expenses_per_trip: int = 40,
+    plan_days: int = 5
+) -> Starlette:
+    db = MemoryDatabase()
+    db.seed(trips, expenses_per_trip, plan_days)
+    return Starlette(routes=[
+        *build_supabase_routes(db, Latency(supabase_latency_ms)),
+        *build_amap_routes(Latency(amap_latency_ms)),
+        *build_llm_routes(Latency(llm_latency_ms), plan_days),
+    ])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="端到端基准的上游替身")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--supabase-latency-ms", type=float, default=5)
+    parser.add_argument("--amap-latency-ms", type=float, default=20)
+    parser.add_argument("--llm-latency-ms", type=float, default=800)
+    parser.add_argument("--trips", type=int, default=50)
+    parser.add_argument("--expenses-per-trip", type=int, default=40)
+    args = parser.parse_args()
+
+    app = create_app(
+        args.supabase_latency_ms, args.amap_latency_ms, args.llm_latency_ms,
+        args.trips, args.expenses_per_trip
+    )
+    uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
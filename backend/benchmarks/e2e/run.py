@@ -0,0 +1,392 @@
+"""
+端到端基准：在本地上游替身上启动完整应用，用混合流量压测
+
+流程：
+1. 启动上游替身（benchmarks/e2e/mocks.py），Supabase / 高德 / 大模型各自带可配置延迟
+2. 以 uvicorn 启动 main:app，SUPABASE_URL、AMAP_BASE_URL、OPENAI_BASE_URL 指向替身
+3. 若干虚拟用户各自登录后按权重循环执行：登录、行程列表、打开行程、记一笔费用、
+   费用统计、POI 搜索、AI 生成行程
+4. 按路由输出吞吐量与 p50 / p95 / p99，结果写入 benchmarks/results/，
+   并与上一次的结果对比，便于发现提交之间的性能回退
+
+在 backend 目录下运行：
+    python -m benchmarks.e2e.run --users 20 --duration 30
+    python -m benchmarks.e2e.run --llm-latency-ms 2000 --workers 2
+    python -m benchmarks.e2e.run --fail-on-regression 0.2    # p95 变慢超过 20% 时退出码为 1
+"""
+import argparse
+import asyncio
+import glob
+import json
+import os
+import random
+import signal
+import subprocess
+import sys
+import time
+from dataclasses import dataclass, field
+from datetime import date, timedelta
+from typing import Any, Callable, Dict, List, Optional
+
+import httpx
+
+from benchmarks.e2e.mocks import BENCH_EMAIL, BENCH_PASSWORD
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+RESULTS_DIR = os.path.join(BACKEND_DIR, "benchmarks", "results")
+API = "/api/v1"
+
+
+@dataclass
+class Scenario:
+    name: str
+    method: str
+    route: str      # 路由模板，作为统计的键
+    weight: int
+    build: Callable[["VirtualUser"], Dict[str, Any]]
+
+
+@dataclass
+class RouteStats:
+    latencies: List[float] = field(default_factory=list)
+    errors: int = 0
+
+    def summary(self, elapsed: float) -> Dict[str, Any]:
+        ordered = sorted(self.latencies)
+        return {
+            "count": len(ordered),
+            "errors": self.errors,
+            "rps": round(len(ordered) / elapsed, 2) if elapsed else 0.0,
+            "mean_ms": round(sum(ordered) / len(ordered) * 1000, 2) if ordered else None,
+            "p50_ms": percentile(ordered, 50),
+            "p95_ms": percentile(ordered, 95),
+            "p99_ms": percentile(ordered, 99),
+        }
+
+
+def percentile(ordered: List[float], p: float) -> Optional[float]:
+    """最近秩法百分位（毫秒）；ordered 已排序"""
+    if not ordered:
+        return None
+    index = max(0, min(len(ordered) - 1, int(round(p / 100 * len(ordered) + 0.5)) - 1))
+    return round(ordered[index] * 1000, 2)
+
+
+class VirtualUser:
+    """一个已登录的用户，持有自己的 token 和可访问的行程 id"""
+
+    def __init__(self, client: httpx.AsyncClient):
+        self.client = client
+        self.token = ""
+        self.trip_ids: List[str] = []
+
+    @property
+    def headers(self) -> Dict[str, str]:
+        return {"Authorization": f"Bearer {self.token}"}
+
+    def trip_id(self) -> str:
+        return random.choice(self.trip_ids)
+
+
+def _expense_body(user: VirtualUser) -> Dict[str, Any]:
+    return {
+        "trip_id": user.trip_id(),
+        "category": random.choice(["transportation", "food", "attractions", "shopping"]),
+        "amount": round(random.uniform(10, 300), 2),
+        "description": "基准测试费用",
+        "date": (date(2024, 6, 1) + timedelta(days=random.randrange(5))).isoformat(),
+    }
+
+
+def _plan_body(user: VirtualUser) -> Dict[str, Any]:
+    return {
+        "destination": "东京",
+        "start_date": "2024-06-01",
+        "end_date": "2024-06-05",
+        "budget": 10000,
+        "travelers": 2,
+        "preferences": ["food", "culture"],
+    }
+
+
+SCENARIOS: List[Scenario] = [
+    Scenario("login", "POST", f"{API}/auth/signin", 2,
+             lambda u: {"url": f"{API}/auth/signin", "json": {"email": BENCH_EMAIL, "password": BENCH_PASSWORD}}),
+    Scenario("list_trips", "GET", f"{API}/trips/", 30,
+             lambda u: {"url": f"{API}/trips/", "headers": u.headers}),
+    Scenario("open_trip", "GET", f"{API}/trips/{{trip_id}}", 25,
+             lambda u: {"url": f"{API}/trips/{u.trip_id()}", "headers": u.headers}),
+    Scenario("add_expense", "POST", f"{API}/expenses/", 15,
+             lambda u: {"url": f"{API}/expenses/", "headers": u.headers, "json": _expense_body(u)}),
+    Scenario("expense_summary", "GET", f"{API}/expenses/trip/{{trip_id}}/summary", 15,
+             lambda u: {"url": f"{API}/expenses/trip/{u.trip_id()}/summary", "headers": u.headers}),
+    Scenario("search_poi", "POST", f"{API}/maps/maps/search", 10,
+             lambda u: {"url": f"{API}/maps/maps/search", "headers": u.headers,
+                        "json": {"keyword": "浅草寺", "city": "东京"}}),
+    Scenario("plan_trip", "POST", f"{API}/trips/plan", 3,
+             lambda u: {"url": f"{API}/trips/plan", "headers": u.headers, "json": _plan_body(u)}),
+]
+
+
+def parse_mix(spec: Optional[str]) -> List[Scenario]:
+    """--mix "list_trips=50,plan_trip=0" 覆盖部分场景的权重，权重为 0 的场景不执行"""
+    weights = {s.name: s.weight for s in SCENARIOS}
+    for item in (spec or "").split(","):
+        name, sep, weight = item.partition("=")
+        if sep:
+            if name.strip() not in weights:
+                raise SystemExit(f"未知场景: {name.strip()}（可选: {', '.join(weights)}）")
+            weights[name.strip()] = int(weight)
+    return [Scenario(s.name, s.method, s.route, weights[s.name], s.build) for s in SCENARIOS if weights[s.name] > 0]
+
+
+def start_process(args: List[str], env: Optional[Dict[str, str]] = None) -> subprocess.Popen:
+    return subprocess.Popen(
+        [sys.executable, *args],
+        cwd=BACKEND_DIR,
+        env={**os.environ, **(env or {})},
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        start_new_session=True,
+    )
+
+
+def stop_process(process: subprocess.Popen) -> None:
+    if process.poll() is None:
+        os.killpg(process.pid, signal.SIGTERM)
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            os.killpg(process.pid, signal.SIGKILL)
+
+
+def wait_ready(url: str, process: subprocess.Popen, timeout: float = 30) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"进程启动失败:\n{process.stderr.read().decode('utf-8', 'replace')}")
+        try:
+            if httpx.get(url, timeout=1).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"等待 {url} 就绪超时")
+
+
+async def login(user: VirtualUser) -> None:
+    response = await user.client.post(
+        f"{API}/auth/signin", json={"email": BENCH_EMAIL, "password": BENCH_PASSWORD}
+    )
+    response.raise_for_status()
+    user.token = response.json()["access_token"]
+    response = await user.client.get(f"{API}/trips/", headers=user.headers, params={"limit": 100, "fields": "id"})
+    response.raise_for_status()
+    user.trip_ids = [trip["id"] for trip in response.json()["trips"]]
+    if not user.trip_ids:
+        raise RuntimeError("替身数据库中没有行程")
+
+
+async def run_user(
+    user: VirtualUser,
+    scenarios: List[Scenario],
+    stats: Dict[str, RouteStats],
+    record_after: float,
+    stop_at: float
+) -> None:
+    weights = [s.weight for s in scenarios]
+    while time.monotonic() < stop_at:
+        scenario = random.choices(scenarios, weights)[0]
+        request = scenario.build(user)
+        start = time.monotonic()
+        try:
+            response = await user.client.request(scenario.method, **request)
+            ok = response.status_code < 400
+        except httpx.HTTPError:
+            ok = False
+        end = time.monotonic()
+        # 预热阶段和压测结束后才完成的请求不计入统计
+        if record_after <= start and end <= stop_at:
+            route_stats = stats.setdefault(f"{scenario.method} {scenario.route}", RouteStats())
+            route_stats.latencies.append(end - start)
+            if not ok:
+                route_stats.errors += 1
+
+
+async def drive(base_url: str, args: argparse.Namespace, scenarios: List[Scenario]) -> Dict[str, Any]:
+    limits = httpx.Limits(max_connections=args.users, max_keepalive_connections=args.users)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=args.request_timeout) as client:
+        users = [VirtualUser(client) for _ in range(args.users)]
+        await asyncio.gather(*(login(user) for user in users))
+
+        stats: Dict[str, RouteStats] = {}
+        now = time.monotonic()
+        record_after = now + args.warmup
+        stop_at = record_after + args.duration
+        await asyncio.gather(*(run_user(u, scenarios, stats, record_after, stop_at) for u in users))
+
+    total = RouteStats()
+    for route_stats in stats.values():
+        total.latencies.extend(route_stats.latencies)
+        total.errors += route_stats.errors
+    return {
+        "routes": {route: stats[route].summary(args.duration) for route in sorted(stats)},
+        "total": total.summary(args.duration),
+    }
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except Exception:
+        return "unknown"
+
+
+def latest_result(directory: str) -> Optional[Dict[str, Any]]:
+    files = sorted(glob.glob(os.path.join(directory, "e2e-*.json")))
+    if not files:
+        return None
+    with open(files[-1], encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _fmt(value: Optional[float]) -> str:
+    return "-" if value is None else f"{value:.1f}"
+
+
+def print_report(result: Dict[str, Any], baseline: Optional[Dict[str, Any]]) -> List[str]:
+    """打印报告；有基线时附上 p95 的变化，返回 p95 变慢超过阈值的路由"""
+    base_routes = (baseline or {}).get("routes", {})
+    threshold = result["config"].get("fail_on_regression")
+    regressions = []
+    header = f"{'route':<48} {'count':>7} {'err':>5} {'rps':>8} {'p50':>8} {'p95':>8} {'p99':>8}"
+    if baseline:
+        header += f"  {'p95 vs ' + baseline['commit']:>16}"
+    print(header)
+    print("-" * len(header))
+    rows = list(result["routes"].items()) + [("TOTAL", result["total"])]
+    for route, s in rows:
+        line = (
+            f"{route:<48} {s['count']:>7} {s['errors']:>5} {s['rps']:>8.1f} "
+            f"{_fmt(s['p50_ms']):>8} {_fmt(s['p95_ms']):>8} {_fmt(s['p99_ms']):>8}"
+        )
+        base = base_routes.get(route) if route != "TOTAL" else (baseline or {}).get("total")
+        if base and base.get("p95_ms") and s["p95_ms"] is not None:
+            change = s["p95_ms"] / base["p95_ms"] - 1
+            line += f"  {change:>+15.1%}"
+            if threshold is not None and route != "TOTAL" and change > threshold:
+                regressions.append(route)
+        print(line)
+    print("（延迟单位 ms）")
+    return regressions
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="端到端混合流量基准")
+    parser.add_argument("--users", type=int, default=20, help="并发虚拟用户数")
+    parser.add_argument("--duration", type=float, default=30, help="计入统计的压测时长（秒）")
+    parser.add_argument("--warmup", type=float, default=3, help="预热时长（秒），不计入统计")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn worker 数")
+    parser.add_argument("--app-port", type=int, default=8100)
+    parser.add_argument("--mock-port", type=int, default=9100)
+    parser.add_argument("--supabase-latency-ms", type=float, default=5)
+    parser.add_argument("--amap-latency-ms", type=float, default=20)
+    parser.add_argument("--llm-latency-ms", type=float, default=800)
+    parser.add_argument("--trips", type=int, default=50, help="替身数据库中预置的行程数")
+    parser.add_argument("--expenses-per-trip", type=int, default=40)
+    parser.add_argument("--admission", action="store_true", help="保持准入控制开启（默认关闭）")
+    parser.add_argument("--mix", help='覆盖场景权重，如 "list_trips=50,plan_trip=0"')
+    parser.add_argument("--request-timeout", type=float, default=60)
+    parser.add_argument("--results-dir", default=RESULTS_DIR)
+    parser.add_argument("--no-save", action="store_true", help="不保存本次结果")
+    parser.add_argument("--baseline", help="对比的结果文件，默认取 results 目录中最新的一份")
+    parser.add_argument("--fail-on-regression", type=float, help="任一路由 p95 相对基线变慢超过该比例时退出码为 1")
+    return parser.parse_args()
+
+
+def main() -> int:
+    args = parse_args()
+    scenarios = parse_mix(args.mix)
+    mock_url = f"http://127.0.0.1:{args.mock_port}"
+    app_url = f"http://127.0.0.1:{args.app_port}"
+
+    mocks = start_process([
+        "-m", "benchmarks.e2e.mocks",
+        "--port", str(args.mock_port),
+        "--supabase-latency-ms", str(args.supabase_latency_ms),
+        "--amap-latency-ms", str(args.amap_latency_ms),
+        "--llm-latency-ms", str(args.llm_latency_ms),
+        "--trips", str(args.trips),
+        "--expenses-per-trip", str(args.expenses_per_trip),
+    ])
+    app = None
+    try:
+        wait_ready(f"{mock_url}/v3/geocode/regeo", mocks)
+        app = start_process(
+            ["-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(args.app_port),
+             "--workers", str(args.workers), "--log-level", "warning", "--no-access-log"],
+            env={
+                "SUPABASE_URL": mock_url,
+                # supabase 客户端会校验 key 的格式（三段式 JWT），替身不校验内容
+                "SUPABASE_KEY": "bench.mock.key",
+                "OPENAI_API_KEY": "bench-mock-key",
+                "OPENAI_BASE_URL": f"{mock_url}/v1",
+                "AMAP_API_KEY": "bench-mock-key",
+                "AMAP_BASE_URL": f"{mock_url}/v3",
+                "LOG_LEVEL": "WARNING",
+                "PROFILING_ENABLED": "false",
+                # 默认压测应用本身的容量；--admission 时保留准入控制，观察限流下的表现
+                "ADMISSION_ENABLED": "true" if args.admission else "false",
+            },
+        )
+        wait_ready(f"{app_url}/health", app)
+
+        print(f"压测中：{args.users} 个用户，预热 {args.warmup}s，计时 {args.duration}s ...")
+        result = asyncio.run(drive(app_url, args, scenarios))
+    finally:
+        if app is not None:
+            stop_process(app)
+        stop_process(mocks)
+
+    result = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": {
+            key: getattr(args, key) for key in (
+                "users", "duration", "warmup", "workers", "supabase_latency_ms", "amap_latency_ms",
+                "llm_latency_ms", "trips", "expenses_per_trip", "mix", "admission", "fail_on_regression",
+            )
+        },
+        **result,
+    }
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+    else:
+        baseline = latest_result(args.results_dir)
+    if baseline and {k: v for k, v in baseline["config"].items() if k != "fail_on_regression"} != \
+            {k: v for k, v in result["config"].items() if k != "fail_on_regression"}:
+        print(f"注意：基线 {baseline['commit']} 的压测参数与本次不同，对比仅供参考")
+
+    regressions = print_report(result, baseline)
+
+    if not args.no_save:
+        os.makedirs(args.results_dir, exist_ok=True)
+        path = os.path.join(
+            args.results_dir, f"e2e-{time.strftime('%Y%m%d-%H%M%S')}-{result['commit']}.json"
+        )
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"结果已保存: {path}")
+
+    if regressions:
+        print(f"p95 回退超过 {args.fail_on_regression:.0%}: {', '.join(regressions)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -17,6 +17,7 @@ class Settings(BaseSettings):
     
     # Amap
     amap_api_key: str = ""
+    amap_base_url: str = "https://restapi.amap.com/v3"
     
     # Application
     app_env: str = "development"
@@ -24,6 +25,85 @@ class Settings(BaseSettings):
     api_prefix: str = "/api/v1"
     cors_origins_str: str = '["http://localhost:5173", "http://localhost:3000"]'
     
+    # 日志：级别、格式（json / text）、按 logger 覆盖的级别（如 "api.trips=DEBUG"），
+    # 以及完整行程计划明细的采样比例（0 关闭，1 每次都输出）
+    log_level: str = "INFO"
+    log_format: str = "json"
+    log_levels: str = "httpx=WARNING"
+    log_plan_dump_sample_rate: float = 0.05
+    
+    # 按请求的性能剖析：默认关闭（不注册中间件，零开销）。开启后，带有效
+    # X-Profile-Token 头的请求或按 profiling_sample_rate 抽中的请求会被剖析
+    profiling_enabled: bool = False
+    profiling_secret: str = ""
+    profiling_sample_rate: float = 0.0
+    profiling_interval: float = 0.001
+    profiling_dir: str = "profiles"
+    profiling_format: str = "speedscope"
+    
+    # 响应压缩：超过该字节数的响应按 Accept-Encoding 使用 brotli / gzip
+    compression_minimum_size: int = 1024
+    brotli_quality: int = 4
+    
+    # 行程读缓存：memory（进程内）/ redis（多 worker 共享）/ none
+    trip_cache_backend: str = "memory"
+    trip_cache_max_entries: int = 1024
+    trip_cache_ttl_seconds: int = 300
+    trip_cache_redis_url: str = "redis://localhost:6379/0"
+    
+    # 费用变更推送：memory（进程内）/ redis（多 worker 之间经 pub/sub 广播）
+    expense_events_backend: str = "memory"
+    expense_events_redis_url: str = "redis://localhost:6379/0"
+    expense_events_heartbeat_seconds: int = 15
+    
+    # 准入控制：按类别（llm / map / crud）的令牌桶，格式为 "类别=每秒速率/桶容量"；
+    # 调用方桶按 token 区分，全局桶所有请求共享。大模型在途请求超过上限时直接返回 429
+    admission_enabled: bool = True
+    admission_backend: str = "memory"
+    admission_redis_url: str = "redis://localhost:6379/0"
+    admission_user_limits: str = "llm=0.05/3,map=2/20,crud=20/100"
+    admission_global_limits: str = "llm=2/20,map=50/200,crud=500/2000"
+    admission_llm_max_in_flight: int = 20
+    admission_llm_retry_after_seconds: int = 30
+    
+    # 幂等键：带 Idempotency-Key 的 POST 请求结果保存的时长、执行中占位的最长时长，
+    # 以及相同请求等待其他 worker 执行完成的最长时间（需覆盖一次行程生成）
+    idempotency_backend: str = "memory"
+    idempotency_redis_url: str = "redis://localhost:6379/0"
+    idempotency_max_entries: int = 2000
+    idempotency_ttl_seconds: int = 86400
+    idempotency_pending_ttl_seconds: int = 300
+    idempotency_wait_seconds: float = 120
+    
+    # 请求截止时间：按路由类别（llm / map / bulk / crud）的总时间预算（秒），本请求的所有上游调用共享；
+    # 剩余预算不足 deadline_min_budget_seconds 时不再发起上游调用。单次调用的超时另有上限
+    request_deadlines: str = "llm=120,map=10,bulk=300,crud=15"
+    deadline_min_budget_seconds: float = 0.05
+    supabase_timeout_seconds: float = 10
+    amap_timeout_seconds: float = 5
+    llm_timeout_seconds: float = 120
+    
+    # 行程路线几何：生成或修改行程后在后台计算每天相邻景点间的路线并随行程保存；
+    # 关闭后地图只用直线连接景点。并发数限制同时进行的高德路线请求；
+    # 有路段未取得的天按 retry_seconds 起指数退避，之后打开或修改行程时重新计算
+    route_geometry_enabled: bool = True
+    route_geometry_concurrency: int = 4
+    route_geometry_timeout_seconds: float = 120
+    route_geometry_retry_seconds: float = 60
+    
+    # 生成行程后按地理位置重新分配每天的景点；每天的游玩时长最多超出原计划的 slack 比例
+    day_clustering_enabled: bool = False
+    day_clustering_slack: float = 0.2
+    
+    # 目的地 POI 索引：生成行程时把高德搜索到的景点、餐厅以编号列入提示词，大模型只返回编号；
+    # 搜索结果按 (城市, 关键词) 缓存，后端同行程缓存（memory / redis / none）
+    poi_grounding_enabled: bool = True
+    poi_candidates_per_kind: int = 40
+    poi_cache_backend: str = "memory"
+    poi_cache_max_entries: int = 512
+    poi_cache_ttl_seconds: int = 7 * 24 * 3600
+    poi_cache_redis_url: str = "redis://localhost:6379/0"
+    
     @property
     def cors_origins(self) -> List[str]:
         try:
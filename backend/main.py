@@ -1,18 +1,45 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
+from fastapi.responses import ORJSONResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
+from brotli_asgi import BrotliMiddleware
 from contextlib import asynccontextmanager
+import asyncio
+import logging
 
 from config import settings
-from api import auth, trips, expenses, maps
+from logging_config import setup_logging, shutdown_logging, RequestIdMiddleware
+from api import auth, trips, expenses, maps, data
+from services.trip_cache import trip_cache
+from services.poi_index import poi_index
+from services.expense_events import expense_events
+from services.metrics import MetricsMiddleware, event_loop_monitor, mark_process_dead, metrics_response
+from services.profiling import ProfilingMiddleware, profiling_enabled
+from services.lazy import services_ready, services_status, warm_up
+from services.admission import AdmissionMiddleware, admission_controller
+from services.disconnect import CLIENT_CLOSED_REQUEST, ClientDisconnected
+from services.deadline import DeadlineMiddleware
+from services.route_geometry import route_geometry
+
+setup_logging()
+logger = logging.getLogger(__name__)
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
-    print("🚀 Starting Travel Agent API...")
+    logger.info("Starting Travel Agent API", extra={"env": settings.app_env, "model": settings.openai_model})
+    event_loop_monitor.start()
+    # 服务客户端在后台线程中预热，不阻塞启动：存活探针立即可用，预热完成后就绪探针才通过
+    warm_up_task = asyncio.create_task(asyncio.to_thread(warm_up))
     yield
     # Shutdown
-    print("👋 Shutting down Travel Agent API...")
+    await warm_up_task
+    await route_geometry.close()
+    await event_loop_monitor.stop()
+    mark_process_dead()
+    await expense_events.backend.close()
+    logger.info("Shutting down Travel Agent API")
+    shutdown_logging()
 
 
 app = FastAPI(
@@ -20,8 +47,35 @@ app = FastAPI(
     description="智能旅行规划和管理系统 API",
     version="1.0.0",
     lifespan=lifespan,
+    default_response_class=ORJSONResponse,
 )
 
+@app.exception_handler(ClientDisconnected)
+async def client_disconnected_handler(request: Request, exc: ClientDisconnected):
+    # 客户端已经断开，响应不会被收到，499 只用于访问日志和指标
+    return Response(status_code=CLIENT_CLOSED_REQUEST)
+
+
+# 响应压缩：支持 brotli 的客户端用 br，否则回退 gzip；小响应不压缩
+app.add_middleware(
+    BrotliMiddleware,
+    quality=settings.brotli_quality,
+    minimum_size=settings.compression_minimum_size,
+    gzip_fallback=True,
+    # 导出接口自行决定是否 gzip，避免重复压缩；SSE 需要逐条立即发送，不能缓冲压缩
+    excluded_handlers=[
+        f"{settings.api_prefix}/data/export",
+        f"{settings.api_prefix}/expenses/trip/[^/]+/events$",
+    ],
+)
+
+# 请求截止时间：在准入控制之内，被拒绝的请求不计时
+app.add_middleware(DeadlineMiddleware)
+
+# 准入控制：在 CORS 之内，429 响应同样带上跨域头，前端才能读取 Retry-After
+if settings.admission_enabled:
+    app.add_middleware(AdmissionMiddleware)
+
 # CORS configuration
 app.add_middleware(
     CORSMiddleware,
@@ -29,13 +83,25 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Total-Count", "ETag", "X-Request-ID", "Retry-After", "Idempotent-Replayed"],
 )
 
+# 请求延迟和并发数指标，在压缩之外计时，包含压缩耗时
+app.add_middleware(MetricsMiddleware)
+
+# 按请求的性能剖析，只在配置开启时注册
+if profiling_enabled():
+    app.add_middleware(ProfilingMiddleware)
+
+# 最外层：为每个请求设置 request_id，之后的中间件和路由记录的日志都带上它
+app.add_middleware(RequestIdMiddleware)
+
 # Include routers
 app.include_router(auth.router, prefix=f"{settings.api_prefix}/auth", tags=["认证"])
 app.include_router(trips.router, prefix=f"{settings.api_prefix}/trips", tags=["行程"])
 app.include_router(expenses.router, prefix=f"{settings.api_prefix}/expenses", tags=["费用"])
 app.include_router(maps.router, prefix=f"{settings.api_prefix}/maps", tags=["地图"])
+app.include_router(data.router, prefix=f"{settings.api_prefix}/data", tags=["数据导入导出"])
 
 
 @app.get("/")
@@ -49,21 +115,72 @@ async def root():
 
 @app.get("/health")
 async def health_check():
+    """存活探针：进程能处理请求即可，不检查依赖"""
     return {"status": "healthy"}
 
 
+@app.get("/health/ready")
+async def readiness_check():
+    """就绪探针：必需的服务（Supabase）构造完成前返回 503，负载均衡暂不转发流量"""
+    services = services_status()
+    if services_ready():
+        status = "ready"
+    elif any(s["required"] and s["error"] for s in services.values()):
+        status = "unavailable"
+    else:
+        status = "starting"
+    return ORJSONResponse(
+        {"status": status, "services": services},
+        status_code=200 if status == "ready" else 503,
+    )
+
+
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    """Prometheus 指标（多 worker 模式需要读文件，定义为同步接口在线程池中执行）"""
+    return metrics_response()
+
+
+@app.get("/health/cache")
+async def cache_stats():
+    """行程缓存命中率和淘汰统计"""
+    return {"trip_cache": await trip_cache.stats()}
+
+
+@app.get("/health/admission")
+async def admission_stats():
+    """准入控制的后端和大模型在途请求数"""
+    return {"admission": await admission_controller.stats()}
+
+
+@app.get("/health/poi")
+async def poi_stats():
+    """POI 搜索缓存的命中率"""
+    return {"poi_index": await poi_index.stats()}
+
+
+@app.get("/health/routes")
+async def route_stats():
+    """后台路线计算的任务数和失败统计"""
+    return {"route_geometry": route_geometry.stats()}
+
+
+@app.get("/health/events")
+async def event_stats():
+    """费用变更推送的订阅数和分发统计"""
+    return {"expense_events": expense_events.stats()}
+
+
 if __name__ == "__main__":
     import uvicorn
     
     # 开发环境配置
-    print("=" * 60)
-    print("🚀 启动 AI 智能旅行助手 后端服务")
-    print("=" * 60)
-    print(f"📡 API 文档: http://localhost:8000/docs")
-    print(f"🔍 健康检查: http://localhost:8000/health")
-    print(f"🌍 环境: {settings.app_env}")
-    print(f"🤖 AI 模型: {settings.openai_model}")
-    print("=" * 60)
+    logger.info("启动 AI 智能旅行助手 后端服务", extra={
+        "docs": "http://localhost:8000/docs",
+        "health": "http://localhost:8000/health",
+        "env": settings.app_env,
+        "model": settings.openai_model,
+    })
     
     # 根据环境决定是否启用热重载
     is_dev = settings.app_env == "development"
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Literal
 from datetime import datetime, date
 from enum import Enum
 
@@ -55,6 +55,7 @@ class Attraction(BaseModel):
     duration: int = Field(..., description="建议游玩时长（分钟）")
     estimated_cost: float = Field(default=0, description="预估费用")
     tips: Optional[str] = None
+    pinned: bool = Field(default=False, description="必须安排在当天（与日期相关的活动等），按地理位置重新分配时不移动")
 
 
 # 餐厅信息
@@ -92,6 +93,26 @@ class Transportation(BaseModel):
     notes: Optional[str] = None
 
 
+# 路线几何
+class RouteLeg(BaseModel):
+    """相邻两个景点之间的路线"""
+    distance: float = Field(default=0, description="距离（米）")
+    duration: float = Field(default=0, description="耗时（秒）")
+    polylines: Dict[str, str] = Field(
+        default={},
+        description="按地图缩放级别简化的 encoded polyline，键为缩放级别；为空表示未取得路线"
+    )
+
+
+class DayRoute(BaseModel):
+    """一天的路线：第 i 段连接当天第 i 个和第 i+1 个景点"""
+    stops_key: str = Field(..., description="计算时当天景点坐标序列的摘要，景点变化后路线失效")
+    legs: List[RouteLeg] = []
+    complete: bool = Field(default=True, description="有路段未取得时为 False，到 retry_after 后重新计算这些路段")
+    failures: int = Field(default=0, description="连续未能取全路线的次数，用于退避")
+    retry_after: Optional[float] = Field(default=None, description="下次重试的时间（Unix 时间戳，秒）")
+
+
 # 每日行程
 class DailyItinerary(BaseModel):
     day: int
@@ -101,6 +122,7 @@ class DailyItinerary(BaseModel):
     transportation: List[Transportation] = []
     notes: Optional[str] = None
     total_cost: float = 0
+    route: Optional[DayRoute] = Field(None, description="预先计算的路线，行程生成或修改后在后台计算")
 
 
 # 完整行程规划
@@ -173,6 +195,14 @@ class Expense(ExpenseCreate):
         from_attributes = True
 
 
+# 批量导入费用结果
+class BulkExpenseResponse(BaseModel):
+    success: bool
+    inserted: int
+    error_count: int
+    errors: List[Dict[str, Any]] = Field(default=[], description="逐行错误（行号从 1 开始）")
+
+
 # 费用统计
 class ExpenseSummary(BaseModel):
     trip_id: str
@@ -181,6 +211,30 @@ class ExpenseSummary(BaseModel):
     remaining: float
     by_category: Dict[str, float]
     daily_average: float
+    expense_count: int = 0
+    by_day: Dict[str, float] = Field(default_factory=dict, description="按日期的花费")
+
+
+# 费用时间序列分析
+class ExpenseAnalytics(BaseModel):
+    trip_id: str
+    budget: float
+    total_spent: float
+    expense_count: int
+    total_days: int
+    days_elapsed: int = Field(..., description="已经过去的行程天数")
+    dates: List[str] = Field(..., description="日期轴，覆盖行程及行程外有花费的日期")
+    daily: List[float] = Field(..., description="每日花费")
+    cumulative: List[float] = Field(..., description="累计花费")
+    budget_line: List[float] = Field(..., description="按天折算的累计预算")
+    by_category: Dict[str, List[float]] = Field(..., description="各类别每日花费")
+    category_totals: Dict[str, float]
+    spent_to_date: float
+    budget_to_date: float
+    daily_average: float = Field(..., description="已过行程天数的日均花费")
+    projected_total: float = Field(..., description="按当前日均预测的行程总花费")
+    projected_remaining: float
+    on_track: bool
 
 
 # 用户相关
@@ -198,7 +252,16 @@ class ApiResponse(BaseModel):
     data: Optional[Any] = None
 
 
+# JSON Patch (RFC 6902) 操作
+class JsonPatchOperation(BaseModel):
+    op: Literal["add", "remove", "replace", "move", "copy", "test"]
+    path: str = Field(..., description="JSON Pointer，如 /daily_itineraries/0/restaurants/1")
+    value: Optional[Any] = None
+    from_: Optional[str] = Field(None, alias="from", description="move / copy 的源路径")
+
+
 class TripListResponse(BaseModel):
     trips: List[TripPlan]
-    total: int
+    total: Optional[int] = Field(None, description="总数（仅在请求 count 时返回）")
+    next_cursor: Optional[str] = Field(None, description="下一页游标，为空表示没有更多")
 
@@ -0,0 +1,127 @@
+"""
+数据库行的快速序列化路径
+
+来自我们自己数据库的行在写入前已经过 Pydantic 校验，读取时不再逐层重建模型，
+而是整理成与响应模型字段一致的字典，直接交给 ORJSONResponse 输出。
+严格校验只保留在入站数据（请求体、AI 返回结果）上。
+"""
+import orjson
+from typing import Any, Dict, List
+from pydantic import BaseModel
+from models.schemas import (
+    TripPlan, DailyItinerary, Attraction, Restaurant, Transportation, Accommodation, Expense, DayRoute, RouteLeg
+)
+
+# trips 表中以 JSON 字符串保存的字段
+TRIP_JSON_FIELDS = ("daily_itineraries", "accommodations")
+
+
+def loads_json_field(value: Any) -> Any:
+    """解析 JSON 字符串字段；已经是 list / dict 的原样返回"""
+    if isinstance(value, (str, bytes)):
+        return orjson.loads(value)
+    return value
+
+
+def dumps_json_field(models: List[BaseModel]) -> str:
+    """将嵌套模型列表序列化为入库用的 JSON 字符串"""
+    return orjson.dumps([m.model_dump(mode="json") for m in models]).decode("utf-8")
+
+
+def trip_plan_to_row(trip_plan: TripPlan) -> Dict[str, Any]:
+    """将校验过的 TripPlan 转为入库格式（嵌套结构为 JSON 字符串，不含 id）"""
+    row = trip_plan.model_dump(mode="json", exclude={"id"})
+    row["daily_itineraries"] = dumps_json_field(trip_plan.daily_itineraries)
+    row["accommodations"] = dumps_json_field(trip_plan.accommodations)
+    return row
+
+
+def parse_trip_row(row: Dict[str, Any]) -> Dict[str, Any]:
+    """解析 trips 表一行中的 JSON 字符串字段，保留其余列"""
+    data = dict(row)
+    for key in TRIP_JSON_FIELDS:
+        if key in data:
+            data[key] = loads_json_field(data[key])
+    return data
+
+
+def trip_row_to_dict(row: Dict[str, Any]) -> Dict[str, Any]:
+    """将 trips 表的一行整理为 TripPlan 形状的字典（不做校验）"""
+    data = {key: row[key] for key in TripPlan.model_fields if key in row}
+    for key in TRIP_JSON_FIELDS:
+        if key in data:
+            data[key] = loads_json_field(data[key])
+    return data
+
+
+def expense_row_to_dict(row: Dict[str, Any]) -> Dict[str, Any]:
+    """将 expenses 表的一行整理为 Expense 形状的字典（不做校验）"""
+    return {key: row[key] for key in Expense.model_fields if key in row}
+
+
+def _construct_day_route(route: Any) -> Any:
+    if not route:
+        return None
+    return DayRoute.model_construct(**{
+        **route,
+        "legs": [RouteLeg.model_construct(**leg) for leg in route.get("legs") or []],
+    })
+
+
+def construct_trip_plan(row: Dict[str, Any]) -> TripPlan:
+    """
+    不经校验地构建 TripPlan，嵌套模型同样使用 model_construct
+
+    仅用于可信的数据库行；字段保持数据库 JSON 中的类型（如日期仍为字符串）。
+    """
+    data = trip_row_to_dict(row)
+    data["daily_itineraries"] = [
+        DailyItinerary.model_construct(**{
+            **day,
+            "attractions": [Attraction.model_construct(**a) for a in day.get("attractions") or []],
+            "restaurants": [Restaurant.model_construct(**r) for r in day.get("restaurants") or []],
+            "transportation": [Transportation.model_construct(**t) for t in day.get("transportation") or []],
+            "route": _construct_day_route(day.get("route")),
+        })
+        for day in data.get("daily_itineraries") or []
+    ]
+    data["accommodations"] = [
+        Accommodation.model_construct(**a) for a in data.get("accommodations") or []
+    ]
+    return TripPlan.model_construct(**data)
+
+
+def parse_fields(fields: str) -> Dict[str, Any]:
+    """
+    解析稀疏字段参数，如 "title,daily_itineraries.attractions.name"
+
+    返回嵌套字典：{"title": {}, "daily_itineraries": {"attractions": {"name": {}}}}，
+    空字典表示保留该字段的全部内容。
+    """
+    tree: Dict[str, Any] = {}
+    for item in fields.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        node = tree
+        parts = item.split(".")
+        for i, part in enumerate(parts):
+            if part in node and not node[part]:
+                break  # 已经选择了整个字段
+            if i == len(parts) - 1:
+                node[part] = {}
+            else:
+                node = node.setdefault(part, {})
+    return tree
+
+
+def select_fields(data: Any, tree: Dict[str, Any]) -> Any:
+    """按字段树裁剪数据；列表逐项裁剪"""
+    if not tree:
+        return data
+    if isinstance(data, list):
+        return [select_fields(item, tree) for item in data]
+    if isinstance(data, dict):
+        return {key: select_fields(data[key], sub) for key, sub in tree.items() if key in data}
+    return data
+
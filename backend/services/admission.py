@@ -0,0 +1,344 @@
+"""
+准入控制 - 按调用方和全局的令牌桶限流，大模型积压过多时快速拒绝
+
+请求按路由分为三类，每类有独立的令牌桶：
+- llm：/trips/plan、/expenses/trip/{id}/analyze，每次占用一个大模型调用，耗时可达一分钟
+- map：/maps/...，调用高德接口
+- crud：其余 API
+
+每类同时检查两个桶：调用方桶（同一 token 的请求共享）和全局桶（所有请求共享）。
+llm 类另外统计正在处理的请求数，超过 ADMISSION_LLM_MAX_IN_FLIGHT 时直接拒绝。
+被拒绝的请求返回 429 和 Retry-After，不进入路由、不做鉴权，开销很小，
+生成行程的高峰不会拖慢普通的增删改查。
+
+调用方按 Authorization 头的摘要区分，没有 token 时按客户端 IP：中间件在鉴权之前运行，
+未经校验的 JWT 中的用户 id 可以伪造，用它计数会让别人耗尽某个用户的配额。
+同一用户重新登录换 token 绕过调用方桶的情况由全局桶兜底。
+
+计数后端可插拔：
+- memory：进程内计数，适合单 worker
+- redis：Lua 脚本原子地更新令牌桶，所有 worker 共享同一份计数
+后端故障时放行请求（fail open）并记录日志，限流不可用不应导致服务不可用。
+"""
+import hashlib
+import logging
+import math
+import re
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+import orjson
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from config import settings
+from services.metrics import ADMISSION_REJECTED
+
+logger = logging.getLogger(__name__)
+
+LLM = "llm"
+MAP = "map"
+CRUD = "crud"
+
+# (方法, 路径正则, 类别)，按顺序匹配；不在 API 前缀下的路径（健康检查、指标、文档）不限流
+ROUTE_CLASSES: List[Tuple[str, "re.Pattern[str]", str]] = [
+    ("POST", re.compile(rf"^{re.escape(settings.api_prefix)}/trips/plan/?$"), LLM),
+    ("POST", re.compile(rf"^{re.escape(settings.api_prefix)}/expenses/trip/[^/]+/analyze/?$"), LLM),
+    ("*", re.compile(rf"^{re.escape(settings.api_prefix)}/maps/"), MAP),
+    ("*", re.compile(rf"^{re.escape(settings.api_prefix)}/"), CRUD),
+]
+
+
+@dataclass(frozen=True)
+class BucketLimit:
+    rate: float     # 每秒补充的令牌数
+    burst: int      # 桶容量
+
+    @property
+    def idle_seconds(self) -> float:
+        """空桶补满所需时间，之后的计数状态与新建无异"""
+        return self.burst / self.rate
+
+
+def parse_limits(spec: str) -> Dict[str, BucketLimit]:
+    """解析 "llm=0.05/3,map=2/20" 形式的配置：类别=每秒速率/桶容量"""
+    limits = {}
+    for item in spec.split(","):
+        name, sep, value = item.partition("=")
+        if not sep or not name.strip():
+            continue
+        rate, _, burst = value.partition("/")
+        limits[name.strip()] = BucketLimit(float(rate), int(burst or 1))
+    return limits
+
+
+def classify(method: str, path: str) -> Optional[str]:
+    for route_method, pattern, admission_class in ROUTE_CLASSES:
+        if (route_method == "*" or route_method == method) and pattern.match(path):
+            return admission_class
+    return None
+
+
+class AdmissionBackend:
+    """计数后端接口"""
+
+    name = "base"
+
+    async def take(self, key: str, limit: BucketLimit) -> float:
+        """从桶中取一个令牌；成功返回 0，否则返回需要等待的秒数"""
+        raise NotImplementedError
+
+    async def enter(self, key: str, max_in_flight: int) -> bool:
+        """在途数加一；已达上限时不计入并返回 False"""
+        raise NotImplementedError
+
+    async def leave(self, key: str) -> None:
+        raise NotImplementedError
+
+    async def in_flight(self, key: str) -> int:
+        return 0
+
+
+class MemoryAdmissionBackend(AdmissionBackend):
+    """进程内计数"""
+
+    name = "memory"
+
+    # 每取这么多次令牌清理一次闲置的桶，避免调用方越来越多时字典无限增长
+    PRUNE_EVERY = 1000
+
+    def __init__(self):
+        self._buckets: Dict[str, Tuple[float, float, float]] = {}  # key -> (令牌数, 更新时间, 补满耗时)
+        self._in_flight: Dict[str, int] = {}
+        self._takes = 0
+
+    def _prune(self, now: float) -> None:
+        self._buckets = {
+            key: bucket for key, bucket in self._buckets.items() if now - bucket[1] < bucket[2]
+        }
+
+    async def take(self, key: str, limit: BucketLimit) -> float:
+        now = time.monotonic()
+        self._takes += 1
+        if self._takes % self.PRUNE_EVERY == 0:
+            self._prune(now)
+        tokens, updated, _ = self._buckets.get(key, (float(limit.burst), now, 0.0))
+        tokens = min(float(limit.burst), tokens + (now - updated) * limit.rate)
+        if tokens >= 1:
+            self._buckets[key] = (tokens - 1, now, limit.idle_seconds)
+            return 0.0
+        self._buckets[key] = (tokens, now, limit.idle_seconds)
+        return (1 - tokens) / limit.rate
+
+    async def enter(self, key: str, max_in_flight: int) -> bool:
+        current = self._in_flight.get(key, 0)
+        if current >= max_in_flight:
+            return False
+        self._in_flight[key] = current + 1
+        return True
+
+    async def leave(self, key: str) -> None:
+        self._in_flight[key] = max(0, self._in_flight.get(key, 0) - 1)
+
+    async def in_flight(self, key: str) -> int:
+        return self._in_flight.get(key, 0)
+
+
+# KEYS[1]=桶；ARGV=速率、容量、当前时间（毫秒）。返回需要等待的毫秒数，0 表示成功
+_TAKE_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1]) or burst
+local ts = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate / 1000)
+local wait = 0
+if tokens >= 1 then
+  tokens = tokens - 1
+else
+  wait = math.ceil((1 - tokens) * 1000 / rate)
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst * 1000 / rate) + 1000)
+return wait
+"""
+
+# KEYS[1]=在途计数；ARGV=上限、过期秒数。超过上限时回退并返回 0
+_ENTER_SCRIPT = """
+local current = redis.call('INCR', KEYS[1])
+redis.call('EXPIRE', KEYS[1], tonumber(ARGV[2]))
+if current > tonumber(ARGV[1]) then
+  redis.call('DECR', KEYS[1])
+  return 0
+end
+return 1
+"""
+
+
+class RedisAdmissionBackend(AdmissionBackend):
+    """
+    Redis 计数后端
+
+    令牌桶以 Redis 服务器时间为准，避免各 worker 时钟不一致；
+    在途计数带过期时间，worker 异常退出没来得及减一时不会永久占用名额。
+    """
+
+    name = "redis"
+
+    # 在途计数的过期时间，应大于最长的大模型请求耗时
+    IN_FLIGHT_TTL_SECONDS = 600
+
+    def __init__(self, url: str):
+        try:
+            import redis.asyncio as redis
+        except ImportError:
+            raise ValueError(
+                "ADMISSION_BACKEND=redis 需要安装 redis 包：pip install redis"
+            )
+        self.client = redis.from_url(url)
+        self._take = self.client.register_script(_TAKE_SCRIPT)
+        self._enter = self.client.register_script(_ENTER_SCRIPT)
+
+    async def take(self, key: str, limit: BucketLimit) -> float:
+        seconds, microseconds = await self.client.time()
+        now_ms = int(seconds) * 1000 + int(microseconds) // 1000
+        wait_ms = await self._take(keys=[key], args=[limit.rate, limit.burst, now_ms])
+        return int(wait_ms) / 1000
+
+    async def enter(self, key: str, max_in_flight: int) -> bool:
+        return bool(await self._enter(keys=[key], args=[max_in_flight, self.IN_FLIGHT_TTL_SECONDS]))
+
+    async def leave(self, key: str) -> None:
+        await self.client.decr(key)
+
+    async def in_flight(self, key: str) -> int:
+        return int(await self.client.get(key) or 0)
+
+
+class AdmissionController:
+    """按类别检查调用方桶、大模型积压和全局桶"""
+
+    def __init__(self, backend: AdmissionBackend):
+        self.backend = backend
+        self.user_limits = parse_limits(settings.admission_user_limits)
+        self.global_limits = parse_limits(settings.admission_global_limits)
+        self.max_llm_in_flight = settings.admission_llm_max_in_flight
+        self.errors = 0
+
+    @staticmethod
+    def caller_key(scope: Scope) -> str:
+        for key, value in scope["headers"]:
+            if key == b"authorization":
+                return "t:" + hashlib.sha256(value).hexdigest()[:32]
+        client = scope.get("client")
+        return f"ip:{client[0] if client else 'unknown'}"
+
+    async def admit(self, admission_class: str, caller: str) -> Tuple[Optional[str], float, bool]:
+        """
+        返回 (拒绝原因, Retry-After 秒数, 是否占用了在途名额)；原因为 None 表示放行。
+        占用了在途名额（只有 llm 类会占用）时，处理结束后必须调用 release()；
+        计数失败放行的请求可能没有占用名额，这时不能 release，否则会释放别的请求的名额
+        """
+        entered = False
+        try:
+            user_limit = self.user_limits.get(admission_class)
+            if user_limit is not None:
+                wait = await self.backend.take(f"admission:{admission_class}:{caller}", user_limit)
+                if wait > 0:
+                    return "user_rate", wait, False
+
+            if admission_class == LLM and self.max_llm_in_flight > 0:
+                if not await self.backend.enter("admission:llm:in_flight", self.max_llm_in_flight):
+                    return "llm_backlog", settings.admission_llm_retry_after_seconds, False
+                entered = True
+
+            global_limit = self.global_limits.get(admission_class)
+            if global_limit is not None:
+                wait = await self.backend.take(f"admission:{admission_class}:global", global_limit)
+                if wait > 0:
+                    if entered:
+                        await self.release()
+                    return "global_rate", wait, False
+        except Exception as e:
+            self.errors += 1
+            logger.warning("准入计数失败，放行请求", extra={"error": str(e)})
+        return None, 0.0, entered
+
+    async def release(self) -> None:
+        """归还 admit() 占用的大模型在途名额"""
+        try:
+            await self.backend.leave("admission:llm:in_flight")
+        except Exception as e:
+            self.errors += 1
+            logger.warning("准入计数失败", extra={"error": str(e)})
+
+    async def stats(self) -> Dict[str, object]:
+        try:
+            llm_in_flight = await self.backend.in_flight("admission:llm:in_flight")
+        except Exception:
+            llm_in_flight = None
+        return {
+            "backend": self.backend.name,
+            "llm_in_flight": llm_in_flight,
+            "llm_max_in_flight": self.max_llm_in_flight,
+            "errors": self.errors,
+        }
+
+
+class AdmissionMiddleware:
+    """在路由和鉴权之前做准入判断，拒绝时直接返回 429"""
+
+    def __init__(self, app: ASGIApp, controller: "AdmissionController" = None):
+        self.app = app
+        self.controller = controller or admission_controller
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["method"] == "OPTIONS":
+            await self.app(scope, receive, send)
+            return
+        admission_class = classify(scope["method"], scope["path"])
+        if admission_class is None:
+            await self.app(scope, receive, send)
+            return
+
+        reason, retry_after, entered = await self.controller.admit(
+            admission_class, self.controller.caller_key(scope)
+        )
+        if reason is not None:
+            ADMISSION_REJECTED.labels(admission_class, reason).inc()
+            await self._reject(send, admission_class, reason, retry_after)
+            return
+        if not entered:
+            await self.app(scope, receive, send)
+            return
+
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            await self.controller.release()
+
+    @staticmethod
+    async def _reject(send: Send, admission_class: str, reason: str, retry_after: float) -> None:
+        detail = "AI 服务繁忙，请稍后重试" if reason == "llm_backlog" else "请求过于频繁，请稍后重试"
+        body = orjson.dumps({"detail": detail, "reason": reason, "class": admission_class})
+        await send({
+            "type": "http.response.start",
+            "status": 429,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode("latin-1")),
+                (b"retry-after", str(max(1, math.ceil(retry_after))).encode("latin-1")),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+
+def _create_backend() -> AdmissionBackend:
+    if settings.admission_backend.lower() == "redis":
+        return RedisAdmissionBackend(settings.admission_redis_url)
+    return MemoryAdmissionBackend()
+
+
+# 单例实例
+admission_controller = AdmissionController(_create_backend())
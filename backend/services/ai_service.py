@@ -1,10 +1,22 @@
-from openai import AsyncOpenAI
 from config import settings
+from services.lazy import LazyService
+from services.metrics import LLM_CANCELLED, LLM_COMPLETION_TOKENS, LLM_TOKENS_SAVED, observe_upstream
+from services.deadline import DeadlineExceeded, upstream_deadline
+from services.poi_index import PoiCandidates, poi_index
 from models.schemas import TripPlanRequest, TripPlan, DailyItinerary, Attraction, Restaurant, Accommodation, Transportation
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional
+import asyncio
 import json
+import logging
+import orjson
+import time
 from datetime import timedelta
 
+logger = logging.getLogger(__name__)
+
+# 各操作平均输出 token 数的平滑系数，用于估算取消调用节省的 token
+OUTPUT_TOKENS_EWMA_ALPHA = 0.2
+
 
 class AIService:
     def __init__(self):
@@ -26,48 +38,190 @@ class AIService:
                 "=" * 60
             )
         
+        # openai 包导入较慢，构造服务时才导入
+        from openai import AsyncOpenAI
+        
         self.client = AsyncOpenAI(
             api_key=settings.openai_api_key,
             base_url=settings.openai_base_url
         )
+        self._average_output_tokens: Dict[str, float] = {}
+    
+    def _record_output(self, operation: str, tokens: int) -> None:
+        LLM_COMPLETION_TOKENS.labels(operation).inc(tokens)
+        average = self._average_output_tokens.get(operation)
+        if average is None:
+            self._average_output_tokens[operation] = float(tokens)
+        else:
+            self._average_output_tokens[operation] = average + OUTPUT_TOKENS_EWMA_ALPHA * (tokens - average)
+    
+    def _record_cancelled(self, operation: str, generated: int, reason: str) -> None:
+        """记录被取消的调用：已生成的部分照常计费，节省的是平均输出量减去已生成的部分"""
+        LLM_CANCELLED.labels(operation, reason).inc()
+        LLM_COMPLETION_TOKENS.labels(operation).inc(generated)
+        saved = max(0.0, self._average_output_tokens.get(operation, 0.0) - generated)
+        LLM_TOKENS_SAVED.labels(operation, reason).inc(saved)
+        logger.info("大模型调用已取消", extra={
+            "operation": operation,
+            "reason": reason,
+            "generated_tokens": generated,
+            "saved_tokens": round(saved),
+        })
+    
+    async def _stream_completion(self, operation: str, messages: List[Dict[str, str]]) -> str:
+        """
+        流式调用大模型并拼接输出
+        
+        被取消（客户端断开）或超过请求截止时间时关闭连接，上游随即停止生成，剩余的输出不再计费。
+        SDK 的流式迭代为每个分片构造一次 pydantic 模型（约 0.3ms），一次行程生成有上千个
+        分片，会长时间占用事件循环；这里取原始响应，用 orjson 直接解析 SSE 数据行。
+        流式接口不返回 usage，输出 token 数按分片数估算（每个分片通常是一个 token）。
+        """
+        parts: List[str] = []
+        response = None
+        try:
+            with observe_upstream("llm", operation):
+                async with upstream_deadline("llm", operation, settings.llm_timeout_seconds) as timeout:
+                    raw = await self.client.chat.completions.with_raw_response.create(
+                        model=settings.openai_model,
+                        messages=messages,
+                        temperature=0.7,
+                        response_format={"type": "json_object"},
+                        stream=True,
+                        timeout=timeout
+                    )
+                    response = raw.http_response
+                    async for line in response.aiter_lines():
+                        if not line.startswith("data:"):
+                            continue
+                        data = line[5:].strip()
+                        if data == "[DONE]":
+                            break
+                        choices = orjson.loads(data).get("choices")
+                        if choices and choices[0].get("delta", {}).get("content"):
+                            parts.append(choices[0]["delta"]["content"])
+        except asyncio.CancelledError:
+            self._record_cancelled(operation, len(parts), "disconnect")
+            raise
+        except DeadlineExceeded:
+            self._record_cancelled(operation, len(parts), "deadline")
+            raise
+        finally:
+            if response is not None:
+                await response.aclose()
+        
+        self._record_output(operation, len(parts))
+        return "".join(parts)
     
     async def generate_trip_plan(self, request: TripPlanRequest, user_id: str) -> TripPlan:
         """使用 AI 生成旅行计划"""
         
+        # 目的地的候选景点和餐厅，大模型只需返回编号
+        candidates = None
+        if settings.poi_grounding_enabled:
+            candidates = await poi_index.candidates(request.destination, request.preferences)
+        
         # 构建提示词
-        prompt = self._build_trip_planning_prompt(request)
-        
-        # 调用 OpenAI API
-        response = await self.client.chat.completions.create(
-            model=settings.openai_model,
-            messages=[
-                {
-                    "role": "system",
-                    "content": "你是一个专业的旅行规划师，精通全球各地的旅游信息。你需要根据用户的需求，生成详细、实用、个性化的旅行计划。请以 JSON 格式返回结果。"
-                },
-                {
-                    "role": "user",
-                    "content": prompt
-                }
-            ],
-            temperature=0.7,
-            response_format={"type": "json_object"}
-        )
+        prompt = self._build_trip_planning_prompt(request, candidates)
+        
+        # 调用 OpenAI API（流式，客户端断开时可以中途停止生成）
+        content = await self._stream_completion("generate_trip_plan", [
+            {
+                "role": "system",
+                "content": "你是一个专业的旅行规划师，精通全球各地的旅游信息。你需要根据用户的需求，生成详细、实用、个性化的旅行计划。请以 JSON 格式返回结果。"
+            },
+            {
+                "role": "user",
+                "content": prompt
+            }
+        ])
         
         # 解析响应
-        ai_response = json.loads(response.choices[0].message.content)
+        ai_response = json.loads(content)
         
         # 构建 TripPlan 对象
-        trip_plan = self._build_trip_plan_from_ai_response(ai_response, request, user_id)
+        trip_plan = self._build_trip_plan_from_ai_response(ai_response, request, user_id, candidates)
+        if candidates:
+            logger.info("候选 POI 编号已展开", extra={
+                "attraction_candidates": candidates.attraction_count,
+                "restaurant_candidates": candidates.restaurant_count,
+                "expanded": candidates.expanded,
+                "unknown": candidates.unknown,
+            })
+        
+        if settings.day_clustering_enabled:
+            self._cluster_days(trip_plan)
         
         return trip_plan
     
-    def _build_trip_planning_prompt(self, request: TripPlanRequest) -> str:
-        """构建行程规划提示词"""
+    def _cluster_days(self, trip_plan: TripPlan) -> None:
+        """按地理位置重新分配每天的景点（见 services/day_clustering.py）"""
+        # day_clustering 依赖 numpy，只在开启分组时导入
+        from services.day_clustering import cluster_days
+
+        started = time.perf_counter()
+        days = cluster_days(trip_plan.daily_itineraries, settings.day_clustering_slack)
+        if days is not None:
+            trip_plan.daily_itineraries = days
+        logger.info("行程景点按地理位置分组", extra={
+            "changed": days is not None,
+            "attractions": sum(len(day.attractions) for day in trip_plan.daily_itineraries),
+            "duration_ms": round((time.perf_counter() - started) * 1000, 2),
+        })
+    
+    def _build_trip_planning_prompt(self, request: TripPlanRequest, candidates: Optional[PoiCandidates] = None) -> str:
+        """构建行程规划提示词；有候选 POI 时景点和餐厅只输出候选编号"""
         days = (request.end_date - request.start_date).days + 1
         preferences_text = "、".join([p.value for p in request.preferences]) if request.preferences else "无特殊偏好"
         children_text = "是" if request.has_children else "否"
         
+        if candidates:
+            attraction_lines, restaurant_lines = candidates.prompt_lines()
+            candidates_text = f"""
+**候选景点**（编号 名称｜区域｜类别｜参考价格）：
+{attraction_lines}
+
+**候选餐厅**：
+{restaurant_lines}
+
+景点和餐厅请优先从候选中选择，只输出编号 poi，名称、地址和坐标由系统补全；
+候选中没有合适的才按完整格式（name、address、latitude、longitude 等）输出。
+"""
+            attraction_format = """{
+          "poi": "候选景点编号，如 a1",
+          "duration": 游玩时长（分钟）,
+          "estimated_cost": 门票（元，候选有参考价格时可省略）,
+          "tips": "游玩建议",
+          "pinned": true（可选，仅与日期相关、必须安排在当天的活动填写）
+        }"""
+            restaurant_format = """{
+          "poi": "候选餐厅编号，如 r1",
+          "estimated_cost": 人均消费（候选有参考价格时可省略）,
+          "recommendations": "推荐菜品"
+        }"""
+        else:
+            candidates_text = ""
+            attraction_format = """{
+          "name": "景点名称",
+          "description": "景点描述",
+          "address": "详细地址",
+          "latitude": 纬度（数字）,
+          "longitude": 经度（数字）,
+          "duration": 游玩时长（分钟）,
+          "estimated_cost": 预估费用（元）,
+          "tips": "游玩建议",
+          "pinned": true（可选，仅与日期相关、必须安排在当天的活动填写）
+        }"""
+            restaurant_format = """{
+          "name": "餐厅名称",
+          "cuisine_type": "菜系",
+          "address": "详细地址",
+          "latitude": 纬度,
+          "longitude": 经度,
+          "estimated_cost": 人均消费,
+          "recommendations": "推荐菜品"
+        }"""
+        
         prompt = f"""
 请为我规划一个详细的旅行计划：
 
@@ -79,7 +233,7 @@ class AIService:
 - 旅行偏好：{preferences_text}
 - 是否带孩子：{children_text}
 {f"- 额外说明：{request.additional_notes}" if request.additional_notes else ""}
-
+{candidates_text}
 **请提供以下内容：**
 
 1. 每日详细行程（包括景点、餐厅、交通）
@@ -98,27 +252,10 @@ class AIService:
       "day": 1,
       "date": "YYYY-MM-DD",
       "attractions": [
-        {{
-          "name": "景点名称",
-          "description": "景点描述",
-          "address": "详细地址",
-          "latitude": 纬度（数字）,
-          "longitude": 经度（数字）,
-          "duration": 游玩时长（分钟）,
-          "estimated_cost": 预估费用（元）,
-          "tips": "游玩建议"
-        }}
+        {attraction_format}
       ],
       "restaurants": [
-        {{
-          "name": "餐厅名称",
-          "cuisine_type": "菜系",
-          "address": "详细地址",
-          "latitude": 纬度,
-          "longitude": 经度,
-          "estimated_cost": 人均消费,
-          "recommendations": "推荐菜品"
-        }}
+        {restaurant_format}
       ],
       "transportation": [
         {{
@@ -171,13 +308,21 @@ class AIService:
         self, 
         ai_response: Dict[str, Any], 
         request: TripPlanRequest, 
-        user_id: str
+        user_id: str,
+        candidates: Optional[PoiCandidates] = None
     ) -> TripPlan:
         """从 AI 响应构建 TripPlan 对象"""
         
         # 解析每日行程
         daily_itineraries = []
         for day_data in ai_response.get("daily_itineraries", []):
+            if candidates:
+                # 展开候选编号，不存在的编号丢弃
+                day_data = {
+                    **day_data,
+                    "attractions": [a for a in map(candidates.attraction, day_data.get("attractions", [])) if a],
+                    "restaurants": [r for r in map(candidates.restaurant, day_data.get("restaurants", [])) if r],
+                }
             daily_itineraries.append(DailyItinerary(**day_data))
         
         # 解析住宿
@@ -231,19 +376,14 @@ class AIService:
 请以 JSON 格式返回，包含 analysis（分析文本）和 suggestions（建议列表）字段。
 """
         
-        response = await self.client.chat.completions.create(
-            model=settings.openai_model,
-            messages=[
-                {"role": "system", "content": "你是一个专业的旅行预算分析师。"},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.7,
-            response_format={"type": "json_object"}
-        )
+        content = await self._stream_completion("analyze_budget", [
+            {"role": "system", "content": "你是一个专业的旅行预算分析师。"},
+            {"role": "user", "content": prompt}
+        ])
         
-        return json.loads(response.choices[0].message.content)
+        return json.loads(content)
 
 
 # 单例实例
-ai_service = AIService()
+ai_service: AIService = LazyService("ai", AIService, required=False)
 
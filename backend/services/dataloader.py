@@ -0,0 +1,125 @@
+"""
+请求级 DataLoader - 合并、去重一次请求内的数据读取
+
+- 同一请求内对同一个 key 的重复读取只查询一次（结果按 key 缓存）
+- 同一轮事件循环内对多个 id 的单条查询合并为一次 in_() 查询
+- 配合 asyncio.gather，互不依赖的读取并发执行
+
+用法：
+    loaders = RequestLoaders(user_id)
+    trip, totals = await asyncio.gather(
+        loaders.trip.load(trip_id),
+        loaders.expense_totals.load(trip_id),
+    )
+
+加载器只在单个请求内使用，不跨请求共享，因此不会读到其他请求写入前的旧数据。
+"""
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Generic, Hashable, List, Optional, Tuple, TypeVar
+from services.supabase_service import supabase_service
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+BatchLoadFn = Callable[[List[K]], Awaitable[Dict[K, V]]]
+
+
+class DataLoader(Generic[K, V]):
+    """
+    按 key 批量加载数据
+
+    load() 同步登记 key 并返回 Future；当前这轮事件循环结束后，
+    所有登记的 key 一起交给 batch_load，结果按 key 分发。
+    batch_load 返回 {key: value}，缺失的 key 得到 None。
+    """
+
+    def __init__(self, batch_load: BatchLoadFn, max_batch_size: int = 100):
+        self._batch_load = batch_load
+        self.max_batch_size = max_batch_size
+        self._cache: Dict[K, asyncio.Future] = {}
+        self._queue: List[K] = []
+
+    def load(self, key: K) -> "asyncio.Future[Optional[V]]":
+        future = self._cache.get(key)
+        if future is not None:
+            return future
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._cache[key] = future
+        self._queue.append(key)
+        if len(self._queue) == 1:
+            loop.call_soon(self._dispatch)
+        return future
+
+    async def load_many(self, keys: List[K]) -> List[Optional[V]]:
+        return list(await asyncio.gather(*(self.load(key) for key in keys)))
+
+    def prime(self, key: K, value: V) -> None:
+        """写入已知结果（例如刚从其他查询得到的数据），之后的 load 不再查询"""
+        if key not in self._cache:
+            future = asyncio.get_running_loop().create_future()
+            future.set_result(value)
+            self._cache[key] = future
+
+    def clear(self, key: K) -> None:
+        """写操作之后清除对应 key，下次 load 重新查询"""
+        self._cache.pop(key, None)
+
+    def _dispatch(self) -> None:
+        keys, self._queue = self._queue, []
+        for start in range(0, len(keys), self.max_batch_size):
+            asyncio.ensure_future(self._run(keys[start:start + self.max_batch_size]))
+
+    async def _run(self, keys: List[K]) -> None:
+        try:
+            results = await self._batch_load(keys)
+        except Exception as e:
+            for key in keys:
+                # 失败的结果不缓存，允许重试
+                future = self._cache.pop(key, None)
+                if future is not None and not future.done():
+                    future.set_exception(e)
+            return
+        for key in keys:
+            future = self._cache.get(key)
+            if future is not None and not future.done():
+                future.set_result(results.get(key))
+
+
+def each(load_one: Callable[[K], Awaitable[V]]) -> BatchLoadFn:
+    """无法合并为一次查询的读取：对每个 key 并发调用一次"""
+    async def batch_load(keys: List[K]) -> Dict[K, V]:
+        values = await asyncio.gather(*(load_one(key) for key in keys))
+        return dict(zip(keys, values))
+    return batch_load
+
+
+class RequestLoaders:
+    """一次请求内使用的全部加载器，均限定在当前用户的数据范围内"""
+
+    def __init__(self, user_id: str):
+        self.user_id = user_id
+        self.trip: DataLoader[str, Dict[str, Any]] = DataLoader(self._load_trips)
+        self.trip_version: DataLoader[str, str] = DataLoader(
+            lambda ids: supabase_service.get_trip_versions(ids, user_id)
+        )
+        self.expenses: DataLoader[str, List[Dict[str, Any]]] = DataLoader(
+            each(lambda trip_id: supabase_service.get_trip_expenses(trip_id, user_id))
+        )
+        self.expense_totals: DataLoader[str, Dict[str, Any]] = DataLoader(
+            each(lambda trip_id: supabase_service.get_expense_totals(trip_id, user_id))
+        )
+        self.expenses_version: DataLoader[str, Tuple[int, Optional[str]]] = DataLoader(
+            each(lambda trip_id: supabase_service.get_expenses_version(trip_id, user_id))
+        )
+
+    async def _load_trips(self, trip_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """
+        先取行程在数据库中的当前 updated_at（与 ETag 校验共用 trip_version，同一请求只查一次），
+        再按版本校验读缓存：其他 worker 修改了预算、天数等之后不会返回缓存中的旧行
+        """
+        versions = await self.trip_version.load_many(trip_ids)
+        return await supabase_service.get_trips_by_ids(trip_ids, self.user_id, versions={
+            trip_id: version for trip_id, version in zip(trip_ids, versions) if version is not None
+        })
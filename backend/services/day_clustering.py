@@ -0,0 +1,176 @@
+"""
+按地理位置重新分配每天的景点
+
+大模型经常把城市两端的景点排在同一天、相邻的景点排在不同的天，路上的时间被拉长。
+生成行程后（DAY_CLUSTERING_ENABLED 开启时）把所有景点按坐标做带容量约束的 k-means，
+分成 total_days 组，再放回各天：
+- 初始中心取大模型原本每天景点的中心，第 j 组仍对应第 j 天，餐厅、交通和备注留在原处
+- 每天的容量是大模型原本安排的游玩时长之和，允许超出 DAY_CLUSTERING_SLACK 的比例，
+  任何一天都不会比原计划重太多（可能变轻）
+- 标记为 pinned 的景点（与日期相关的活动等）和没有有效坐标的景点不移动，占用当天的容量
+- 分配时按“最近与次近中心的距离差”从大到小依次放入仍有容量的最近一组
+  （差距大的景点放错代价最大，先分配）；距离矩阵、排序和中心更新是向量化计算，
+  逐个放入受容量约束、前后依赖，是一个小规模的 Python 循环
+- 分组后各天景点离中心的距离平方和没有减少时保留原计划
+移到新一天的景点按插入代价最小的位置插入，留在原来一天的景点保持原顺序。
+"""
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from models.schemas import Attraction, DailyItinerary
+from services.route_geometry import METERS_PER_DEGREE_LAT, METERS_PER_DEGREE_LNG
+
+# k-means 的最大迭代次数，分配不再变化时提前结束
+MAX_ITERATIONS = 20
+
+
+def _has_coordinates(attraction: Attraction) -> bool:
+    return -90 <= attraction.latitude <= 90 and -180 <= attraction.longitude <= 180 and (
+        attraction.latitude != 0 or attraction.longitude != 0
+    )
+
+
+def _assign(
+    distances: np.ndarray,
+    weights: np.ndarray,
+    capacity: np.ndarray,
+    fixed: np.ndarray,
+) -> np.ndarray:
+    """
+    带容量约束的贪心分配；fixed 中 >= 0 的点固定在该组
+
+    排序（regret、每个点的候选组顺序）是向量化的；放入哪一组取决于前面的点占用的容量，
+    只能逐个决定，这里有意保留 Python 循环。景点数是一次行程的量级（几十到几百个），
+    循环在转换成列表后进行，避免逐个访问 numpy 标量的开销。
+    """
+    groups = distances.shape[1]
+    labels = fixed.copy()
+    load = np.bincount(labels[labels >= 0], weights=weights[labels >= 0], minlength=groups).tolist()
+    limit = capacity.tolist()
+
+    free = np.flatnonzero(fixed < 0)
+    if groups > 1:
+        nearest_two = np.partition(distances[free], 1, axis=1)[:, :2]
+        regret = nearest_two[:, 1] - nearest_two[:, 0]
+    else:
+        regret = np.zeros(len(free))
+    order = np.argsort(-regret, kind="stable")
+    preference = np.argsort(distances[free], axis=1)[order].tolist()
+    indices = free[order].tolist()
+    point_weights = weights[free[order]].tolist()
+
+    for index, weight, candidates in zip(indices, point_weights, preference):
+        for group in candidates:
+            if load[group] + weight <= limit[group]:
+                break
+        else:
+            # 没有一组放得下时放入超出最少的一组
+            group = min(range(groups), key=lambda g: load[g] + weight - limit[g])
+        labels[index] = group
+        load[group] += weight
+    return labels
+
+
+def _spread(points: np.ndarray, labels: np.ndarray, groups: int) -> float:
+    """各组内点到组中心的距离平方和"""
+    total = 0.0
+    for group in range(groups):
+        members = points[labels == group]
+        if len(members):
+            total += float(((members - members.mean(axis=0)) ** 2).sum())
+    return total
+
+
+def _insertion_order(
+    points: np.ndarray, kept: List[int], moved: List[int]
+) -> List[int]:
+    """原有景点保持顺序，新移入的景点依次插入使路程增加最少的位置"""
+    order = list(kept)
+    for index in moved:
+        if not order:
+            order.append(index)
+            continue
+        path = points[order]
+        to_new = np.hypot(*(path - points[index]).T)
+        # 插在开头、末尾或相邻两点之间的路程增量
+        between = to_new[:-1] + to_new[1:] - np.hypot(*(path[1:] - path[:-1]).T)
+        costs = np.concatenate(([to_new[0]], between, [to_new[-1]]))
+        order.insert(int(np.argmin(costs)), index)
+    return order
+
+
+def cluster_days(days: List[DailyItinerary], slack: float) -> Optional[List[DailyItinerary]]:
+    """
+    按地理位置重新分配景点，返回新的每日行程；不需要或无法改善时返回 None
+
+    days 中的景点不会被修改，返回的每日行程是浅拷贝。
+    """
+    groups = len(days)
+    entries: List[Tuple[int, Attraction]] = [
+        (day_index, attraction)
+        for day_index, day in enumerate(days)
+        for attraction in day.attractions
+    ]
+    if groups < 2 or len(entries) <= groups:
+        return None
+
+    original = np.array([day_index for day_index, _ in entries])
+    attractions = [attraction for _, attraction in entries]
+    lnglat = np.array([[a.longitude, a.latitude] for a in attractions], dtype=np.float64)
+    weights = np.array([max(a.duration, 1) for a in attractions], dtype=np.float64)
+    movable = np.array([_has_coordinates(a) and not a.pinned for a in attractions])
+    if movable.sum() < 2:
+        return None
+
+    # 以可移动景点的中心为原点投影到平面（米）
+    origin = lnglat[movable].mean(axis=0)
+    points = np.empty_like(lnglat)
+    points[:, 0] = (lnglat[:, 0] - origin[0]) * METERS_PER_DEGREE_LNG * np.cos(np.radians(origin[1]))
+    points[:, 1] = (lnglat[:, 1] - origin[1]) * METERS_PER_DEGREE_LAT
+    # 没有坐标的景点不参与中心和距离计算，排序时视为在城市中心
+    located = np.array([_has_coordinates(a) for a in attractions])
+    points[~located] = 0
+
+    capacity = np.bincount(original, weights=weights, minlength=groups) * (1 + slack)
+    fixed = np.where(movable, -1, original)
+
+    # 初始中心：原计划各天的中心；当天没有有坐标的景点时取整体中心
+    centers = np.zeros((groups, 2))
+    for group in range(groups):
+        members = points[(original == group) & located]
+        if len(members):
+            centers[group] = members.mean(axis=0)
+
+    labels = original
+    for _ in range(MAX_ITERATIONS):
+        distances = np.hypot(
+            points[:, None, 0] - centers[None, :, 0],
+            points[:, None, 1] - centers[None, :, 1],
+        )
+        new_labels = _assign(distances, weights, capacity, fixed)
+        if np.array_equal(new_labels, labels):
+            break
+        labels = new_labels
+        # 按游玩时长加权更新中心，空组保留原中心
+        for group in range(groups):
+            mask = (labels == group) & located
+            if mask.any():
+                centers[group] = np.average(points[mask], axis=0, weights=weights[mask])
+
+    if np.array_equal(labels, original):
+        return None
+    if _spread(points[located], labels[located], groups) >= _spread(points[located], original[located], groups):
+        return None
+
+    result = []
+    for group, day in enumerate(days):
+        kept = [i for i in np.flatnonzero(labels == group) if original[i] == group]
+        moved = [i for i in np.flatnonzero(labels == group) if original[i] != group]
+        order = _insertion_order(points, kept, moved)
+        result.append(day.model_copy(update={
+            "attractions": [attractions[i] for i in order],
+            # 景点变化后原来的路线失效
+            "route": None,
+        }))
+    return result
@@ -0,0 +1,153 @@
+"""
+请求截止时间 - 一个请求内的所有上游调用共享同一个时间预算
+
+请求进入时按路由类别（llm / map / crud 同准入控制，批量导入导出单独归为 bulk）从
+REQUEST_DEADLINES 取得预算，截止时间保存在 contextvar 中，对本请求创建的任务和线程池
+调用同样可见。每次上游调用
+（Supabase、高德、大模型）的超时取“该上游的超时上限”和“剩余预算”中的较小者：
+- 剩余预算不足 DEADLINE_MIN_BUDGET_SECONDS 时不再发起调用，直接失败（stage=skipped）
+- 调用因剩余预算用尽而中止（stage=timeout）
+
+两种情况都抛出 DeadlineExceeded（504），并计入 upstream_deadline_exceeded_total。
+只是触及该上游自己的超时上限、请求预算还有剩余时，原来的超时异常照常抛出，
+由调用方按普通的上游失败处理（例如 POI 搜索返回空、行程生成不带候选继续进行）。
+不在请求中（预热、后台任务）时没有截止时间，只受各上游的超时上限约束。
+"""
+import asyncio
+import re
+import time
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+import httpx
+from fastapi import HTTPException
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from config import settings
+from services.admission import classify
+from services.metrics import DEADLINE_EXCEEDED
+
+BULK = "bulk"
+
+# 批量导入导出按数据量可能持续数分钟，不适用普通 CRUD 的预算；其余路由沿用准入控制的分类
+BULK_ROUTES: List[Tuple[str, "re.Pattern[str]"]] = [
+    ("POST", re.compile(rf"^{re.escape(settings.api_prefix)}/data/import/?$")),
+    ("GET", re.compile(rf"^{re.escape(settings.api_prefix)}/data/export/?$")),
+    ("POST", re.compile(rf"^{re.escape(settings.api_prefix)}/expenses/bulk/?$")),
+]
+
+# 当前请求的截止时间（time.monotonic() 时刻），不在请求中时为 None
+_deadline: ContextVar[Optional[float]] = ContextVar("request_deadline", default=None)
+
+
+class DeadlineExceeded(HTTPException):
+    """请求的时间预算已用尽，上游调用未发起或已中止"""
+
+    def __init__(self, upstream: str, operation: str):
+        super().__init__(status_code=504, detail=f"请求超时：{upstream} 调用未能在截止时间前完成")
+        self.upstream = upstream
+        self.operation = operation
+
+    def __str__(self) -> str:
+        return self.detail
+
+
+def parse_deadlines(spec: str) -> Dict[str, float]:
+    """解析 "llm=120,map=10,bulk=300,crud=15" 形式的配置：类别=秒数"""
+    deadlines = {}
+    for item in spec.split(","):
+        name, sep, value = item.partition("=")
+        if not sep or not name.strip():
+            continue
+        deadlines[name.strip()] = float(value)
+    return deadlines
+
+
+def deadline_class(method: str, path: str) -> Optional[str]:
+    for route_method, pattern in BULK_ROUTES:
+        if route_method == method and pattern.match(path):
+            return BULK
+    return classify(method, path)
+
+
+def remaining() -> Optional[float]:
+    """当前请求剩余的秒数；不在请求中时为 None"""
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+def within_deadline(limit: float) -> float:
+    """上游超时上限和剩余预算中的较小者，不检查预算是否已用尽"""
+    left = remaining()
+    if left is None:
+        return limit
+    return max(0.0, min(limit, left))
+
+
+def start_deadline(seconds: Optional[float]) -> None:
+    """
+    为当前上下文设置新的截止时间（None 为不限）
+
+    请求中创建的后台任务继承了请求的 contextvar 副本（包括截止时间），
+    在任务开头调用它换成任务自己的预算，不影响发起任务的请求。
+    """
+    _deadline.set(None if seconds is None else time.monotonic() + seconds)
+
+
+def call_timeout(upstream: str, operation: str, limit: float) -> float:
+    """本次上游调用可用的超时；剩余预算不足时不发起调用，抛出 DeadlineExceeded"""
+    left = remaining()
+    if left is not None and left < settings.deadline_min_budget_seconds:
+        DEADLINE_EXCEEDED.labels(upstream, operation, "skipped").inc()
+        raise DeadlineExceeded(upstream, operation)
+    return within_deadline(limit)
+
+
+@asynccontextmanager
+async def upstream_deadline(upstream: str, operation: str, limit: float) -> AsyncIterator[float]:
+    """
+    在截止时间内完成一次上游调用，超时即中止：
+        async with upstream_deadline("amap", "geocode", settings.amap_timeout_seconds) as timeout:
+            response = await client.get(url, timeout=timeout)
+
+    超时发生在请求预算用尽时抛出 DeadlineExceeded；只是触及上游的超时上限时
+    原样抛出 TimeoutError / httpx.TimeoutException。
+    """
+    timeout = call_timeout(upstream, operation, limit)
+    try:
+        # asyncio.timeout 需要 Python 3.11+（与 Dockerfile 一致，文档中的最低版本同样为 3.11）
+        async with asyncio.timeout(timeout):
+            yield timeout
+    except (TimeoutError, httpx.TimeoutException):
+        left = remaining()
+        if left is None or left >= settings.deadline_min_budget_seconds:
+            raise
+        DEADLINE_EXCEEDED.labels(upstream, operation, "timeout").inc()
+        raise DeadlineExceeded(upstream, operation)
+
+
+class DeadlineMiddleware:
+    """按路由类别为请求设置截止时间"""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+        self.deadlines = parse_deadlines(settings.request_deadlines)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        budget = self.deadlines.get(deadline_class(scope["method"], scope["path"]))
+        if budget is None:
+            await self.app(scope, receive, send)
+            return
+
+        token = _deadline.set(time.monotonic() + budget)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _deadline.reset(token)
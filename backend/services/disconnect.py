@@ -0,0 +1,67 @@
+"""
+客户端断开检测 - 长耗时接口在客户端断开后取消正在进行的上游调用
+
+用户在行程生成（可能长达一分钟）期间关闭页面时，服务端默认会把大模型调用跑完、
+把结果保存成一个没人要的行程，输出 token 照常计费。cancel_on_disconnect 在执行
+操作的同时监听 ASGI 的 http.disconnect 消息，客户端一断开就取消操作：
+- 大模型流式调用在取消时关闭连接，上游随即停止生成（见 AIService）
+- 高德请求的 httpx 客户端在取消时关闭连接
+- 尚未执行的保存等后续步骤不再执行
+
+取消后抛出 ClientDisconnected，由全局异常处理返回 499（响应不会被客户端收到，
+只用于访问日志和指标）。断开次数按路由模板计入 client_disconnects_total。
+"""
+import asyncio
+import logging
+from typing import Awaitable, TypeVar
+
+from fastapi import Request
+
+from services.metrics import CLIENT_DISCONNECTS
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# nginx 约定的“客户端关闭连接”状态码
+CLIENT_CLOSED_REQUEST = 499
+
+
+class ClientDisconnected(Exception):
+    """客户端在操作完成前断开，操作已被取消"""
+
+
+async def _wait_for_disconnect(request: Request) -> None:
+    # 请求体已被 FastAPI 读完，之后 receive 只会在客户端断开（或响应结束）时返回
+    while True:
+        message = await request.receive()
+        if message["type"] == "http.disconnect":
+            return
+
+
+async def cancel_on_disconnect(request: Request, operation: Awaitable[T]) -> T:
+    """执行 operation，客户端先断开时取消它并抛出 ClientDisconnected"""
+    work = asyncio.ensure_future(operation)
+    watcher = asyncio.ensure_future(_wait_for_disconnect(request))
+    try:
+        await asyncio.wait({work, watcher}, return_when=asyncio.FIRST_COMPLETED)
+    except asyncio.CancelledError:
+        work.cancel()
+        watcher.cancel()
+        raise
+
+    if work.done():
+        watcher.cancel()
+        return work.result()
+
+    work.cancel()
+    try:
+        # 等待取消完成，让上游连接在返回前关闭
+        await work
+    except BaseException:
+        pass
+
+    route = getattr(request.scope.get("route"), "path", request.url.path)
+    CLIENT_DISCONNECTS.labels(route).inc()
+    logger.info("客户端已断开，取消请求", extra={"route": route})
+    raise ClientDisconnected()
@@ -0,0 +1,125 @@
+"""
+费用时间序列分析与预算消耗预测
+
+全部计算都在 NumPy 数组上向量化完成（bincount / cumsum），
+几千条费用也只需几毫秒，不需要调用大模型。
+
+日期轴覆盖整个行程，并向前/向后扩展到最早/最晚的费用日期
+（例如出发前预订的机票）。预算按行程天数平均折算；
+"日均"和"消耗速度"只统计行程中已经过去的天数。
+"""
+from datetime import date
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Union
+
+if TYPE_CHECKING:
+    import numpy as np
+
+
+def _to_date(value: Union[str, date]) -> date:
+    if isinstance(value, date):
+        return value
+    return date.fromisoformat(str(value)[:10])
+
+
+def _round(values: "np.ndarray") -> List[float]:
+    import numpy as np
+
+    return np.round(values, 2).tolist()
+
+
+def compute_expense_analytics(
+    expenses: List[Dict[str, Any]],
+    start_date: Union[str, date],
+    end_date: Union[str, date],
+    budget: float,
+    as_of: Optional[date] = None
+) -> Dict[str, Any]:
+    """
+    计算按天、按类别的花费序列，累计消耗与折算预算的对比，以及行程结束时的预测总花费
+
+    Args:
+        expenses: 费用行，只使用 date / category / amount
+        start_date: 行程开始日期
+        end_date: 行程结束日期
+        budget: 总预算
+        as_of: 以哪一天为"今天"，默认当天
+
+    Returns:
+        与 ExpenseAnalytics 字段一致的字典
+    """
+    # numpy 只在第一次计算时导入，不拖慢 import main
+    import numpy as np
+
+    start = np.datetime64(_to_date(start_date), "D")
+    end = np.datetime64(_to_date(end_date), "D")
+    if end < start:
+        end = start
+    today = np.datetime64(as_of or date.today(), "D")
+    total_days = int((end - start).astype(int)) + 1
+
+    count = len(expenses)
+    if count:
+        dates = np.array([str(exp["date"])[:10] for exp in expenses], dtype="datetime64[D]")
+        amounts = np.fromiter((exp["amount"] for exp in expenses), dtype=np.float64, count=count)
+        categories, category_idx = np.unique(
+            np.array([str(exp["category"]) for exp in expenses]),
+            return_inverse=True
+        )
+        axis_start = min(start, dates.min())
+        axis_end = max(end, dates.max())
+    else:
+        dates = np.empty(0, dtype="datetime64[D]")
+        amounts = np.empty(0, dtype=np.float64)
+        categories, category_idx = np.empty(0, dtype=str), np.empty(0, dtype=np.int64)
+        axis_start, axis_end = start, end
+
+    n_days = int((axis_end - axis_start).astype(int)) + 1
+    offset = int((start - axis_start).astype(int))  # 行程第一天在日期轴上的位置
+    day_idx = (dates - axis_start).astype(np.int64)
+
+    daily = np.bincount(day_idx, weights=amounts, minlength=n_days)
+    by_category = np.bincount(
+        category_idx * n_days + day_idx,
+        weights=amounts,
+        minlength=len(categories) * n_days
+    ).reshape(len(categories), n_days)
+    cumulative = np.cumsum(daily)
+
+    # 折算预算：行程前为 0，行程中线性增长，行程后为总预算
+    trip_day = np.arange(n_days) - offset + 1
+    budget_line = budget * np.clip(trip_day, 0, total_days) / total_days
+
+    # 已经过去的行程天数（含今天）
+    days_elapsed = int(np.clip((today - start).astype(int) + 1, 0, total_days))
+    total_spent = float(amounts.sum())
+    today_idx = int(np.clip((today - axis_start).astype(int), -1, n_days - 1))
+    spent_to_date = float(cumulative[today_idx]) if today_idx >= 0 else 0.0
+
+    # 消耗速度只统计行程中已过去的天数，出发前的预订不计入
+    in_trip = daily[offset:offset + days_elapsed]
+    run_rate = float(in_trip.mean()) if days_elapsed else 0.0
+    days_left = total_days - days_elapsed
+    projected_total = total_spent + run_rate * days_left
+    budget_to_date = float(budget_line[today_idx]) if today_idx >= 0 else 0.0
+
+    day_labels = np.arange(axis_start, axis_end + np.timedelta64(1, "D")).astype(str).tolist()
+
+    return {
+        "budget": budget,
+        "total_spent": round(total_spent, 2),
+        "expense_count": count,
+        "total_days": total_days,
+        "days_elapsed": days_elapsed,
+        "dates": day_labels,
+        "daily": _round(daily),
+        "cumulative": _round(cumulative),
+        "budget_line": _round(budget_line),
+        "by_category": {str(cat): _round(row) for cat, row in zip(categories, by_category)},
+        "category_totals": {str(cat): round(float(total), 2) for cat, total in zip(categories, by_category.sum(axis=1))},
+        "spent_to_date": round(spent_to_date, 2),
+        "budget_to_date": round(budget_to_date, 2),
+        "daily_average": round(run_rate, 2),
+        "projected_total": round(projected_total, 2),
+        "projected_remaining": round(budget - projected_total, 2),
+        "on_track": projected_total <= budget,
+    }
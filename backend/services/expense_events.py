@@ -0,0 +1,228 @@
+"""
+费用变更事件 - 按行程推送费用统计的增量
+
+费用新增、修改、删除后发布一条事件，订阅该行程的连接（同行人打开的页面）
+收到变更的费用和统计增量后在本地更新，不再重新拉取费用列表和统计。
+
+事件格式：
+    {
+        "type": "expense.created" | "expense.updated" | "expense.deleted" | "expense.bulk",
+        "trip_id": "...",
+        "expense": {...} 或 {"id": "..."}（删除）或 null（批量）,
+        "delta": {"total_spent": 12.5, "expense_count": 1,
+                  "by_category": {"food": 12.5}, "by_day": {"2024-06-01": 12.5}}
+    }
+
+分发后端可插拔：
+- memory：进程内分发，适合单 worker
+- redis：通过 Redis pub/sub 广播，所有 worker 上的订阅者都能收到
+"""
+import asyncio
+import logging
+import orjson
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Set
+from config import settings
+from models.serialization import expense_row_to_dict
+
+logger = logging.getLogger(__name__)
+
+CHANNEL_PREFIX = "expenses:"
+
+# 每个订阅者最多积压的事件数，超过后改发 resync，由客户端重新拉取
+SUBSCRIBER_QUEUE_SIZE = 100
+
+
+def _accumulate(delta: Dict[str, Any], row: Dict[str, Any], sign: int) -> None:
+    amount = sign * float(row["amount"])
+    day = str(row["date"])[:10]
+    delta["total_spent"] += amount
+    delta["expense_count"] += sign
+    delta["by_category"][row["category"]] = delta["by_category"].get(row["category"], 0.0) + amount
+    delta["by_day"][day] = delta["by_day"].get(day, 0.0) + amount
+
+
+def _empty_delta() -> Dict[str, Any]:
+    return {"total_spent": 0.0, "expense_count": 0, "by_category": {}, "by_day": {}}
+
+
+def _rounded(delta: Dict[str, Any]) -> Dict[str, Any]:
+    delta["total_spent"] = round(delta["total_spent"], 2)
+    for key in ("by_category", "by_day"):
+        delta[key] = {k: round(v, 2) for k, v in delta[key].items() if round(v, 2) != 0}
+    return delta
+
+
+def summary_delta(old: Optional[Dict[str, Any]], new: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """由变更前后的费用行计算统计增量（新增时 old 为空，删除时 new 为空）"""
+    delta = _empty_delta()
+    if old:
+        _accumulate(delta, old, -1)
+    if new:
+        _accumulate(delta, new, 1)
+    return _rounded(delta)
+
+
+def bulk_deltas(rows: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """批量新增的费用按行程汇总为增量"""
+    deltas: Dict[str, Dict[str, Any]] = {}
+    for row in rows:
+        _accumulate(deltas.setdefault(row["trip_id"], _empty_delta()), row, 1)
+    return {trip_id: _rounded(delta) for trip_id, delta in deltas.items()}
+
+
+class PubSubBackend:
+    """发布订阅后端接口；收到的消息交给 deliver(trip_id, payload)"""
+
+    name = "base"
+
+    def __init__(self, deliver: Callable[[str, bytes], None]):
+        self.deliver = deliver
+
+    async def publish(self, trip_id: str, payload: bytes) -> None:
+        raise NotImplementedError
+
+    async def close(self) -> None:
+        pass
+
+
+class MemoryPubSubBackend(PubSubBackend):
+    """进程内直接分发"""
+
+    name = "memory"
+
+    async def publish(self, trip_id: str, payload: bytes) -> None:
+        self.deliver(trip_id, payload)
+
+
+class RedisPubSubBackend(PubSubBackend):
+    """
+    Redis pub/sub 后端
+
+    每个 worker 只保持一个订阅连接（模式订阅 expenses:*），在首次订阅时启动；
+    本 worker 发布的消息同样经 Redis 回到自己，因此不在本地重复分发。
+    """
+
+    name = "redis"
+
+    def __init__(self, deliver: Callable[[str, bytes], None], url: str):
+        super().__init__(deliver)
+        try:
+            import redis.asyncio as redis
+        except ImportError:
+            raise ValueError(
+                "EXPENSE_EVENTS_BACKEND=redis 需要安装 redis 包：pip install redis"
+            )
+        self.client = redis.from_url(url)
+        self._listener: Optional[asyncio.Task] = None
+
+    def ensure_listening(self) -> None:
+        if self._listener is None or self._listener.done():
+            self._listener = asyncio.create_task(self._listen())
+
+    async def _listen(self) -> None:
+        pubsub = self.client.pubsub()
+        await pubsub.psubscribe(f"{CHANNEL_PREFIX}*")
+        try:
+            async for message in pubsub.listen():
+                if message.get("type") != "pmessage":
+                    continue
+                channel = message["channel"]
+                if isinstance(channel, bytes):
+                    channel = channel.decode("utf-8")
+                self.deliver(channel[len(CHANNEL_PREFIX):], message["data"])
+        finally:
+            await pubsub.close()
+
+    async def publish(self, trip_id: str, payload: bytes) -> None:
+        await self.client.publish(f"{CHANNEL_PREFIX}{trip_id}", payload)
+
+    async def close(self) -> None:
+        if self._listener is not None:
+            self._listener.cancel()
+
+
+class ExpenseEventBus:
+    """按行程分发费用事件；发布失败只记录，不影响写操作本身"""
+
+    def __init__(self, backend_name: str):
+        self._subscribers: Dict[str, Set[asyncio.Queue]] = {}
+        self.published = 0
+        self.delivered = 0
+        self.dropped = 0
+        if backend_name.lower() == "redis":
+            self.backend: PubSubBackend = RedisPubSubBackend(self._deliver, settings.expense_events_redis_url)
+        else:
+            self.backend = MemoryPubSubBackend(self._deliver)
+
+    def _deliver(self, trip_id: str, payload: bytes) -> None:
+        for queue in self._subscribers.get(trip_id, ()):
+            try:
+                queue.put_nowait(payload)
+                self.delivered += 1
+            except asyncio.QueueFull:
+                # 客户端消费太慢：清空积压，让其重新拉取完整统计
+                self.dropped += queue.qsize()
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(orjson.dumps({"type": "resync", "trip_id": trip_id}))
+
+    async def publish(self, trip_id: str, event: Dict[str, Any]) -> None:
+        try:
+            await self.backend.publish(trip_id, orjson.dumps({**event, "trip_id": trip_id}))
+            self.published += 1
+        except Exception as e:
+            logger.warning("费用事件发布失败", extra={"error": str(e)})
+
+    async def publish_change(
+        self,
+        event_type: str,
+        old: Optional[Dict[str, Any]],
+        new: Optional[Dict[str, Any]]
+    ) -> None:
+        """发布单条费用的变更；修改中换了行程时拆成旧行程的删除和新行程的新增"""
+        if old and new and old["trip_id"] != new["trip_id"]:
+            await self.publish_change("expense.deleted", old, None)
+            await self.publish_change("expense.created", None, new)
+            return
+        row = new or old
+        await self.publish(row["trip_id"], {
+            "type": event_type,
+            "expense": expense_row_to_dict(new) if new else {"id": old["id"]},
+            "delta": summary_delta(old, new),
+        })
+
+    async def publish_bulk(self, rows: List[Dict[str, Any]]) -> None:
+        """批量新增只推送每个行程的汇总增量，不逐条推送费用"""
+        for trip_id, delta in bulk_deltas(rows).items():
+            await self.publish(trip_id, {"type": "expense.bulk", "expense": None, "delta": delta})
+
+    @asynccontextmanager
+    async def subscribe(self, trip_id: str) -> AsyncIterator[asyncio.Queue]:
+        """订阅行程的事件，退出时自动取消订阅"""
+        if isinstance(self.backend, RedisPubSubBackend):
+            self.backend.ensure_listening()
+        queue: asyncio.Queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self._subscribers.setdefault(trip_id, set()).add(queue)
+        try:
+            yield queue
+        finally:
+            subscribers = self._subscribers.get(trip_id)
+            if subscribers is not None:
+                subscribers.discard(queue)
+                if not subscribers:
+                    del self._subscribers[trip_id]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": self.backend.name,
+            "trips": len(self._subscribers),
+            "subscribers": sum(len(s) for s in self._subscribers.values()),
+            "published": self.published,
+            "delivered": self.delivered,
+            "dropped": self.dropped,
+        }
+
+
+# 单例实例
+expense_events = ExpenseEventBus(settings.expense_events_backend)
@@ -0,0 +1,260 @@
+"""
+幂等键 - 同一个 Idempotency-Key 的 POST 请求只执行一次
+
+前端在 token 刷新后会重放原请求，用户也可能连点“生成”，都会产生重复的行程生成
+（每次都是一次付费的大模型调用）和重复的费用记录。带 Idempotency-Key 请求头时：
+- 第一个请求正常执行，结果（状态码、响应头、响应体）按 TTL 保存
+- 执行期间到达的相同请求挂到正在执行的操作上，拿到同一个结果；
+  其他 worker 上的相同请求轮询存储直到结果写入
+- 之后的相同请求直接重放保存的结果，响应头带 Idempotent-Replayed: true
+- 同一个键配上不同的请求（方法、路径、查询参数或请求体不同）返回 422
+
+键按用户隔离（在鉴权之后使用，token 刷新前后是同一个用户）。执行失败（异常或 5xx）
+或原请求的客户端中途断开时，不保存结果并释放键，客户端可以用同一个键重试。
+
+存储后端可插拔：
+- memory：进程内，按条目数限制大小，适合单 worker
+- redis：多个 worker 共享，SET NX 原子地占用键
+"""
+import asyncio
+import hashlib
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+import orjson
+from fastapi import HTTPException, Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import ORJSONResponse
+from starlette.responses import Response
+
+from config import settings
+from services.disconnect import ClientDisconnected
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+REPLAYED_HEADER = "Idempotent-Replayed"
+MAX_KEY_LENGTH = 255
+
+IDEMPOTENCY_KEY_DESCRIPTION = "幂等键：同一个键的重复请求只执行一次，返回相同的结果"
+
+# 其他 worker 正在执行时轮询存储的间隔
+POLL_INTERVAL_SECONDS = 0.2
+
+
+class IdempotencyBackend:
+    """存储后端接口，值统一为 bytes"""
+
+    name = "base"
+
+    async def reserve(self, key: str, value: bytes, ttl: int) -> Optional[bytes]:
+        """键不存在时写入 value 并返回 None；已存在时返回现有的值"""
+        raise NotImplementedError
+
+    async def set(self, key: str, value: bytes, ttl: int) -> None:
+        raise NotImplementedError
+
+    async def delete(self, key: str) -> None:
+        raise NotImplementedError
+
+
+class MemoryIdempotencyBackend(IdempotencyBackend):
+    """进程内存储，超过 max_entries 时淘汰最早写入的条目"""
+
+    name = "memory"
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()
+
+    def _get(self, key: str) -> Optional[bytes]:
+        item = self._data.get(key)
+        if item is None:
+            return None
+        value, expires_at = item
+        if expires_at < time.monotonic():
+            del self._data[key]
+            return None
+        return value
+
+    async def reserve(self, key: str, value: bytes, ttl: int) -> Optional[bytes]:
+        existing = self._get(key)
+        if existing is None:
+            await self.set(key, value, ttl)
+        return existing
+
+    async def set(self, key: str, value: bytes, ttl: int) -> None:
+        self._data[key] = (value, time.monotonic() + ttl)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+
+    async def delete(self, key: str) -> None:
+        self._data.pop(key, None)
+
+
+class RedisIdempotencyBackend(IdempotencyBackend):
+    """Redis 存储后端，容量由 Redis 的 maxmemory 策略控制"""
+
+    name = "redis"
+
+    def __init__(self, url: str):
+        try:
+            import redis.asyncio as redis
+        except ImportError:
+            raise ValueError(
+                "IDEMPOTENCY_BACKEND=redis 需要安装 redis 包：pip install redis"
+            )
+        self.client = redis.from_url(url)
+
+    async def reserve(self, key: str, value: bytes, ttl: int) -> Optional[bytes]:
+        if await self.client.set(key, value, ex=ttl, nx=True):
+            return None
+        existing = await self.client.get(key)
+        if existing is None:
+            # 读取前恰好过期或被释放，重新占用
+            return await self.reserve(key, value, ttl)
+        return existing
+
+    async def set(self, key: str, value: bytes, ttl: int) -> None:
+        await self.client.set(key, value, ex=ttl)
+
+    async def delete(self, key: str) -> None:
+        await self.client.delete(key)
+
+
+def _as_response(result: Any) -> Response:
+    if isinstance(result, Response):
+        return result
+    return ORJSONResponse(jsonable_encoder(result))
+
+
+def _replay(status: int, headers: Dict[str, str], body: bytes) -> Response:
+    response = Response(content=body, status_code=status, headers=headers)
+    response.headers[REPLAYED_HEADER] = "true"
+    return response
+
+
+class IdempotencyStore:
+    """按用户和 Idempotency-Key 保存 POST 请求的结果"""
+
+    def __init__(self, backend: IdempotencyBackend, ttl: int, pending_ttl: int, wait_seconds: float):
+        self.backend = backend
+        self.ttl = ttl
+        self.pending_ttl = pending_ttl
+        self.wait_seconds = wait_seconds
+        # 本进程正在执行的操作，相同请求直接等待它的结果
+        self._in_flight: Dict[str, asyncio.Future] = {}
+
+    @staticmethod
+    async def _fingerprint(request: Request) -> str:
+        digest = hashlib.sha256()
+        digest.update(f"{request.method} {request.url.path}?{request.url.query}\n".encode("utf-8"))
+        # 请求体已被 FastAPI 读取并缓存在 request 上，这里不会重复读取
+        digest.update(await request.body())
+        return digest.hexdigest()
+
+    async def run(
+        self,
+        request: Request,
+        user_id: str,
+        idempotency_key: Optional[str],
+        operation: Callable[[], Awaitable[Any]]
+    ) -> Response:
+        """执行 operation，带幂等键时去重；operation 返回 Response 或可 JSON 编码的数据"""
+        if not idempotency_key:
+            return _as_response(await operation())
+        if len(idempotency_key) > MAX_KEY_LENGTH:
+            raise HTTPException(status_code=400, detail=f"{IDEMPOTENCY_HEADER} 长度不能超过 {MAX_KEY_LENGTH}")
+
+        key = f"idempotency:{user_id}:{request.method}:{request.url.path}:{idempotency_key}"
+        fingerprint = await self._fingerprint(request)
+        pending = orjson.dumps({"state": "pending", "fingerprint": fingerprint})
+        deadline = time.monotonic() + self.wait_seconds
+
+        while True:
+            try:
+                existing = await self.backend.reserve(key, pending, self.pending_ttl)
+            except Exception as e:
+                # 存储不可用时不去重，直接执行
+                logger.warning("幂等键存储失败，跳过去重", extra={"error": str(e)})
+                return _as_response(await operation())
+            if existing is None:
+                return await self._execute(key, fingerprint, operation)
+
+            record = orjson.loads(existing)
+            if record["fingerprint"] != fingerprint:
+                raise HTTPException(status_code=422, detail=f"{IDEMPOTENCY_HEADER} 已用于另一个不同的请求")
+            if record["state"] == "done":
+                return _replay(record["status"], record["headers"], record["body"].encode("utf-8"))
+
+            future = self._in_flight.get(key)
+            if future is not None:
+                response = await asyncio.shield(future)
+                return _replay(response.status_code, dict(response.headers), response.body)
+
+            if time.monotonic() >= deadline:
+                raise HTTPException(
+                    status_code=409,
+                    detail="相同的请求仍在处理中，请稍后重试",
+                    headers={"Retry-After": "5"},
+                )
+            await asyncio.sleep(POLL_INTERVAL_SECONDS)
+
+    async def _execute(self, key: str, fingerprint: str, operation: Callable[[], Awaitable[Any]]) -> Response:
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            response = _as_response(await operation())
+        except BaseException as e:
+            await self._release(key)
+            if isinstance(e, Exception) and not isinstance(e, ClientDisconnected):
+                future.set_exception(e)
+            else:
+                # 原请求被取消或客户端已断开，等待者改为收到可重试的错误
+                future.set_exception(HTTPException(status_code=409, detail="相同的请求已中断，请重试"))
+            # 没有等待者时也标记为已取回，避免 "exception was never retrieved" 警告
+            future.exception()
+            raise
+        finally:
+            self._in_flight.pop(key, None)
+
+        if response.status_code < 500 and hasattr(response, "body"):
+            record = orjson.dumps({
+                "state": "done",
+                "fingerprint": fingerprint,
+                "status": response.status_code,
+                "headers": dict(response.headers),
+                "body": response.body.decode("utf-8"),
+            })
+            try:
+                await self.backend.set(key, record, self.ttl)
+            except Exception as e:
+                logger.warning("幂等键结果保存失败", extra={"error": str(e)})
+        else:
+            await self._release(key)
+        future.set_result(response)
+        return response
+
+    async def _release(self, key: str) -> None:
+        try:
+            await self.backend.delete(key)
+        except Exception as e:
+            logger.warning("幂等键释放失败", extra={"error": str(e)})
+
+
+def _create_backend() -> IdempotencyBackend:
+    if settings.idempotency_backend.lower() == "redis":
+        return RedisIdempotencyBackend(settings.idempotency_redis_url)
+    return MemoryIdempotencyBackend(settings.idempotency_max_entries)
+
+
+# 单例实例
+idempotency_store = IdempotencyStore(
+    _create_backend(),
+    ttl=settings.idempotency_ttl_seconds,
+    pending_ttl=settings.idempotency_pending_ttl_seconds,
+    wait_seconds=settings.idempotency_wait_seconds,
+)
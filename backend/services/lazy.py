@@ -0,0 +1,100 @@
+"""
+服务单例的延迟构造
+
+各服务模块导出的单例是 LazyService 代理，导入模块时不创建客户端（也不导入 openai、
+supabase 等较重的依赖），第一次访问属性时才构造；main.py 的 lifespan 会在后台预热，
+预热结果通过 /health/ready 报告。配置缺失时应用仍能启动，只有用到该服务的请求失败。
+
+用法与原来的单例相同：
+    supabase_service = LazyService("supabase", SupabaseService)
+    await supabase_service.get_trip(...)
+"""
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, Generic, List, Optional, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+_registry: List["LazyService"] = []
+
+
+class LazyService(Generic[T]):
+    """首次使用时构造的单例代理；构造失败不缓存，下次访问重试"""
+
+    def __init__(self, name: str, factory: Callable[[], T], required: bool = True):
+        self._name = name
+        self._factory = factory
+        self._required = required
+        self._instance: Optional[T] = None
+        self._error: Optional[str] = None
+        self._init_seconds: Optional[float] = None
+        # 预热在线程中进行，可能与请求中的首次访问同时发生
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    @property
+    def initialized(self) -> bool:
+        return self._instance is not None
+
+    def get(self) -> T:
+        instance = self._instance
+        if instance is not None:
+            return instance
+        with self._lock:
+            if self._instance is None:
+                start = time.perf_counter()
+                try:
+                    self._instance = self._factory()
+                    self._error = None
+                except Exception as e:
+                    self._error = _summarize(e)
+                    raise
+                finally:
+                    self._init_seconds = time.perf_counter() - start
+            return self._instance
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.get(), name)
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "required": self._required,
+            "initialized": self.initialized,
+            "init_ms": None if self._init_seconds is None else round(self._init_seconds * 1000, 1),
+            "error": self._error,
+        }
+
+
+def _summarize(error: Exception) -> str:
+    """
+    构造失败的原因只取第一行有效文字：完整的配置提示很长，
+    而且 Supabase 的连接错误中带有 key，不能经 /health/ready 暴露
+    """
+    for line in str(error).splitlines():
+        line = line.strip()
+        if line and set(line) != {"="}:
+            return line
+    return type(error).__name__
+
+
+def warm_up() -> None:
+    """构造所有尚未构造的服务；失败只记录日志和 status()，请求中访问时会重试"""
+    for service in _registry:
+        if service.initialized:
+            continue
+        try:
+            service.get()
+        except Exception:
+            logger.warning("服务初始化失败", extra={"service": service._name, "error": service._error})
+
+
+def services_status() -> Dict[str, Dict[str, Any]]:
+    return {service._name: service.status() for service in _registry}
+
+
+def services_ready() -> bool:
+    """必需的服务都已构造成功；非必需服务（地图、AI）失败时只影响对应功能"""
+    return all(service.initialized for service in _registry if service._required)
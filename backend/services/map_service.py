@@ -2,8 +2,26 @@
 地图服务 - 使用高德地图 API（在后端）
 """
 import httpx
+import logging
 from typing import List, Dict, Any, Optional, Tuple
 from config import settings
+from services.metrics import observe_upstream
+from services.deadline import DeadlineExceeded, upstream_deadline
+from services.lazy import LazyService
+
+logger = logging.getLogger(__name__)
+
+
+def _text(value: Any) -> str:
+    """高德在字段为空时返回 [] 而不是空字符串"""
+    return value if isinstance(value, str) else ""
+
+
+def _cost(value: Any) -> Optional[float]:
+    try:
+        return float(value) or None
+    except (TypeError, ValueError):
+        return None
 
 
 class MapService:
@@ -15,7 +33,7 @@ class MapService:
                 "请在 backend/.env 文件中设置 AMAP_API_KEY\n"
                 "获取地址: https://console.amap.com/dev/key/app"
             )
-        self.base_url = "https://restapi.amap.com/v3"
+        self.base_url = settings.amap_base_url
     
     async def geocode(self, address: str, city: Optional[str] = None) -> Optional[Dict[str, Any]]:
         """
@@ -37,7 +55,9 @@ class MapService:
         
         async with httpx.AsyncClient() as client:
             try:
-                response = await client.get(f"{self.base_url}/geocode/geo", params=params)
+                with observe_upstream("amap", "geocode"):
+                    async with upstream_deadline("amap", "geocode", settings.amap_timeout_seconds) as timeout:
+                        response = await client.get(f"{self.base_url}/geocode/geo", params=params, timeout=timeout)
                 response.raise_for_status()
                 data = response.json()
                 
@@ -49,8 +69,10 @@ class MapService:
                         "latitude": float(lat),
                         "formatted_address": data["geocodes"][0].get("formatted_address", address)
                     }
+            except DeadlineExceeded:
+                raise
             except Exception as e:
-                print(f"地理编码失败: {e}")
+                logger.warning("地理编码失败", extra={"error": str(e)})
         
         return None
     
@@ -65,14 +87,18 @@ class MapService:
         
         async with httpx.AsyncClient() as client:
             try:
-                response = await client.get(f"{self.base_url}/geocode/regeo", params=params)
+                with observe_upstream("amap", "reverse_geocode"):
+                    async with upstream_deadline("amap", "reverse_geocode", settings.amap_timeout_seconds) as timeout:
+                        response = await client.get(f"{self.base_url}/geocode/regeo", params=params, timeout=timeout)
                 response.raise_for_status()
                 data = response.json()
                 
                 if data.get("status") == "1" and data.get("regeocode"):
                     return data["regeocode"].get("formatted_address")
+            except DeadlineExceeded:
+                raise
             except Exception as e:
-                print(f"逆地理编码失败: {e}")
+                logger.warning("逆地理编码失败", extra={"error": str(e)})
         
         return None
     
@@ -96,19 +122,23 @@ class MapService:
             limit: 返回数量
         
         Returns:
-            POI 列表
+            POI 列表（含高德 POI id、分类编码、所在区域和人均消费 cost，没有消费信息时为 None）
         """
         params = {
             "key": self.api_key,
             "keywords": keyword,
             "offset": limit,
+            # 返回 biz_ext（人均消费、评分）
+            "extensions": "all",
         }
         if city:
             params["city"] = city
         
         async with httpx.AsyncClient() as client:
             try:
-                response = await client.get(f"{self.base_url}/place/text", params=params)
+                with observe_upstream("amap", "search_poi"):
+                    async with upstream_deadline("amap", "search_poi", settings.amap_timeout_seconds) as timeout:
+                        response = await client.get(f"{self.base_url}/place/text", params=params, timeout=timeout)
                 response.raise_for_status()
                 data = response.json()
                 
@@ -118,15 +148,21 @@ class MapService:
                         location = poi.get("location", "0,0")
                         lng, lat = location.split(",")
                         results.append({
+                            "id": poi.get("id"),
                             "name": poi.get("name"),
-                            "address": poi.get("address"),
+                            "address": _text(poi.get("address")),
                             "longitude": float(lng),
                             "latitude": float(lat),
                             "type": poi.get("type"),
+                            "typecode": poi.get("typecode"),
+                            "adname": _text(poi.get("adname")),
+                            "cost": _cost((poi.get("biz_ext") or {}).get("cost")),
                         })
                     return results
+            except DeadlineExceeded:
+                raise
             except Exception as e:
-                print(f"POI 搜索失败: {e}")
+                logger.warning("POI 搜索失败", extra={"error": str(e)})
         
         return []
     
@@ -134,7 +170,8 @@ class MapService:
         self, 
         origin: Tuple[float, float], 
         destination: Tuple[float, float],
-        strategy: int = 0
+        strategy: int = 0,
+        with_path: bool = False
     ) -> Optional[Dict[str, Any]]:
         """
         路线规划
@@ -143,6 +180,7 @@ class MapService:
             origin: 起点 (longitude, latitude)
             destination: 终点 (longitude, latitude)
             strategy: 路线策略 (0=速度优先, 1=费用优先, 2=距离优先)
+            with_path: 是否返回完整路线坐标（path，[(longitude, latitude), ...]）
         
         Returns:
             路线信息
@@ -156,23 +194,36 @@ class MapService:
         
         async with httpx.AsyncClient() as client:
             try:
-                response = await client.get(f"{self.base_url}/direction/driving", params=params)
+                with observe_upstream("amap", "route"):
+                    async with upstream_deadline("amap", "route", settings.amap_timeout_seconds) as timeout:
+                        response = await client.get(f"{self.base_url}/direction/driving", params=params, timeout=timeout)
                 response.raise_for_status()
                 data = response.json()
                 
                 if data.get("status") == "1" and data.get("route"):
                     route = data["route"]["paths"][0]
-                    return {
+                    result = {
                         "distance": float(route.get("distance", 0)),  # 米
                         "duration": float(route.get("duration", 0)),  # 秒
                         "strategy": route.get("strategy"),
                     }
+                    if with_path:
+                        # 每个路段的 polyline 为 "lng,lat;lng,lat;..."，按顺序拼接
+                        result["path"] = [
+                            (float(lng), float(lat))
+                            for step in route.get("steps", [])
+                            for point in step.get("polyline", "").split(";") if point
+                            for lng, lat in [point.split(",")]
+                        ]
+                    return result
+            except DeadlineExceeded:
+                raise
             except Exception as e:
-                print(f"路线规划失败: {e}")
+                logger.warning("路线规划失败", extra={"error": str(e)})
         
         return None
 
 
 # 单例
-map_service = MapService()
+map_service: MapService = LazyService("map", MapService, required=False)
 
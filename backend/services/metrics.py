@@ -0,0 +1,214 @@
+"""
+Prometheus 指标
+
+- http_request_duration_seconds：按路由模板（而非实际路径）、方法、状态码的延迟直方图
+- http_requests_in_progress：正在处理的请求数
+- upstream_request_duration_seconds：Supabase 查询、高德接口、大模型调用的客户端耗时
+- event_loop_lag_seconds：事件循环延迟（定时器实际唤醒时间与预期的差）
+- admission_rejected_total：准入控制拒绝的请求数，按类别和原因
+- upstream_deadline_exceeded_total：请求截止时间用尽导致的上游调用失败（未发起或超时中止）
+- client_disconnects_total：客户端在处理完成前断开、被取消的请求数
+- llm_completion_tokens_total / llm_cancelled_total / llm_tokens_saved_total：
+  大模型输出 token 数、中途取消的调用数（客户端断开或截止时间用尽）和取消节省的输出 token 估算
+
+多 worker：设置环境变量 PROMETHEUS_MULTIPROC_DIR（启动前清空该目录）后，
+各 worker 把指标写入共享目录的 mmap 文件，/metrics 汇总所有 worker 的数据。
+记录指标只是内存中的计数，开销很小，可以在生产环境常开。
+"""
+import asyncio
+import os
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess
+)
+from starlette.responses import Response
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+MULTIPROCESS = bool(os.environ.get("PROMETHEUS_MULTIPROC_DIR"))
+
+# 未匹配任何路由的请求统一归为一个标签值，避免路径扫描造成标签爆炸
+UNMATCHED_ROUTE = "<unmatched>"
+
+REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds",
+    "HTTP 请求处理耗时",
+    ["method", "route", "status"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+)
+
+REQUESTS_IN_PROGRESS = Gauge(
+    "http_requests_in_progress",
+    "正在处理的 HTTP 请求数",
+    ["method"],
+    multiprocess_mode="livesum",
+)
+
+UPSTREAM_DURATION = Histogram(
+    "upstream_request_duration_seconds",
+    "上游依赖调用耗时（客户端视角）",
+    ["upstream", "operation", "outcome"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120),
+)
+
+EVENT_LOOP_LAG = Histogram(
+    "event_loop_lag_seconds",
+    "事件循环延迟",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+)
+
+ADMISSION_REJECTED = Counter(
+    "admission_rejected_total",
+    "准入控制拒绝的请求数",
+    ["admission_class", "reason"],
+)
+
+DEADLINE_EXCEEDED = Counter(
+    "upstream_deadline_exceeded_total",
+    "请求截止时间用尽导致的上游调用失败（skipped：预算不足未发起；timeout：超时中止）",
+    ["upstream", "operation", "stage"],
+)
+
+CLIENT_DISCONNECTS = Counter(
+    "client_disconnects_total",
+    "客户端在处理完成前断开而被取消的请求数",
+    ["route"],
+)
+
+LLM_COMPLETION_TOKENS = Counter(
+    "llm_completion_tokens_total",
+    "大模型输出的 token 数（流式调用按分片数估算）",
+    ["operation"],
+)
+
+LLM_CANCELLED = Counter(
+    "llm_cancelled_total",
+    "中途取消的大模型调用数（reason：disconnect 客户端断开 / deadline 截止时间用尽）",
+    ["operation", "reason"],
+)
+
+LLM_TOKENS_SAVED = Counter(
+    "llm_tokens_saved_total",
+    "取消大模型调用节省的输出 token 数（按该操作的平均输出量估算）",
+    ["operation", "reason"],
+)
+
+
+@contextmanager
+def observe_upstream(upstream: str, operation: str) -> Iterator[None]:
+    """
+    记录一次上游调用的耗时，同步和异步代码中都可以使用：
+        with observe_upstream("amap", "geocode"):
+            response = await client.get(...)
+    """
+    start = time.perf_counter()
+    outcome = "error"
+    try:
+        yield
+        outcome = "ok"
+    finally:
+        UPSTREAM_DURATION.labels(upstream, operation, outcome).observe(time.perf_counter() - start)
+
+
+class EventLoopLagMonitor:
+    """每隔 interval 秒睡眠一次，实际唤醒时间超出预期的部分即为事件循环延迟"""
+
+    def __init__(self, interval: float = 0.5):
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            EVENT_LOOP_LAG.observe(max(0.0, loop.time() - expected))
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+class MetricsMiddleware:
+    """
+    记录请求延迟和并发数
+
+    路由模板取自路由匹配后写入 scope 的 endpoint，而不是请求路径，
+    这样 /trips/{trip_id} 的所有请求共用一组时间序列。
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+        self._route_paths: Dict[object, str] = {}
+
+    def _route_template(self, scope: Scope) -> str:
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return UNMATCHED_ROUTE
+        path = self._route_paths.get(endpoint)
+        if path is None:
+            app = scope.get("app")
+            for route in getattr(app, "routes", []):
+                if getattr(route, "endpoint", None) is endpoint:
+                    path = route.path
+                    break
+            path = path or UNMATCHED_ROUTE
+            self._route_paths[endpoint] = path
+        return path
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        status = 500
+        start = time.perf_counter()
+
+        async def send_with_status(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        in_progress = REQUESTS_IN_PROGRESS.labels(method)
+        in_progress.inc()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            in_progress.dec()
+            REQUEST_DURATION.labels(method, self._route_template(scope), str(status)).observe(
+                time.perf_counter() - start
+            )
+
+
+def metrics_response() -> Response:
+    """Prometheus 文本格式的指标；多 worker 模式下汇总所有 worker"""
+    if MULTIPROCESS:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        data = generate_latest(registry)
+    else:
+        data = generate_latest()
+    return Response(data, media_type=CONTENT_TYPE_LATEST)
+
+
+def mark_process_dead() -> None:
+    """worker 正常退出时清理本进程 livesum 类 gauge 的数据，避免已退出的 worker 仍计入在途请求"""
+    if MULTIPROCESS:
+        multiprocess.mark_process_dead(os.getpid())
+
+
+# 单例实例
+event_loop_monitor = EventLoopLagMonitor()
@@ -0,0 +1,77 @@
+"""
+游标分页工具 - 基于 (created_at, id) 的 keyset 分页
+"""
+import base64
+import json
+import re
+import uuid
+from typing import Tuple, Literal, Optional
+
+# 总数统计方式：exact 精确计数，planned / estimated 使用查询规划器估算
+CountMethod = Literal["exact", "planned", "estimated"]
+
+_TIMESTAMP_RE = re.compile(r"^[0-9T:.+\- ]+$")
+
+
+class InvalidCursorError(ValueError):
+    """客户端传入的游标无法解析"""
+
+
+def encode_cursor(created_at: str, row_id: str) -> str:
+    """将一行的排序键编码为不透明游标"""
+    raw = json.dumps([created_at, row_id], separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[str, str]:
+    """解码游标，格式错误时抛出 InvalidCursorError"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, row_id = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+    except Exception:
+        raise InvalidCursorError("无效的分页游标")
+    # 游标值会拼进 PostgREST 过滤表达式，只接受时间戳和 UUID
+    if not isinstance(created_at, str) or not _TIMESTAMP_RE.match(created_at):
+        raise InvalidCursorError("无效的分页游标")
+    try:
+        row_id = str(uuid.UUID(str(row_id)))
+    except ValueError:
+        raise InvalidCursorError("无效的分页游标")
+    return created_at, row_id
+
+
+def keyset_filter(cursor: str) -> str:
+    """
+    生成 PostgREST or 过滤条件，取排在游标之后的行
+
+    排序为 created_at DESC, id DESC，因此下一页满足：
+    created_at < c  或  (created_at = c 且 id < i)
+    """
+    created_at, row_id = decode_cursor(cursor)
+    return (
+        f'created_at.lt."{created_at}",'
+        f'and(created_at.eq."{created_at}",id.lt.{row_id})'
+    )
+
+
+def apply_keyset(query, cursor: Optional[str], limit: int):
+    """
+    给 PostgREST 查询加上游标条件、排序和 limit
+
+    当前 postgrest-py 版本没有 or_()，多次 order() 也不会合并成一个参数，
+    因此直接写入查询参数（与新版 or_() 的实现方式一致）。
+    多取一行用于判断是否存在下一页。
+    """
+    if cursor:
+        query.params = query.params.add("or", f"({keyset_filter(cursor)})")
+    query.params = query.params.add("order", "created_at.desc,id.desc")
+    return query.limit(limit + 1)
+
+
+def next_cursor(rows: list, limit: int) -> Optional[str]:
+    """多取一行判断是否还有下一页；有则返回最后一行的游标（会截断 rows）"""
+    if len(rows) <= limit:
+        return None
+    del rows[limit:]
+    last = rows[-1]
+    return encode_cursor(last["created_at"], last["id"])
@@ -0,0 +1,219 @@
+"""
+目的地 POI 索引 - 用高德 POI 搜索结果约束大模型的景点和餐厅
+
+大模型凭记忆写出的名称、地址和经纬度经常不准，完整的景点对象也让输出很长。
+生成行程前按目的地取出一批候选 POI（景点、餐厅，以及与旅行偏好对应的关键词），
+以短编号（a1、r1 ...）列在提示词中，大模型只需输出编号和游玩时长、建议等少量字段，
+由服务端展开成 Attraction / Restaurant：名称、地址、坐标来自高德，不需要事后地理编码。
+
+每个 (城市, 关键词) 的搜索结果缓存 POI_CACHE_TTL_SECONDS（默认 7 天），同一城市的
+后续行程和 /maps/search 直接使用缓存。后端与行程缓存相同（memory / redis）。
+"""
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+import orjson
+
+from config import settings
+from models.schemas import Attraction, Restaurant, TravelPreference
+from services.deadline import DeadlineExceeded
+from services.map_service import map_service
+from services.trip_cache import CacheBackend, MemoryCacheBackend, RedisCacheBackend
+
+logger = logging.getLogger(__name__)
+
+# 高德 POI 分类编码中“餐饮服务”的前缀
+RESTAURANT_TYPECODE_PREFIX = "05"
+
+# 高德单次搜索最多返回的条数
+SEARCH_LIMIT = 25
+
+ATTRACTION_KEYWORDS = ["景点"]
+RESTAURANT_KEYWORDS = ["美食"]
+
+# 旅行偏好对应的额外搜索关键词
+PREFERENCE_KEYWORDS: Dict[TravelPreference, str] = {
+    TravelPreference.FOOD: "特色餐厅",
+    TravelPreference.CULTURE: "博物馆",
+    TravelPreference.NATURE: "公园",
+    TravelPreference.SHOPPING: "购物中心",
+    TravelPreference.ADVENTURE: "户外",
+    TravelPreference.RELAXATION: "温泉",
+    TravelPreference.ANIME: "动漫",
+    TravelPreference.HISTORY: "古迹",
+}
+
+
+class PoiCandidates:
+    """一次行程生成的候选 POI，编号只在本次生成中有效"""
+
+    def __init__(self, attractions: List[Dict[str, Any]], restaurants: List[Dict[str, Any]]):
+        self.by_id: Dict[str, Dict[str, Any]] = {}
+        for prefix, pois in (("a", attractions), ("r", restaurants)):
+            for index, poi in enumerate(pois, 1):
+                self.by_id[f"{prefix}{index}"] = poi
+        self.attraction_count = len(attractions)
+        self.restaurant_count = len(restaurants)
+        self.expanded = 0
+        self.unknown = 0
+
+    def __bool__(self) -> bool:
+        return bool(self.by_id)
+
+    def prompt_lines(self) -> Tuple[str, str]:
+        """候选景点和候选餐厅的列表文本，每行：编号 名称｜区域｜类别｜参考价格"""
+        attractions, restaurants = [], []
+        for poi_id, poi in self.by_id.items():
+            fields = [f"{poi_id} {poi['name']}", poi.get("adname") or "", _category(poi)]
+            if poi.get("cost"):
+                fields.append(f"约{poi['cost']:g}元")
+            (attractions if poi_id[0] == "a" else restaurants).append("｜".join(fields))
+        return "\n".join(attractions), "\n".join(restaurants)
+
+    def _lookup(self, item: Dict[str, Any], prefix: str) -> Optional[Dict[str, Any]]:
+        poi = self.by_id.get(str(item["poi"])) if str(item["poi"]).startswith(prefix) else None
+        if poi is None:
+            self.unknown += 1
+            logger.warning("大模型返回了不存在的 POI 编号", extra={"poi": item["poi"]})
+        else:
+            self.expanded += 1
+        return poi
+
+    def attraction(self, item: Dict[str, Any]) -> Optional[Attraction]:
+        """展开景点；没有 poi 字段时按完整格式解析，编号不存在时返回 None"""
+        if "poi" not in item:
+            return Attraction(**item)
+        poi = self._lookup(item, "a")
+        if poi is None:
+            return None
+        return Attraction(
+            name=poi["name"],
+            description=item.get("description") or _category(poi),
+            address=poi.get("address") or "",
+            latitude=poi["latitude"],
+            longitude=poi["longitude"],
+            duration=item.get("duration") or 120,
+            estimated_cost=item.get("estimated_cost") or poi.get("cost") or 0,
+            tips=item.get("tips"),
+            pinned=item.get("pinned", False),
+        )
+
+    def restaurant(self, item: Dict[str, Any]) -> Optional[Restaurant]:
+        """展开餐厅；没有 poi 字段时按完整格式解析，编号不存在时返回 None"""
+        if "poi" not in item:
+            return Restaurant(**item)
+        poi = self._lookup(item, "r")
+        if poi is None:
+            return None
+        return Restaurant(
+            name=poi["name"],
+            cuisine_type=item.get("cuisine_type") or _category(poi),
+            address=poi.get("address") or "",
+            latitude=poi["latitude"],
+            longitude=poi["longitude"],
+            estimated_cost=item.get("estimated_cost") or poi.get("cost") or 0,
+            recommendations=item.get("recommendations"),
+        )
+
+
+def _category(poi: Dict[str, Any]) -> str:
+    """高德类别 "风景名胜;公园广场;公园" 取最细的一级"""
+    return (poi.get("type") or "").split(";")[-1]
+
+
+class PoiIndex:
+    """按城市缓存的 POI 搜索结果"""
+
+    def __init__(self, backend: Optional[CacheBackend], ttl: int):
+        self.backend = backend
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    @staticmethod
+    def _key(city: str, keyword: str) -> str:
+        return f"poi:{city}:{keyword}"
+
+    async def search(self, keyword: str, city: Optional[str] = None, limit: int = 10) -> List[Dict[str, Any]]:
+        """带缓存的 POI 搜索；总是按最大条数搜索并缓存，返回前 limit 条"""
+        if self.backend is None or not city:
+            return await map_service.search_poi(keyword, city, limit)
+
+        key = self._key(city, keyword)
+        try:
+            cached = await self.backend.get(key)
+        except Exception as e:
+            self.errors += 1
+            logger.warning("POI 缓存读取失败", extra={"error": str(e)})
+            cached = None
+        if cached is not None:
+            self.hits += 1
+            return orjson.loads(cached)[:limit]
+
+        self.misses += 1
+        pois = await map_service.search_poi(keyword, city, SEARCH_LIMIT)
+        if pois:
+            # 搜索失败时返回空列表，不缓存
+            try:
+                await self.backend.set(key, orjson.dumps(pois), self.ttl)
+            except Exception as e:
+                self.errors += 1
+                logger.warning("POI 缓存写入失败", extra={"error": str(e)})
+        return pois[:limit]
+
+    async def candidates(self, city: str, preferences: List[TravelPreference]) -> PoiCandidates:
+        """目的地的候选景点和餐厅；高德不可用或搜索失败时为空，生成按原来的完整格式进行"""
+        keywords = ATTRACTION_KEYWORDS + RESTAURANT_KEYWORDS + [
+            PREFERENCE_KEYWORDS[p] for p in preferences if p in PREFERENCE_KEYWORDS
+        ]
+        try:
+            results = await asyncio.gather(*(self.search(keyword, city, SEARCH_LIMIT) for keyword in keywords))
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            logger.warning("候选 POI 获取失败", extra={"city": city, "error": str(e)})
+            return PoiCandidates([], [])
+
+        attractions: Dict[str, Dict[str, Any]] = {}
+        restaurants: Dict[str, Dict[str, Any]] = {}
+        for poi in (poi for pois in results for poi in pois):
+            if not poi.get("id") or (poi["longitude"] == 0 and poi["latitude"] == 0):
+                continue
+            target = restaurants if (poi.get("typecode") or "").startswith(RESTAURANT_TYPECODE_PREFIX) else attractions
+            target.setdefault(poi["id"], poi)
+
+        limit = settings.poi_candidates_per_kind
+        return PoiCandidates(list(attractions.values())[:limit], list(restaurants.values())[:limit])
+
+    async def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        result = {
+            "backend": self.backend.name if self.backend else "none",
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "errors": self.errors,
+            "size": 0,
+        }
+        if self.backend is not None:
+            try:
+                result["size"] = await self.backend.size()
+            except Exception as e:
+                self.errors += 1
+                logger.warning("POI 缓存统计失败", extra={"error": str(e)})
+        return result
+
+
+def _create_backend() -> Optional[CacheBackend]:
+    backend = settings.poi_cache_backend.lower()
+    if backend == "none":
+        return None
+    if backend == "redis":
+        return RedisCacheBackend(settings.poi_cache_redis_url)
+    return MemoryCacheBackend(settings.poi_cache_max_entries)
+
+
+# 单例实例
+poi_index = PoiIndex(_create_backend(), settings.poi_cache_ttl_seconds)
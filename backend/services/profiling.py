@@ -0,0 +1,134 @@
+"""
+按请求的性能剖析（可选开启）
+
+请求满足以下任一条件时，用 pyinstrument 采样剖析整个请求的处理过程：
+- 带有管理员签发的 X-Profile-Token 请求头（见 make_profile_token）
+- 按 PROFILING_SAMPLE_RATE 随机抽中
+
+结果写入 PROFILING_DIR，文件名包含时间、request_id 和路由，
+格式为 speedscope（https://www.speedscope.app 打开）或 pyinstrument 的 HTML 火焰图。
+
+未开启时 main.py 不会注册该中间件，请求路径上没有任何额外开销；
+pyinstrument 也只在开启时才导入。
+
+生成令牌（在 backend 目录下）：
+    python -m services.profiling 600     # 有效期 600 秒
+"""
+import asyncio
+import hashlib
+import hmac
+import logging
+import os
+import re
+import time
+
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from config import settings
+from logging_config import request_id_var, should_sample
+
+logger = logging.getLogger(__name__)
+
+PROFILE_TOKEN_HEADER = b"x-profile-token"
+
+
+def _sign(expires: int) -> str:
+    return hmac.new(
+        settings.profiling_secret.encode("utf-8"), str(expires).encode("utf-8"), hashlib.sha256
+    ).hexdigest()
+
+
+def make_profile_token(ttl_seconds: int = 600) -> str:
+    """签发剖析令牌，格式为 "<过期时间戳>.<HMAC>" """
+    if not settings.profiling_secret:
+        raise ValueError("未配置 PROFILING_SECRET，无法签发剖析令牌")
+    expires = int(time.time()) + ttl_seconds
+    return f"{expires}.{_sign(expires)}"
+
+
+def verify_profile_token(token: str) -> bool:
+    if not settings.profiling_secret:
+        return False
+    expires, _, signature = token.partition(".")
+    if not expires.isdigit() or int(expires) < time.time():
+        return False
+    return hmac.compare_digest(signature, _sign(int(expires)))
+
+
+class ProfilingMiddleware:
+    """对选中的请求运行采样剖析器，并把结果写入文件"""
+
+    def __init__(self, app: ASGIApp):
+        from pyinstrument import Profiler  # 仅在开启剖析时导入
+
+        self.app = app
+        self._profiler_class = Profiler
+        os.makedirs(settings.profiling_dir, exist_ok=True)
+
+    def _should_profile(self, scope: Scope) -> bool:
+        for key, value in scope["headers"]:
+            if key == PROFILE_TOKEN_HEADER:
+                return verify_profile_token(value.decode("latin-1"))
+        return should_sample(settings.profiling_sample_rate)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not self._should_profile(scope):
+            await self.app(scope, receive, send)
+            return
+
+        profiler = self._profiler_class(interval=settings.profiling_interval, async_mode="enabled")
+        try:
+            profiler.start()
+            await self.app(scope, receive, send)
+        finally:
+            # start() 本身失败时剖析器没有运行，不需要停止和保存
+            if profiler.is_running:
+                profiler.stop()
+                path = self._output_path(scope)
+                try:
+                    await asyncio.to_thread(self._write, profiler, path)
+                    logger.info("请求剖析结果已保存", extra={"path": path})
+                except Exception as e:
+                    logger.warning("请求剖析结果保存失败", extra={"error": str(e)})
+
+    def _output_path(self, scope: Scope) -> str:
+        route = re.sub(r"[^A-Za-z0-9]+", "_", scope["path"]).strip("_")[:80] or "root"
+        # request_id 可能来自客户端请求头，不能直接用作文件名
+        request_id = re.sub(r"[^A-Za-z0-9_-]+", "_", request_id_var.get())
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        extension = "html" if settings.profiling_format == "html" else "speedscope.json"
+        return os.path.join(
+            settings.profiling_dir,
+            f"{stamp}-{request_id}-{scope['method']}-{route}.{extension}"
+        )
+
+    @staticmethod
+    def _write(profiler, path: str) -> None:
+        if settings.profiling_format == "html":
+            output = profiler.output_html()
+        else:
+            from pyinstrument.renderers import SpeedscopeRenderer
+            output = profiler.output(renderer=SpeedscopeRenderer())
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(output)
+
+
+def profiling_enabled() -> bool:
+    """是否注册剖析中间件；开启了剖析但未安装 pyinstrument 时在启动阶段直接报错"""
+    enabled = settings.profiling_enabled and (
+        bool(settings.profiling_secret) or settings.profiling_sample_rate > 0
+    )
+    if enabled:
+        try:
+            import pyinstrument  # noqa: F401
+        except ImportError as e:
+            raise RuntimeError(
+                "已开启 PROFILING_ENABLED，但未安装 pyinstrument，请执行 pip install -r requirements.txt"
+            ) from e
+    return enabled
+
+
+if __name__ == "__main__":
+    import sys
+
+    print(make_profile_token(int(sys.argv[1]) if len(sys.argv) > 1 else 600))
@@ -0,0 +1,326 @@
+"""
+行程路线几何 - 在后台为每天相邻景点之间计算实际路线，随行程保存
+
+地图需要按道路绘制路线，但每次打开行程都逐段调用 /maps/route 既慢又消耗高德配额。
+行程生成或修改后，后台任务为每一天相邻的两个景点调用一次驾车路线规划，取回完整的
+路线坐标，在平面坐标（米）上用 Douglas–Peucker 按几个缩放级别的容差（约一个像素）
+简化，编码为 encoded polyline（精度 1e-5，纬度在前），写入 DailyItinerary.route。
+打开行程时直接绘制保存的路线，不再调用路线接口。
+
+route.stops_key 是当天景点坐标序列的摘要：行程被修改后，只有景点发生变化的那些天
+路线失效并重新计算。写回时使用乐观并发更新，期间行程被修改则重新读取，已算好的
+路线按 stops_key 复用。
+
+取不到的路段（高德限流、网络错误等）在同一次计算中稍后重试一次；仍失败时当天路线
+标记为 complete=False 并记录 retry_after（按 ROUTE_GEOMETRY_RETRY_SECONDS 指数退避），
+之后打开或修改行程时只重新请求失败的路段，不会因为一次短暂故障永远画直线。
+"""
+import asyncio
+import hashlib
+import logging
+import time
+from typing import TYPE_CHECKING, Any, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+import orjson
+
+from config import settings
+from models.schemas import DailyItinerary, DayRoute, RouteLeg
+from services.deadline import start_deadline
+from services.map_service import map_service
+from services.supabase_service import supabase_service
+
+if TYPE_CHECKING:
+    import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# 缩放级别 -> 简化容差（米），约为该级别下一个像素对应的地面距离（纬度 30° 附近）
+ZOOM_TOLERANCES: Dict[str, float] = {"10": 130.0, "13": 16.0, "16": 2.0}
+
+# 写回时行程被并发修改的最大重试次数
+MAX_WRITE_ATTEMPTS = 3
+
+# 同一次计算中重试失败路段前的等待（秒），避开高德的瞬时限流
+LEG_RETRY_DELAY = 2.0
+
+# 跨请求重试的最长退避（秒）
+MAX_RETRY_BACKOFF = 6 * 3600
+
+# 经纬度 -> 米的近似换算（局部等距投影，路线跨度很小时误差可以忽略）
+METERS_PER_DEGREE_LAT = 110_574.0
+METERS_PER_DEGREE_LNG = 111_320.0
+
+
+def _coordinate(stop: Any) -> Tuple[float, float]:
+    """景点的 (longitude, latitude)，景点可以是模型或数据库中的字典"""
+    if isinstance(stop, dict):
+        return float(stop.get("longitude") or 0), float(stop.get("latitude") or 0)
+    return float(stop.longitude), float(stop.latitude)
+
+
+def stops_key(attractions: Iterable[Any]) -> str:
+    """当天景点坐标序列的摘要，顺序或坐标变化时随之变化"""
+    digest = hashlib.sha1()
+    for lng, lat in map(_coordinate, attractions):
+        digest.update(f"{lng:.6f},{lat:.6f};".encode("ascii"))
+    return digest.hexdigest()[:16]
+
+
+def simplify(points: "np.ndarray", tolerance: float) -> "np.ndarray":
+    """
+    Douglas–Peucker 折线简化，返回保留点的布尔掩码
+
+    points 为平面坐标（米）。用栈代替递归；每一段内所有中间点到线段的距离一次向量化算出。
+    """
+    import numpy as np
+
+    count = len(points)
+    keep = np.zeros(count, dtype=bool)
+    if count < 3:
+        keep[:] = True
+        return keep
+    keep[0] = keep[-1] = True
+
+    stack = [(0, count - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        a = points[start]
+        ab = points[end] - a
+        inner = points[start + 1:end] - a
+        length_sq = float(ab @ ab)
+        if length_sq == 0:
+            distances = np.hypot(inner[:, 0], inner[:, 1])
+        else:
+            # 投影到线段上（超出两端时取端点）后的距离
+            t = np.clip(inner @ ab / length_sq, 0.0, 1.0)
+            offset = inner - t[:, None] * ab
+            distances = np.hypot(offset[:, 0], offset[:, 1])
+        index = int(np.argmax(distances))
+        if distances[index] > tolerance:
+            split = start + 1 + index
+            keep[split] = True
+            stack.append((start, split))
+            stack.append((split, end))
+    return keep
+
+
+def encode_polyline(coordinates: Iterable[Tuple[float, float]]) -> str:
+    """按 encoded polyline 算法编码 (latitude, longitude) 序列，精度 1e-5"""
+    chunks: List[str] = []
+    previous_lat = previous_lng = 0
+    for lat, lng in coordinates:
+        current_lat, current_lng = round(lat * 1e5), round(lng * 1e5)
+        for delta in (current_lat - previous_lat, current_lng - previous_lng):
+            value = ~(delta << 1) if delta < 0 else delta << 1
+            while value >= 0x20:
+                chunks.append(chr((0x20 | (value & 0x1F)) + 63))
+                value >>= 5
+            chunks.append(chr(value + 63))
+        previous_lat, previous_lng = current_lat, current_lng
+    return "".join(chunks)
+
+
+def build_polylines(path: Sequence[Tuple[float, float]]) -> Dict[str, str]:
+    """把 [(longitude, latitude), ...] 路线按各缩放级别简化并编码"""
+    if len(path) < 2:
+        return {}
+    # numpy 只在计算路线时导入，不拖慢 import main
+    import numpy as np
+
+    lnglat = np.asarray(path, dtype=np.float64)
+    origin = lnglat[0]
+    planar = np.empty_like(lnglat)
+    planar[:, 0] = (lnglat[:, 0] - origin[0]) * METERS_PER_DEGREE_LNG * np.cos(np.radians(origin[1]))
+    planar[:, 1] = (lnglat[:, 1] - origin[1]) * METERS_PER_DEGREE_LAT
+    return {
+        zoom: encode_polyline((lat, lng) for lng, lat in lnglat[simplify(planar, tolerance)])
+        for zoom, tolerance in ZOOM_TOLERANCES.items()
+    }
+
+
+def _retry_due(route: Dict[str, Any], now: float) -> bool:
+    """有路段未取得且已到重试时间"""
+    return not route.get("complete", True) and (route.get("retry_after") or 0) <= now
+
+
+def routes_pending(days: List[Dict[str, Any]]) -> bool:
+    """
+    数据库中的每日行程是否有还没有路线、或有失败路段已到重试时间的天
+
+    打开行程时调用，不计算 stops_key：景点变化只会来自写操作，写操作已经安排了计算。
+    """
+    now = time.time()
+    return any(not day.get("route") or _retry_due(day["route"], now) for day in days)
+
+
+def invalidate_stale_routes(days: List[DailyItinerary]) -> bool:
+    """清除景点已变化的那些天的路线；返回是否有需要（重新）计算路线的天"""
+    now = time.time()
+    pending = False
+    for day in days:
+        if day.route is not None and day.route.stops_key != stops_key(day.attractions):
+            day.route = None
+        if day.route is None or _retry_due(day.route.model_dump(), now):
+            pending = True
+    return pending
+
+
+class RouteGeometryService:
+    """行程路线的后台计算"""
+
+    def __init__(self, concurrency: int):
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._tasks: Set[asyncio.Task] = set()
+        self._running: Dict[str, int] = {}
+        self.stats_counters = {
+            "scheduled": 0, "days_computed": 0, "days_incomplete": 0, "legs_failed": 0, "write_conflicts": 0
+        }
+
+    def schedule(self, trip_id: str, user_id: str, if_idle: bool = False) -> None:
+        """
+        在后台计算该行程缺少路线的天并写回
+
+        在请求中调用：任务继承请求的 contextvar，查询和写回都以调用者的身份进行。
+        if_idle 为 True 时（打开行程触发的重试）本 worker 上已有该行程的计算则不再安排。
+        """
+        if not settings.route_geometry_enabled:
+            return
+        if if_idle and self._running.get(trip_id):
+            return
+        self._running[trip_id] = self._running.get(trip_id, 0) + 1
+        task = asyncio.create_task(self._run(trip_id, user_id))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        task.add_done_callback(lambda _: self._finished(trip_id))
+        self.stats_counters["scheduled"] += 1
+
+    def _finished(self, trip_id: str) -> None:
+        self._running[trip_id] -= 1
+        if not self._running[trip_id]:
+            del self._running[trip_id]
+
+    async def _run(self, trip_id: str, user_id: str) -> None:
+        start_deadline(settings.route_geometry_timeout_seconds)
+        computed: Dict[str, Dict[str, Any]] = {}
+        try:
+            for _ in range(MAX_WRITE_ATTEMPTS):
+                # 写回以 updated_at 为条件，读取时按数据库中的当前版本校验缓存
+                version = await supabase_service.get_trip_version(trip_id, user_id)
+                trip = version is not None and await supabase_service.get_trip(trip_id, user_id, version=version)
+                if not trip:
+                    return
+                # 缓存中的行可能被其他请求共享，修改前先复制
+                days = [dict(day) for day in trip.get("daily_itineraries") or []]
+                now = time.time()
+                stale = {}
+                previous: Dict[str, Dict[str, Any]] = {}
+                for day in days:
+                    key = stops_key(day.get("attractions") or [])
+                    route = day.get("route")
+                    if not route or route.get("stops_key") != key:
+                        stale[id(day)] = key
+                    elif _retry_due(route, now):
+                        # 景点没变，只重新请求上次失败的路段
+                        stale[id(day)] = key
+                        previous[key] = route
+                if not stale:
+                    return
+
+                # 各天并发计算（路段请求数由信号量限制）
+                missing = {
+                    key: day.get("attractions") or []
+                    for day in days if id(day) in stale
+                    for key in [stale[id(day)]] if key not in computed
+                }
+                routes = await asyncio.gather(*(
+                    self._compute_day(stops, key, previous.get(key)) for key, stops in missing.items()
+                ))
+                for route in routes:
+                    computed[route.stops_key] = route.model_dump()
+                self.stats_counters["days_computed"] += len(routes)
+                for day in days:
+                    if id(day) in stale:
+                        day["route"] = computed[stale[id(day)]]
+
+                # 只写路线，不改变内容版本 edited_at：客户端刚拿到的 ETag 仍可用于 If-Match
+                updated = await supabase_service.update_trip_routes(
+                    trip_id, user_id, orjson.dumps(days).decode("utf-8"), trip.get("updated_at")
+                )
+                if updated:
+                    logger.info("行程路线已保存", extra={"trip_id": trip_id, "days": len(days)})
+                    return
+                self.stats_counters["write_conflicts"] += 1
+            logger.warning("行程路线写回冲突次数过多，放弃", extra={"trip_id": trip_id})
+        except Exception as e:
+            logger.warning("行程路线计算失败", extra={"trip_id": trip_id, "error": str(e)})
+
+    async def _compute_day(
+        self, attractions: List[Dict[str, Any]], key: str, previous: Optional[Dict[str, Any]] = None
+    ) -> DayRoute:
+        """
+        计算一天的路线；previous 为同一组景点上次未取全的路线，已取得的路段直接复用
+
+        失败的路段等待 LEG_RETRY_DELAY 后重试一次，仍失败时返回 complete=False 的路线，
+        retry_after 按连续失败次数指数退避。
+        """
+        stops = [_coordinate(attraction) for attraction in attractions]
+        pairs = list(zip(stops, stops[1:]))
+        legs: List[Optional[RouteLeg]] = [None] * len(pairs)
+        for index, leg in enumerate((previous or {}).get("legs") or []):
+            if index < len(legs) and leg.get("polylines"):
+                legs[index] = RouteLeg(**leg)
+
+        for delay in (0.0, LEG_RETRY_DELAY):
+            failed = [index for index, leg in enumerate(legs) if leg is None]
+            if not failed:
+                break
+            if delay:
+                await asyncio.sleep(delay)
+            results = await asyncio.gather(*(self._compute_leg(*pairs[index]) for index in failed))
+            for index, leg in zip(failed, results):
+                legs[index] = leg
+
+        failed_count = legs.count(None)
+        if not failed_count:
+            return DayRoute(stops_key=key, legs=legs)
+        # 取不到的路段保留为空，地图用直线连接，到 retry_after 后重新请求
+        self.stats_counters["legs_failed"] += failed_count
+        self.stats_counters["days_incomplete"] += 1
+        failures = (previous or {}).get("failures", 0) + 1
+        backoff = min(settings.route_geometry_retry_seconds * 2 ** (failures - 1), MAX_RETRY_BACKOFF)
+        return DayRoute(
+            stops_key=key,
+            legs=[leg or RouteLeg() for leg in legs],
+            complete=False,
+            failures=failures,
+            retry_after=time.time() + backoff,
+        )
+
+    async def _compute_leg(
+        self, origin: Tuple[float, float], destination: Tuple[float, float]
+    ) -> Optional[RouteLeg]:
+        """一段路线；高德返回错误或请求失败时返回 None"""
+        async with self._semaphore:
+            route = await map_service.get_route(origin, destination, with_path=True)
+        if not route:
+            return None
+        return RouteLeg(
+            distance=route["distance"],
+            duration=route["duration"],
+            polylines=build_polylines(route.get("path") or [origin, destination]),
+        )
+
+    def stats(self) -> Dict[str, int]:
+        return {"running": len(self._tasks), **self.stats_counters}
+
+    async def close(self) -> None:
+        """取消尚未完成的计算（关闭服务时调用）"""
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+
+# 单例实例
+route_geometry = RouteGeometryService(settings.route_geometry_concurrency)
@@ -1,8 +1,48 @@
-from supabase import create_client, Client
 from config import settings
-from typing import Optional, List, Dict, Any
+from services.pagination import CountMethod, apply_keyset, next_cursor
+from services.trip_cache import trip_cache
+from services.metrics import observe_upstream
+from services.deadline import upstream_deadline, within_deadline
+from services.lazy import LazyService
+from models.serialization import parse_trip_row
+from contextvars import ContextVar
+from typing import TYPE_CHECKING, Callable, Optional, List, Dict, Any, Tuple, TypeVar
 from datetime import datetime
+import asyncio
 import json
+import uuid
+
+T = TypeVar("T")
+
+if TYPE_CHECKING:
+    from gotrue.types import UserResponse
+    from postgrest import SyncPostgrestClient
+    from supabase import Client
+
+# 当前请求调用者的 PostgREST 客户端：access token 校验通过后设置（见 get_user），
+# 之后本请求中的查询都带上调用者的 JWT，由 RLS 按调用者生效
+_request_db: ContextVar[Optional["SyncPostgrestClient"]] = ContextVar("supabase_request_db", default=None)
+
+
+class _ScopedSession:
+    """
+    共享 httpx.Client 的轻量视图：每次请求附加调用者的 Authorization 头，
+    连接池、apikey 和 schema 头沿用共享客户端，不修改共享客户端的任何状态。
+    
+    HTTP 超时按请求剩余的时间预算收紧（截止时间的 contextvar 在线程池中同样可见），
+    _execute 放弃等待之后，线程中的请求也会随之超时，不会继续占用线程。
+    """
+
+    def __init__(self, session, authorization: str):
+        self._session = session
+        self._authorization = authorization
+        self.base_url = session.base_url
+
+    def request(self, method: str, url: str, *, headers=None, **kwargs):
+        headers = dict(headers or {})
+        headers["Authorization"] = self._authorization
+        kwargs.setdefault("timeout", within_deadline(settings.supabase_timeout_seconds))
+        return self._session.request(method, url, headers=headers, **kwargs)
 
 
 class SupabaseService:
@@ -26,8 +66,13 @@ class SupabaseService:
                 "=" * 60
             )
         
+        # supabase 包导入较慢，构造服务时才导入
+        from supabase import create_client
+        from gotrue import SyncGoTrueClient
+        from postgrest import SyncPostgrestClient
+        
         try:
-            self.client: Client = create_client(
+            self.client: "Client" = create_client(
                 settings.supabase_url,
                 settings.supabase_key
             )
@@ -38,105 +83,362 @@ class SupabaseService:
                 f"当前 URL: {settings.supabase_url}\n"
                 f"当前 key: {settings.supabase_key}\n"
             )
+        
+        # 认证操作使用独立、无状态的 GoTrue 客户端：在 self.client.auth 上登录会把该用户的
+        # session 保存到共享客户端，并把之后所有查询的 Authorization 切换成该用户的 JWT
+        self.auth = SyncGoTrueClient(
+            url=f"{settings.supabase_url.rstrip('/')}/auth/v1",
+            headers={"apikey": settings.supabase_key, "Authorization": f"Bearer {settings.supabase_key}"},
+            auto_refresh_token=False,
+            persist_session=False,
+        )
+        
+        class ScopedPostgrestClient(SyncPostgrestClient):
+            """请求级的 PostgREST 客户端，会话为共享连接池上附加调用者 JWT 的视图"""
+            
+            def __init__(self, session: _ScopedSession):
+                self._scoped_session = session
+                super().__init__(str(session.base_url))
+            
+            def create_session(self, base_url, headers, timeout):
+                return self._scoped_session
+        
+        self._scoped_client_class = ScopedPostgrestClient
+    
+    async def get_user(self, access_token: str) -> "UserResponse":
+        """
+        校验 access token 并返回用户；校验通过后把调用者的 PostgREST 客户端绑定到当前请求
+        
+        绑定保存在 contextvar 中，只对当前请求（及其创建的任务、线程池调用）可见
+        """
+        response = await self.call_auth("auth.get_user", self.auth.get_user, access_token)
+        if response and response.user:
+            _request_db.set(self._scoped_postgrest(access_token))
+        return response
+    
+    async def call_auth(self, operation: str, func: Callable[..., T], *args: Any) -> T:
+        """在线程池中调用 GoTrue 客户端的方法，记录耗时并受请求截止时间约束"""
+        with observe_upstream("supabase", operation):
+            async with upstream_deadline("supabase", operation, settings.supabase_timeout_seconds):
+                return await asyncio.to_thread(func, *args)
+    
+    def _scoped_postgrest(self, access_token: str) -> "SyncPostgrestClient":
+        """构造携带调用者 JWT 的 PostgREST 客户端，与共享客户端使用同一个连接池"""
+        return self._scoped_client_class(_ScopedSession(self.client.postgrest.session, f"Bearer {access_token}"))
+    
+    @property
+    def db(self):
+        """当前请求调用者的 PostgREST 客户端；不在已认证的请求中时（如预热、后台任务）使用服务端客户端"""
+        return _request_db.get() or self.client
     
     # 行程相关操作
-    async def create_trip(self, trip_data: Dict[str, Any], access_token: str = None) -> Dict[str, Any]:
+    async def create_trip(self, trip_data: Dict[str, Any]) -> Dict[str, Any]:
         """创建新行程"""
         # 将日期和枚举类型转换为字符串
         trip_data_json = self._prepare_trip_data(trip_data)
+        trip_data_json.setdefault("edited_at", trip_data_json.get("updated_at") or datetime.utcnow().isoformat())
         
-        # 如果提供了 access_token，设置到请求头
-        client = self.client
-        if access_token:
-            client = self.client.auth.set_session(access_token)
-        
-        response = client.table("trips").insert(trip_data_json).execute()
+        response = await self._execute(self.db.table("trips").insert(trip_data_json))
         return response.data[0] if response.data else None
     
-    async def get_trip(self, trip_id: str, user_id: str) -> Optional[Dict[str, Any]]:
-        """获取单个行程"""
-        response = self.client.table("trips").select("*").eq("id", trip_id).eq("user_id", user_id).execute()
-        return response.data[0] if response.data else None
+    async def create_trips_bulk(self, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """批量创建行程（单次多行 insert），返回的行与 rows 顺序一致"""
+        if not rows:
+            return []
+        now = datetime.utcnow().isoformat()
+        for row in rows:
+            row.setdefault("edited_at", row.get("updated_at") or now)
+        response = await self._execute(self.db.table("trips").insert(rows))
+        return response.data if response.data else []
     
-    async def get_user_trips(self, user_id: str, limit: int = 50, offset: int = 0) -> List[Dict[str, Any]]:
-        """获取用户的所有行程"""
-        response = (
-            self.client.table("trips")
-            .select("*")
+    @staticmethod
+    async def _execute(query):
+        """
+        在线程池中执行查询
+
+        supabase 客户端是同步的，直接 execute() 会阻塞事件循环；
+        放到线程中执行后，同一请求内互不依赖的查询才能真正并发。
+        耗时按 "方法 路径"（如 "GET /trips"、"POST /rpc/..."）记录到上游指标。
+        等待时间受请求截止时间约束，超时抛出 DeadlineExceeded。
+        """
+        operation = f"{query.http_method} {query.path}"
+        with observe_upstream("supabase", operation):
+            async with upstream_deadline("supabase", operation, settings.supabase_timeout_seconds):
+                return await asyncio.to_thread(query.execute)
+    
+    @staticmethod
+    def _valid_ids(ids: List[str]) -> List[str]:
+        """过滤掉非 UUID 的 id，避免整批 in_() 查询因类型错误失败"""
+        valid = []
+        for value in ids:
+            try:
+                uuid.UUID(str(value))
+            except ValueError:
+                continue
+            valid.append(value)
+        return valid
+    
+    async def get_trip(
+        self, trip_id: str, user_id: str, version: Optional[str] = None
+    ) -> Optional[Dict[str, Any]]:
+        """
+        获取单个行程（经过读缓存，JSON 字段已解析）
+
+        version 为刚从数据库读到的 updated_at（get_trip_version）：缓存的行与之不同时
+        （其他 worker 写入了、或写入与缓存失效之间的窗口）不用缓存，重新加载
+        """
+        async def load() -> Optional[Dict[str, Any]]:
+            response = await self._execute(
+                self.db.table("trips").select("*").eq("id", trip_id).eq("user_id", user_id)
+            )
+            return parse_trip_row(response.data[0]) if response.data else None
+        
+        return await trip_cache.get_or_load(user_id, trip_id, load, version=version)
+    
+    async def get_trips_by_ids(
+        self, trip_ids: List[str], user_id: str, versions: Optional[Dict[str, str]] = None
+    ) -> Dict[str, Dict[str, Any]]:
+        """
+        按 id 批量获取行程（经过读缓存），一次 in_() 查询加载所有未命中的行程
+
+        versions 为刚从数据库读到的 {trip_id: updated_at}（get_trip_versions），
+        与 get_trip 的 version 相同：缓存的行版本不同时重新加载
+
+        Returns:
+            {trip_id: 行程}，不存在或不属于该用户的 id 不在结果中
+        """
+        async def load(missing: List[str]) -> Dict[str, Dict[str, Any]]:
+            ids = self._valid_ids(missing)
+            if not ids:
+                return {}
+            response = await self._execute(
+                self.db.table("trips").select("*").in_("id", ids).eq("user_id", user_id)
+            )
+            return {row["id"]: parse_trip_row(row) for row in response.data or []}
+        
+        return await trip_cache.get_many_or_load(user_id, trip_ids, load, versions=versions)
+    
+    async def get_trip_version(self, trip_id: str, user_id: str) -> Optional[str]:
+        """只读取行程的 updated_at，用于 ETag 校验；行程不存在时返回 None"""
+        response = await self._execute(
+            self.db.table("trips")
+            .select("updated_at")
+            .eq("id", trip_id)
             .eq("user_id", user_id)
-            .order("created_at", desc=True)
-            .range(offset, offset + limit - 1)
-            .execute()
         )
-        return response.data if response.data else []
+        return (response.data[0]["updated_at"] or "") if response.data else None
+    
+    async def get_trip_versions(self, trip_ids: List[str], user_id: str) -> Dict[str, str]:
+        """批量读取行程的 updated_at；不存在的 id 不在结果中"""
+        ids = self._valid_ids(trip_ids)
+        if not ids:
+            return {}
+        response = await self._execute(
+            self.db.table("trips")
+            .select("id,updated_at")
+            .in_("id", ids)
+            .eq("user_id", user_id)
+        )
+        return {row["id"]: row["updated_at"] or "" for row in response.data or []}
     
-    async def update_trip(self, trip_id: str, user_id: str, trip_data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
-        """更新行程"""
+    async def get_user_trips(
+        self,
+        user_id: str,
+        limit: int = 50,
+        cursor: Optional[str] = None,
+        count: Optional[CountMethod] = None
+    ) -> Tuple[List[Dict[str, Any]], Optional[str], Optional[int]]:
+        """
+        获取用户的行程（keyset 分页）
+
+        Returns:
+            (当前页行程, 下一页游标, 总数)；未请求 count 时总数为 None
+        """
+        query = self.db.table("trips").select("*").eq("user_id", user_id)
+        response = await self._execute(apply_keyset(query, cursor, limit))
+        rows = response.data if response.data else []
+        cursor_out = next_cursor(rows, limit)
+        total = await self._count_rows("trips", count, user_id=user_id) if count else None
+        return rows, cursor_out, total
+    
+    async def update_trip(
+        self,
+        trip_id: str,
+        user_id: str,
+        trip_data: Dict[str, Any],
+        expected_updated_at: Optional[str] = None,
+        expected_edited_at: Optional[str] = None
+    ) -> Optional[Dict[str, Any]]:
+        """
+        更新行程（只写入 trip_data 中的列），同时更新内容版本 edited_at
+
+        传入 expected_updated_at（行版本）或 expected_edited_at（内容版本，后台写回路线不改变它）
+        时为乐观并发更新：行程已被他人修改则不写入并返回 None
+        """
         trip_data_json = self._prepare_trip_data(trip_data)
         trip_data_json["updated_at"] = datetime.utcnow().isoformat()
+        trip_data_json["edited_at"] = trip_data_json["updated_at"]
         
-        response = (
-            self.client.table("trips")
+        query = (
+            self.db.table("trips")
             .update(trip_data_json)
             .eq("id", trip_id)
             .eq("user_id", user_id)
-            .execute()
         )
+        if expected_updated_at is not None:
+            query = query.eq("updated_at", expected_updated_at)
+        if expected_edited_at is not None:
+            query = query.eq("edited_at", expected_edited_at)
+        response = await self._execute(query)
+        await trip_cache.invalidate(user_id, trip_id)
+        return response.data[0] if response.data else None
+    
+    async def update_trip_routes(
+        self, trip_id: str, user_id: str, daily_itineraries: str, expected_updated_at: str
+    ) -> Optional[Dict[str, Any]]:
+        """
+        写回后台算好的每日路线，不改变 edited_at
+
+        updated_at 仍会变化（条件 GET 取到带路线的新表示），但客户端手中 ETag 的内容版本不变，
+        PATCH 的 If-Match 不会因此返回 412。以 updated_at 为条件，期间行程被修改则返回 None。
+        """
+        query = (
+            self.db.table("trips")
+            .update({"daily_itineraries": daily_itineraries, "updated_at": datetime.utcnow().isoformat()})
+            .eq("id", trip_id)
+            .eq("user_id", user_id)
+            .eq("updated_at", expected_updated_at)
+        )
+        response = await self._execute(query)
+        await trip_cache.invalidate(user_id, trip_id)
         return response.data[0] if response.data else None
     
     async def delete_trip(self, trip_id: str, user_id: str) -> bool:
         """删除行程"""
-        response = (
-            self.client.table("trips")
+        response = await self._execute(
+            self.db.table("trips")
             .delete()
             .eq("id", trip_id)
             .eq("user_id", user_id)
-            .execute()
         )
+        await trip_cache.invalidate(user_id, trip_id)
         return True if response.data else False
     
     # 费用相关操作
     async def create_expense(self, expense_data: Dict[str, Any]) -> Dict[str, Any]:
         """创建费用记录"""
         expense_data["created_at"] = datetime.utcnow().isoformat()
-        response = self.client.table("expenses").insert(expense_data).execute()
+        response = await self._execute(self.db.table("expenses").insert(expense_data))
         return response.data[0] if response.data else None
     
+    async def create_expenses_bulk(self, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """批量创建费用记录（单次多行 insert），未指定 created_at 的使用当前时间"""
+        if not rows:
+            return []
+        now = datetime.utcnow().isoformat()
+        for row in rows:
+            row.setdefault("created_at", now)
+        response = await self._execute(self.db.table("expenses").insert(rows))
+        return response.data if response.data else []
+    
     async def get_trip_expenses(self, trip_id: str, user_id: str) -> List[Dict[str, Any]]:
         """获取行程的所有费用"""
-        response = (
-            self.client.table("expenses")
+        response = await self._execute(
+            self.db.table("expenses")
             .select("*")
             .eq("trip_id", trip_id)
             .eq("user_id", user_id)
             .order("date", desc=True)
-            .execute()
         )
         return response.data if response.data else []
     
+    async def get_expense_totals(self, trip_id: str, user_id: str) -> Dict[str, Any]:
+        """
+        通过 RPC 从汇总表读取费用统计，一次往返、与费用条数无关
+
+        Returns:
+            {total_spent, expense_count, by_category, by_day, last_updated_at}
+        """
+        response = await self._execute(self.db.rpc(
+            "get_trip_expense_summary",
+            {"p_trip_id": trip_id, "p_user_id": user_id}
+        ))
+        return response.data
+    
+    async def get_expenses_version(self, trip_id: str, user_id: str) -> Tuple[int, Optional[str]]:
+        """
+        获取行程费用的版本信息 (条数, 最近的 updated_at)，用于 ETag 校验
+
+        新增、修改、删除任一费用都会改变其中至少一项；只取一行，不加载费用明细。
+        """
+        response = await self._execute(
+            self.db.table("expenses")
+            .select("updated_at", count="exact")
+            .eq("trip_id", trip_id)
+            .eq("user_id", user_id)
+            .order("updated_at", desc=True)
+            .limit(1)
+        )
+        latest = response.data[0]["updated_at"] if response.data else None
+        return response.count or 0, latest
+    
+    async def get_trip_expenses_page(
+        self,
+        trip_id: str,
+        user_id: str,
+        limit: int = 50,
+        cursor: Optional[str] = None,
+        count: Optional[CountMethod] = None
+    ) -> Tuple[List[Dict[str, Any]], Optional[str], Optional[int]]:
+        """获取行程费用（keyset 分页，按 created_at, id 倒序）"""
+        query = (
+            self.db.table("expenses")
+            .select("*")
+            .eq("trip_id", trip_id)
+            .eq("user_id", user_id)
+        )
+        response = await self._execute(apply_keyset(query, cursor, limit))
+        rows = response.data if response.data else []
+        cursor_out = next_cursor(rows, limit)
+        total = await self._count_rows("expenses", count, trip_id=trip_id, user_id=user_id) if count else None
+        return rows, cursor_out, total
+    
+    async def get_expense(self, expense_id: str, user_id: str) -> Optional[Dict[str, Any]]:
+        """获取单条费用记录"""
+        response = await self._execute(
+            self.db.table("expenses").select("*").eq("id", expense_id).eq("user_id", user_id)
+        )
+        return response.data[0] if response.data else None
+    
     async def update_expense(self, expense_id: str, user_id: str, expense_data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
         """更新费用记录"""
-        response = (
-            self.client.table("expenses")
+        response = await self._execute(
+            self.db.table("expenses")
             .update(expense_data)
             .eq("id", expense_id)
             .eq("user_id", user_id)
-            .execute()
         )
         return response.data[0] if response.data else None
     
-    async def delete_expense(self, expense_id: str, user_id: str) -> bool:
-        """删除费用记录"""
-        response = (
-            self.client.table("expenses")
+    async def delete_expense(self, expense_id: str, user_id: str) -> Optional[Dict[str, Any]]:
+        """删除费用记录，返回被删除的行（不存在时返回 None）"""
+        response = await self._execute(
+            self.db.table("expenses")
             .delete()
             .eq("id", expense_id)
             .eq("user_id", user_id)
-            .execute()
         )
-        return True if response.data else False
+        return response.data[0] if response.data else None
     
     # 辅助方法
+    async def _count_rows(self, table: str, count: CountMethod, **filters: str) -> Optional[int]:
+        """统计总数；planned / estimated 由 PostgREST 读取查询规划器的估算值，避免全表计数"""
+        query = self.db.table(table).select("id", count=count)
+        for column, value in filters.items():
+            query = query.eq(column, value)
+        response = await self._execute(query.limit(1))
+        return response.count
+    
     def _prepare_trip_data(self, trip_data: Dict[str, Any]) -> Dict[str, Any]:
         """准备行程数据，转换为 JSON 兼容格式"""
         result = {}
@@ -151,5 +453,5 @@ class SupabaseService:
 
 
 # 单例实例
-supabase_service = SupabaseService()
+supabase_service: SupabaseService = LazyService("supabase", SupabaseService)
 
@@ -0,0 +1,261 @@
+"""
+行程读缓存 - 按 (user_id, trip_id) 缓存解析后的行程行
+
+读取走 read-through：未命中时从 Supabase 加载并写入缓存；
+update_trip / delete_trip 时删除对应条目。
+
+后端可插拔：
+- memory：进程内 LRU，按条目数限制大小，适合单 worker
+- redis：共享的本地缓存服务器，多个 worker 看到同一份数据并同时失效
+"""
+import time
+import logging
+import orjson
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class CacheBackend:
+    """缓存后端接口，值统一为 bytes"""
+
+    name = "base"
+
+    async def get(self, key: str) -> Optional[bytes]:
+        raise NotImplementedError
+
+    async def set(self, key: str, value: bytes, ttl: int) -> None:
+        raise NotImplementedError
+
+    async def delete(self, key: str) -> None:
+        raise NotImplementedError
+
+    async def evictions(self) -> int:
+        """因容量被淘汰的条目数"""
+        return 0
+
+    async def size(self) -> int:
+        return 0
+
+
+class MemoryCacheBackend(CacheBackend):
+    """进程内 LRU 缓存，超过 max_entries 时淘汰最久未使用的条目"""
+
+    name = "memory"
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()
+        self._evictions = 0
+
+    async def get(self, key: str) -> Optional[bytes]:
+        item = self._data.get(key)
+        if item is None:
+            return None
+        value, expires_at = item
+        if expires_at < time.monotonic():
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    async def set(self, key: str, value: bytes, ttl: int) -> None:
+        self._data[key] = (value, time.monotonic() + ttl)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+            self._evictions += 1
+
+    async def delete(self, key: str) -> None:
+        self._data.pop(key, None)
+
+    async def evictions(self) -> int:
+        return self._evictions
+
+    async def size(self) -> int:
+        return len(self._data)
+
+
+class RedisCacheBackend(CacheBackend):
+    """
+    Redis 缓存后端
+
+    容量由 Redis 的 maxmemory + allkeys-lru 策略控制，淘汰数读取自 INFO stats。
+    """
+
+    name = "redis"
+
+    def __init__(self, url: str):
+        try:
+            import redis.asyncio as redis
+        except ImportError:
+            raise ValueError(
+                "TRIP_CACHE_BACKEND=redis 需要安装 redis 包：pip install redis"
+            )
+        self.client = redis.from_url(url)
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return await self.client.get(key)
+
+    async def set(self, key: str, value: bytes, ttl: int) -> None:
+        await self.client.set(key, value, ex=ttl)
+
+    async def delete(self, key: str) -> None:
+        await self.client.delete(key)
+
+    async def evictions(self) -> int:
+        info = await self.client.info("stats")
+        return int(info.get("evicted_keys", 0))
+
+    async def size(self) -> int:
+        return await self.client.dbsize()
+
+
+class TripCache:
+    """行程 read-through 缓存，记录命中率"""
+
+    def __init__(self, backend: Optional[CacheBackend], ttl: int):
+        self.backend = backend
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.errors = 0
+
+    @staticmethod
+    def _key(user_id: str, trip_id: str) -> str:
+        return f"trip:{user_id}:{trip_id}"
+
+    async def get_or_load(
+        self,
+        user_id: str,
+        trip_id: str,
+        loader: Callable[[], Awaitable[Optional[Dict[str, Any]]]],
+        version: Optional[str] = None
+    ) -> Optional[Dict[str, Any]]:
+        """
+        命中则返回缓存副本，否则调用 loader 加载并写入缓存；缓存故障时直接回源。
+        给出 version（数据库中当前的 updated_at）时，updated_at 不同的缓存条目视为过期
+        """
+        if self.backend is None:
+            return await loader()
+
+        key = self._key(user_id, trip_id)
+        try:
+            cached = await self.backend.get(key)
+        except Exception as e:
+            self.errors += 1
+            logger.warning("行程缓存读取失败", extra={"error": str(e)})
+            cached = None
+        if cached is not None:
+            trip = orjson.loads(cached)
+            if version is None or (trip.get("updated_at") or "") == version:
+                self.hits += 1
+                return trip
+            self.stale += 1
+        else:
+            self.misses += 1
+
+        trip = await loader()
+        if trip is not None:
+            try:
+                await self.backend.set(key, orjson.dumps(trip), self.ttl)
+            except Exception as e:
+                self.errors += 1
+                logger.warning("行程缓存写入失败", extra={"error": str(e)})
+        return trip
+
+    async def get_many_or_load(
+        self,
+        user_id: str,
+        trip_ids: List[str],
+        loader: Callable[[List[str]], Awaitable[Dict[str, Dict[str, Any]]]],
+        versions: Optional[Dict[str, str]] = None
+    ) -> Dict[str, Dict[str, Any]]:
+        """
+        批量版本：逐个查缓存，未命中的 id 交给 loader 一次加载
+
+        给出 versions（{trip_id: 数据库中当前的 updated_at}）时，版本不同的缓存条目视为过期，
+        不在 versions 中的 id 视为不存在，不再查缓存和加载
+        """
+        if versions is not None:
+            trip_ids = [trip_id for trip_id in trip_ids if trip_id in versions]
+        if self.backend is None:
+            return await loader(trip_ids) if trip_ids else {}
+
+        found: Dict[str, Dict[str, Any]] = {}
+        missing: List[str] = []
+        for trip_id in trip_ids:
+            try:
+                cached = await self.backend.get(self._key(user_id, trip_id))
+            except Exception as e:
+                self.errors += 1
+                logger.warning("行程缓存读取失败", extra={"error": str(e)})
+                cached = None
+            if cached is not None:
+                trip = orjson.loads(cached)
+                if versions is None or (trip.get("updated_at") or "") == versions[trip_id]:
+                    self.hits += 1
+                    found[trip_id] = trip
+                    continue
+                self.stale += 1
+            else:
+                self.misses += 1
+            missing.append(trip_id)
+
+        if missing:
+            loaded = await loader(missing)
+            for trip_id, trip in loaded.items():
+                try:
+                    await self.backend.set(self._key(user_id, trip_id), orjson.dumps(trip), self.ttl)
+                except Exception as e:
+                    self.errors += 1
+                    logger.warning("行程缓存写入失败", extra={"error": str(e)})
+            found.update(loaded)
+        return found
+
+    async def invalidate(self, user_id: str, trip_id: str) -> None:
+        if self.backend is None:
+            return
+        try:
+            await self.backend.delete(self._key(user_id, trip_id))
+        except Exception as e:
+            self.errors += 1
+            logger.warning("行程缓存失效失败", extra={"error": str(e)})
+
+    async def stats(self) -> Dict[str, Any]:
+        """命中率、淘汰数等指标"""
+        lookups = self.hits + self.misses + self.stale
+        result = {
+            "backend": self.backend.name if self.backend else "none",
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "stale": self.stale,
+            "errors": self.errors,
+            "evictions": 0,
+            "size": 0,
+        }
+        if self.backend is not None:
+            try:
+                result["evictions"] = await self.backend.evictions()
+                result["size"] = await self.backend.size()
+            except Exception as e:
+                self.errors += 1
+                logger.warning("行程缓存统计失败", extra={"error": str(e)})
+        return result
+
+
+def _create_backend() -> Optional[CacheBackend]:
+    backend = settings.trip_cache_backend.lower()
+    if backend == "none":
+        return None
+    if backend == "redis":
+        return RedisCacheBackend(settings.trip_cache_redis_url)
+    return MemoryCacheBackend(settings.trip_cache_max_entries)
+
+
+# 单例实例
+trip_cache = TripCache(_create_backend(), settings.trip_cache_ttl_seconds)
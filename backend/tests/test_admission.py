@@ -0,0 +1,45 @@
+"""准入控制的在途名额：只有真正占用了名额的请求才归还"""
+import asyncio
+
+from services.admission import LLM, AdmissionController, MemoryAdmissionBackend
+
+IN_FLIGHT_KEY = "admission:llm:in_flight"
+
+
+class FlakyTakeBackend(MemoryAdmissionBackend):
+    """取令牌失败（如 Redis 超时）的后端"""
+
+    async def take(self, key, limit):
+        raise ConnectionError("redis unavailable")
+
+
+def test_fail_open_does_not_hold_or_release_a_slot():
+    async def scenario():
+        controller = AdmissionController(FlakyTakeBackend())
+        controller.max_llm_in_flight = 2
+        # 另一个请求正常占用了名额
+        await controller.backend.enter(IN_FLIGHT_KEY, 2)
+
+        reason, _, entered = await controller.admit(LLM, "t:caller")
+        assert reason is None
+        assert entered is False
+        assert controller.errors == 1
+        assert await controller.backend.in_flight(IN_FLIGHT_KEY) == 1
+
+    asyncio.run(scenario())
+
+
+def test_admitted_llm_request_holds_a_slot_until_released():
+    async def scenario():
+        controller = AdmissionController(MemoryAdmissionBackend())
+        controller.max_llm_in_flight = 1
+
+        reason, _, entered = await controller.admit(LLM, "t:a")
+        assert (reason, entered) == (None, True)
+        reason, _, entered = await controller.admit(LLM, "t:b")
+        assert (reason, entered) == ("llm_backlog", False)
+
+        await controller.release()
+        assert await controller.backend.in_flight(IN_FLIGHT_KEY) == 0
+
+    asyncio.run(scenario())
@@ -0,0 +1,75 @@
+"""导入按批写入：导出文件中行程与其费用交错，行程仍成批写入"""
+import asyncio
+from itertools import count
+from types import SimpleNamespace
+
+import pytest
+
+import api.data as data_api
+from api.data import _Importer
+
+
+def _trip(trip_id):
+    return {
+        "id": trip_id,
+        "title": "导入测试",
+        "destination": "东京",
+        "start_date": "2026-11-01",
+        "end_date": "2026-11-02",
+        "total_days": 2,
+        "budget": 5000,
+        "travelers": 1,
+        "preferences": [],
+        "has_children": False,
+        "daily_itineraries": [],
+        "accommodations": [],
+        "estimated_costs": {},
+        "total_estimated_cost": 0,
+    }
+
+
+def _expense(trip_id):
+    return {"trip_id": trip_id, "category": "food", "amount": 50, "description": "午餐", "date": "2026-11-01"}
+
+
+@pytest.fixture
+def inserts(monkeypatch):
+    calls = {"trips": [], "expenses": []}
+    new_ids = count(1)
+
+    async def create_trips_bulk(rows):
+        calls["trips"].append(rows)
+        return [{**row, "id": f"new-{next(new_ids)}"} for row in rows]
+
+    async def create_expenses_bulk(rows):
+        calls["expenses"].append(rows)
+        return rows
+
+    fake_service = SimpleNamespace(create_trips_bulk=create_trips_bulk, create_expenses_bulk=create_expenses_bulk)
+    monkeypatch.setattr(data_api, "supabase_service", fake_service)
+    monkeypatch.setattr(data_api, "IMPORT_BATCH_SIZE", 50)
+    return calls
+
+
+def test_interleaved_expenses_do_not_flush_trips_one_by_one(inserts):
+    async def scenario():
+        importer = _Importer("user-1")
+        line_no = count(1)
+        for old_id in ("old-a", "old-b", "old-c"):
+            await importer.add_trip(next(line_no), _trip(old_id))
+            for _ in range(2):
+                await importer.add_expense(next(line_no), _expense(old_id))
+        # 没有 id 的行程不应把 None 记为待写入的行程 id
+        await importer.add_trip(next(line_no), {k: v for k, v in _trip(None).items() if k != "id"})
+        assert None not in importer.pending_trip_ids
+
+        await importer.flush_trips()
+        await importer.flush_expenses()
+        return importer
+
+    importer = asyncio.run(scenario())
+
+    assert [len(batch) for batch in inserts["trips"]] == [4]
+    assert [len(batch) for batch in inserts["expenses"]] == [6]
+    assert [row["trip_id"] for row in inserts["expenses"][0]] == ["new-1"] * 2 + ["new-2"] * 2 + ["new-3"] * 2
+    assert (importer.trips_imported, importer.expenses_imported, importer.error_count) == (4, 6, 0)
@@ -0,0 +1,27 @@
+"""行程 ETag：条件 GET 比较行版本，If-Match 只比较内容版本"""
+from api.etag import trip_content_matches, trip_etag, trip_not_modified_etag
+
+
+def test_route_write_back_changes_get_etag_but_not_if_match():
+    before = trip_etag("t1", "edit-1", "row-1")
+    # 后台写回路线：updated_at 变化，edited_at 不变
+    after = trip_etag("t1", "edit-1", "row-2")
+
+    assert before != after
+    assert trip_not_modified_etag(before, "t1", "row-2") is None
+    assert trip_not_modified_etag(f'W/{after}', "t1", "row-2") == after
+    assert trip_content_matches(before, "t1", "edit-1")
+    # 用户修改后内容版本变化
+    assert not trip_content_matches(before, "t1", "edit-2")
+    assert trip_content_matches("*", "t1", "edit-2")
+
+
+def test_sparse_fields_are_a_different_representation():
+    full = trip_etag("t1", "edit-1", "row-1")
+    sparse = trip_etag("t1", "edit-1", "row-1", "title")
+
+    assert full != sparse
+    assert trip_not_modified_etag(full, "t1", "row-1", "title") is None
+    assert trip_not_modified_etag(sparse, "t1", "row-1", "title") == sparse
+    # 旧格式（单段）的 ETag 不再匹配
+    assert trip_not_modified_etag('"0123"', "t1", "row-1") is None
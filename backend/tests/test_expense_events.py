@@ -0,0 +1,48 @@
+"""费用事件流：读快照期间到达的变更不再作为增量发出，改发 resync"""
+import asyncio
+from types import SimpleNamespace
+
+import orjson
+import pytest
+
+import api.expenses as expenses_api
+from services.expense_events import expense_events
+
+ROW = {"id": "e1", "trip_id": "t1", "user_id": "u1", "category": "food", "amount": 30, "date": "2026-11-01"}
+
+
+@pytest.fixture
+def fake_db(monkeypatch):
+    async def get_user(token):
+        return SimpleNamespace(user=SimpleNamespace(id="u1"))
+
+    async def get_trip_version(trip_id, user_id):
+        return "2026-10-19T00:00:00+00:00"
+
+    async def get_expense_totals(trip_id, user_id):
+        # 费用在快照读取期间提交并发布，快照已经包含它
+        await expense_events.publish_change("expense.created", None, ROW)
+        return {"total_spent": 30.0, "expense_count": 1, "by_category": {"food": 30.0}, "by_day": {"2026-11-01": 30.0}}
+
+    monkeypatch.setattr(expenses_api, "supabase_service", SimpleNamespace(
+        get_user=get_user, get_trip_version=get_trip_version, get_expense_totals=get_expense_totals,
+    ))
+
+
+def test_change_during_snapshot_read_is_not_sent_as_delta(fake_db):
+    async def scenario():
+        response = await expenses_api.subscribe_expense_events("t1", authorization="Bearer token")
+        stream = response.body_iterator
+        try:
+            chunks = [await stream.__anext__() for _ in range(3)]
+            # 之后的变更照常作为增量推送
+            await expense_events.publish_change("expense.deleted", ROW, None)
+            chunks.append(await stream.__anext__())
+        finally:
+            await stream.aclose()
+        return [orjson.loads(chunk[len(b"data: "):]) for chunk in chunks[1:]]
+
+    snapshot, resync, deleted = asyncio.run(scenario())
+    assert snapshot["type"] == "snapshot" and snapshot["summary"]["expense_count"] == 1
+    assert resync == {"type": "resync", "trip_id": "t1"}
+    assert deleted["type"] == "expense.deleted" and deleted["delta"]["expense_count"] == -1
@@ -0,0 +1,74 @@
+"""
+行程生成在高德变慢时的降级：POI 搜索触及高德的超时上限（请求预算仍有剩余）时，
+候选为空，行程按完整格式生成并成功返回，而不是 504
+"""
+import socket
+
+import httpx
+import pytest
+
+from benchmarks.e2e.mocks import BENCH_EMAIL, BENCH_PASSWORD
+from benchmarks.e2e.run import start_process, stop_process, wait_ready
+
+API = "/api/v1"
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture
+def slow_amap_app():
+    """替身的高德延迟 1.5s，应用的高德超时上限 0.3s"""
+    mock_port, app_port = _free_port(), _free_port()
+    mock_url = f"http://127.0.0.1:{mock_port}"
+    app_url = f"http://127.0.0.1:{app_port}"
+    mocks = start_process([
+        "-m", "benchmarks.e2e.mocks", "--port", str(mock_port),
+        "--amap-latency-ms", "1500", "--llm-latency-ms", "50",
+    ])
+    app = None
+    try:
+        wait_ready(f"{mock_url}/v1/chat/completions", mocks)
+        app = start_process(
+            ["-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(app_port), "--log-level", "warning"],
+            env={
+                "SUPABASE_URL": mock_url,
+                "SUPABASE_KEY": "bench.mock.key",
+                "OPENAI_API_KEY": "bench-mock-key",
+                "OPENAI_BASE_URL": f"{mock_url}/v1",
+                "AMAP_API_KEY": "bench-mock-key",
+                "AMAP_BASE_URL": f"{mock_url}/v3",
+                "AMAP_TIMEOUT_SECONDS": "0.3",
+                "ADMISSION_ENABLED": "false",
+                "ROUTE_GEOMETRY_ENABLED": "false",
+            },
+        )
+        wait_ready(f"{app_url}/health", app)
+        yield app_url
+    finally:
+        if app is not None:
+            stop_process(app)
+        stop_process(mocks)
+
+
+def test_plan_falls_back_when_poi_search_times_out(slow_amap_app):
+    with httpx.Client(base_url=slow_amap_app, timeout=30) as client:
+        response = client.post(f"{API}/auth/signin", json={"email": BENCH_EMAIL, "password": BENCH_PASSWORD})
+        headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+        response = client.post(f"{API}/trips/plan", headers=headers, json={
+            "destination": "东京",
+            "start_date": "2026-11-01",
+            "end_date": "2026-11-03",
+            "budget": 9000,
+            "preferences": ["culture"],
+        })
+
+        assert response.status_code == 200, response.text
+        first = response.json()["daily_itineraries"][0]["attractions"][0]
+        # 没有候选时大模型替身按完整格式回复
+        assert first["name"] == "景点0-0"
+        assert client.get("/health/poi").json()["poi_index"]["size"] == 0
@@ -0,0 +1,116 @@
+"""行程路线几何：折线简化、polyline 编码、路线失效判断和失败路段的重试"""
+import asyncio
+import time
+from datetime import date
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+import services.route_geometry as route_geometry_module
+from models.schemas import Attraction, DailyItinerary, DayRoute, RouteLeg
+from services.route_geometry import (
+    RouteGeometryService, encode_polyline, invalidate_stale_routes, simplify, stops_key
+)
+
+
+def _attraction(lng: float, lat: float) -> Attraction:
+    return Attraction(name="景点", description="", address="", latitude=lat, longitude=lng, duration=60)
+
+
+def _day(attractions, route=None) -> DailyItinerary:
+    return DailyItinerary(day=1, date=date(2026, 11, 1), attractions=attractions, route=route)
+
+
+def test_simplify_drops_points_within_tolerance():
+    points = np.array([[0.0, 0.0], [50.0, 1.0], [100.0, -1.0], [150.0, 0.0], [200.0, 80.0]])
+    assert simplify(points, 5.0).tolist() == [True, False, False, True, True]
+    # 容差足够大时只保留两端
+    assert simplify(points, 100.0).tolist() == [True, False, False, False, True]
+    assert simplify(points[:2], 5.0).tolist() == [True, True]
+
+
+def test_encode_polyline_matches_reference():
+    # 算法说明中的示例
+    coordinates = [(38.5, -120.2), (40.7, -120.95), (43.252, -126.453)]
+    assert encode_polyline(coordinates) == "_p~iF~ps|U_ulLnnqC_mqNvxq`@"
+    assert encode_polyline([]) == ""
+
+
+def test_invalidate_stale_routes():
+    stops = [_attraction(104.06, 30.66), _attraction(104.08, 30.67)]
+    key = stops_key(stops)
+
+    fresh = _day(stops, DayRoute(stops_key=key, legs=[RouteLeg()]))
+    assert invalidate_stale_routes([fresh]) is False
+    assert fresh.route is not None
+
+    moved = _day([stops[1], stops[0]], DayRoute(stops_key=key))
+    assert invalidate_stale_routes([moved]) is True
+    assert moved.route is None
+
+    waiting = DayRoute(stops_key=key, complete=False, failures=1, retry_after=time.time() + 600)
+    assert invalidate_stale_routes([_day(stops, waiting)]) is False
+    due = DayRoute(stops_key=key, complete=False, failures=1, retry_after=time.time() - 1)
+    day = _day(stops, due)
+    assert invalidate_stale_routes([day]) is True
+    # 景点没变，保留已取得的路段
+    assert day.route is due
+
+
+@pytest.fixture
+def routes(monkeypatch):
+    """高德路线的替身：outage 中的路段返回 None（与 map_service 出错时一致）"""
+    state = SimpleNamespace(outage=set(), calls=[])
+
+    async def get_route(origin, destination, with_path=False):
+        state.calls.append(origin)
+        if origin in state.outage:
+            return None
+        return {"distance": 1000, "duration": 120, "path": [origin, destination]}
+
+    monkeypatch.setattr(route_geometry_module, "map_service", SimpleNamespace(get_route=get_route))
+    monkeypatch.setattr(route_geometry_module, "LEG_RETRY_DELAY", 0)
+    return state
+
+
+def test_failed_leg_is_marked_for_retry_and_only_it_is_refetched(routes):
+    service = RouteGeometryService(concurrency=2)
+    stops = [{"longitude": 104.0 + i / 100, "latitude": 30.6} for i in range(3)]
+    second = (stops[1]["longitude"], stops[1]["latitude"])
+
+    async def scenario():
+        routes.outage.add(second)
+        failed = await service._compute_day(stops, "k")
+        routes.outage.clear()
+        routes.calls.clear()
+        retried = await service._compute_day(stops, "k", failed.model_dump())
+        return failed, retried
+
+    failed, retried = asyncio.run(scenario())
+    assert failed.complete is False and failed.failures == 1
+    assert failed.retry_after > time.time()
+    assert failed.legs[0].polylines and not failed.legs[1].polylines
+    # 重试只请求上次失败的路段
+    assert routes.calls == [second]
+    assert retried.complete is True
+    assert all(leg.polylines for leg in retried.legs)
+
+
+def test_transient_failure_is_retried_within_the_same_run(routes):
+    service = RouteGeometryService(concurrency=2)
+    stops = [{"longitude": 104.0, "latitude": 30.6}, {"longitude": 104.01, "latitude": 30.6}]
+    first = (104.0, 30.6)
+    original = route_geometry_module.map_service.get_route
+
+    async def flaky(origin, destination, with_path=False):
+        # 第一次请求被限流，第二次成功
+        if not routes.calls:
+            routes.calls.append(origin)
+            return None
+        return await original(origin, destination, with_path)
+
+    route_geometry_module.map_service.get_route = flaky
+    day = asyncio.run(service._compute_day(stops, "k"))
+    assert day.complete is True and day.legs[0].polylines
+    assert routes.calls == [first, first]
@@ -0,0 +1,30 @@
+"""导入 main 不构造服务，也不导入只在请求中用到的重量级依赖"""
+import os
+import subprocess
+import sys
+
+from benchmarks.bench_startup import BACKEND_DIR, EMPTY_ENV, HEAVY_MODULES
+
+PROBE = f"""
+import sys
+import main
+from services.lazy import services_status
+print(",".join(name for name, status in services_status().items() if status["initialized"]))
+print(",".join(name for name in {HEAVY_MODULES!r} if name in sys.modules))
+"""
+
+
+def test_import_main_stays_light():
+    # 在干净的子进程中导入，避免其他测试已经导入的模块干扰
+    output = subprocess.run(
+        [sys.executable, "-c", PROBE],
+        cwd=BACKEND_DIR,
+        env={**os.environ, **EMPTY_ENV},
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout.splitlines()
+
+    built, loaded = output[-2:]
+    assert built == ""
+    assert loaded == ""
@@ -0,0 +1,77 @@
+"""行程读缓存按数据库版本校验：缓存的行与当前 updated_at 不同时重新加载"""
+import asyncio
+from types import SimpleNamespace
+
+from services.trip_cache import MemoryCacheBackend, TripCache
+
+
+def test_stale_entry_is_reloaded_when_version_differs():
+    async def scenario():
+        cache = TripCache(MemoryCacheBackend(16), ttl=60)
+        rows = [{"id": "t1", "updated_at": "v1"}, {"id": "t1", "updated_at": "v2"}]
+        loads = []
+
+        async def load():
+            loads.append(1)
+            return rows[len(loads) - 1]
+
+        assert (await cache.get_or_load("u", "t1", load, version="v1"))["updated_at"] == "v1"
+        assert (await cache.get_or_load("u", "t1", load, version="v1"))["updated_at"] == "v1"
+        # 另一个 worker 写入后数据库版本变为 v2，本进程的缓存条目仍是 v1
+        assert (await cache.get_or_load("u", "t1", load, version="v2"))["updated_at"] == "v2"
+        assert (await cache.get_or_load("u", "t1", load, version="v2"))["updated_at"] == "v2"
+
+        assert len(loads) == 2
+        assert (cache.hits, cache.misses, cache.stale) == (2, 1, 1)
+
+    asyncio.run(scenario())
+
+
+def test_batch_read_checks_versions():
+    async def scenario():
+        cache = TripCache(MemoryCacheBackend(16), ttl=60)
+        rows = {"t1": {"id": "t1", "updated_at": "v1"}, "t2": {"id": "t2", "updated_at": "v1"}}
+        loaded = []
+
+        async def load(ids):
+            loaded.append(sorted(ids))
+            return {trip_id: dict(rows[trip_id]) for trip_id in ids}
+
+        await cache.get_many_or_load("u", ["t1", "t2"], load, versions={"t1": "v1", "t2": "v1"})
+        # 其他 worker 修改了 t2：只有 t2 重新加载；不在 versions 中的 id 视为不存在
+        rows["t2"]["updated_at"] = "v2"
+        trips = await cache.get_many_or_load("u", ["t1", "t2", "t3"], load, versions={"t1": "v1", "t2": "v2"})
+
+        assert loaded == [["t1", "t2"], ["t2"]]
+        assert trips["t2"]["updated_at"] == "v2" and "t3" not in trips
+        assert (cache.hits, cache.misses, cache.stale) == (1, 2, 1)
+
+    asyncio.run(scenario())
+
+
+def test_request_loader_validates_cached_trips(monkeypatch):
+    import services.dataloader as dataloader
+    calls = []
+
+    async def get_trip_versions(ids, user_id):
+        calls.append(("versions", sorted(ids)))
+        return {trip_id: "v2" for trip_id in ids if trip_id != "missing"}
+
+    async def get_trips_by_ids(ids, user_id, versions=None):
+        calls.append(("trips", versions))
+        return {trip_id: {"id": trip_id, "updated_at": version} for trip_id, version in versions.items()}
+
+    monkeypatch.setattr(dataloader, "supabase_service", SimpleNamespace(
+        get_trip_versions=get_trip_versions, get_trips_by_ids=get_trips_by_ids,
+    ))
+
+    async def scenario():
+        loaders = dataloader.RequestLoaders("u")
+        version = await loaders.trip_version.load("t1")
+        trip, missing = await asyncio.gather(loaders.trip.load("t1"), loaders.trip.load("missing"))
+        return version, trip, missing
+
+    version, trip, missing = asyncio.run(scenario())
+    assert version == "v2" and trip["updated_at"] == "v2" and missing is None
+    # t1 的版本复用 ETag 校验时的查询
+    assert calls == [("versions", ["t1"]), ("versions", ["missing"]), ("trips", {"t1": "v2"})]
@@ -19,9 +19,15 @@ CREATE TABLE IF NOT EXISTS trips (
   estimated_costs JSONB DEFAULT '{}'::jsonb,
   total_estimated_cost DECIMAL DEFAULT 0,
   created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
-  updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+  updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+  edited_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW()
 );
 
+-- 已有数据库升级：补充 edited_at（内容版本：只随用户修改变化，
+-- 后台写回路线不改变它，用于 PATCH 的 If-Match 和写入条件）
+ALTER TABLE trips
+  ADD COLUMN IF NOT EXISTS edited_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW();
+
 -- 创建费用表
 CREATE TABLE IF NOT EXISTS expenses (
   id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
@@ -33,9 +39,14 @@ CREATE TABLE IF NOT EXISTS expenses (
   date DATE NOT NULL,
   location TEXT,
   notes TEXT,
-  created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+  created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+  updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW()
 );
 
+-- 已有数据库升级：补充 updated_at（用于 ETag 版本校验）
+ALTER TABLE expenses
+  ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW();
+
 -- 创建索引以提高查询性能
 CREATE INDEX IF NOT EXISTS idx_trips_user_id ON trips(user_id);
 CREATE INDEX IF NOT EXISTS idx_trips_created_at ON trips(created_at DESC);
@@ -43,6 +54,16 @@ CREATE INDEX IF NOT EXISTS idx_expenses_trip_id ON expenses(trip_id);
 CREATE INDEX IF NOT EXISTS idx_expenses_user_id ON expenses(user_id);
 CREATE INDEX IF NOT EXISTS idx_expenses_date ON expenses(date);
 
+-- keyset 分页索引：与 (created_at DESC, id DESC) 排序和游标条件一致
+CREATE INDEX IF NOT EXISTS idx_trips_user_created_id
+  ON trips(user_id, created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_expenses_trip_user_created_id
+  ON expenses(trip_id, user_id, created_at DESC, id DESC);
+
+-- ETag 版本查询索引：取某行程最近一次修改的费用
+CREATE INDEX IF NOT EXISTS idx_expenses_trip_user_updated
+  ON expenses(trip_id, user_id, updated_at DESC);
+
 -- 启用行级安全策略 (Row Level Security)
 ALTER TABLE trips ENABLE ROW LEVEL SECURITY;
 ALTER TABLE expenses ENABLE ROW LEVEL SECURITY;
@@ -95,6 +116,11 @@ CREATE TRIGGER update_trips_updated_at
   FOR EACH ROW
   EXECUTE FUNCTION update_updated_at_column();
 
+CREATE TRIGGER update_expenses_updated_at
+  BEFORE UPDATE ON expenses
+  FOR EACH ROW
+  EXECUTE FUNCTION update_updated_at_column();
+
 -- 创建视图：用户行程统计
 CREATE OR REPLACE VIEW user_trip_stats AS
 SELECT 
@@ -118,6 +144,139 @@ FROM expenses e
 JOIN trips t ON e.trip_id = t.id
 GROUP BY e.trip_id, e.user_id, t.budget;
 
+-- ==========================================
+-- 费用汇总表：按 (行程, 类别, 日期) 维护金额和条数
+-- ==========================================
+-- 由 expenses 上的语句级触发器增量维护，统计查询只扫描汇总格子
+-- （类别数 × 天数），与费用条数无关。
+-- 不对 trips / auth.users 建外键：级联删除费用时触发器仍需写入本表。
+CREATE TABLE IF NOT EXISTS expense_rollups (
+  trip_id UUID NOT NULL,
+  user_id UUID NOT NULL,
+  category TEXT NOT NULL,
+  date DATE NOT NULL,
+  total DECIMAL NOT NULL DEFAULT 0,
+  expense_count INTEGER NOT NULL DEFAULT 0,
+  PRIMARY KEY (trip_id, category, date)
+);
+
+-- 触发器清理空格子时只需扫描这个很小的部分索引
+CREATE INDEX IF NOT EXISTS idx_expense_rollups_empty
+  ON expense_rollups(trip_id) WHERE expense_count <= 0;
+
+ALTER TABLE expense_rollups ENABLE ROW LEVEL SECURITY;
+
+CREATE POLICY "Users can view own expense rollups" ON expense_rollups
+  FOR SELECT USING (auth.uid() = user_id);
+
+-- 分组与主键一致；同一行程的费用属于同一用户，user_id 取组内任意一个
+CREATE OR REPLACE FUNCTION maintain_expense_rollups()
+RETURNS TRIGGER AS $$
+BEGIN
+  IF TG_OP = 'INSERT' THEN
+    INSERT INTO expense_rollups (trip_id, user_id, category, date, total, expense_count)
+    SELECT trip_id, MAX(user_id::text)::uuid, category, date, SUM(amount), COUNT(*)
+    FROM new_rows
+    GROUP BY trip_id, category, date
+    ON CONFLICT (trip_id, category, date) DO UPDATE
+      SET total = expense_rollups.total + EXCLUDED.total,
+          expense_count = expense_rollups.expense_count + EXCLUDED.expense_count;
+  ELSIF TG_OP = 'UPDATE' THEN
+    INSERT INTO expense_rollups (trip_id, user_id, category, date, total, expense_count)
+    SELECT trip_id, MAX(user_id::text)::uuid, category, date, SUM(amount), SUM(delta)
+    FROM (
+      SELECT trip_id, user_id, category, date, amount, 1 AS delta FROM new_rows
+      UNION ALL
+      SELECT trip_id, user_id, category, date, -amount, -1 AS delta FROM old_rows
+    ) changes
+    GROUP BY trip_id, category, date
+    ON CONFLICT (trip_id, category, date) DO UPDATE
+      SET total = expense_rollups.total + EXCLUDED.total,
+          expense_count = expense_rollups.expense_count + EXCLUDED.expense_count;
+  ELSE
+    INSERT INTO expense_rollups (trip_id, user_id, category, date, total, expense_count)
+    SELECT trip_id, MAX(user_id::text)::uuid, category, date, -SUM(amount), -COUNT(*)
+    FROM old_rows
+    GROUP BY trip_id, category, date
+    ON CONFLICT (trip_id, category, date) DO UPDATE
+      SET total = expense_rollups.total + EXCLUDED.total,
+          expense_count = expense_rollups.expense_count + EXCLUDED.expense_count;
+  END IF;
+
+  -- 只有更新和删除会减少条数，只清理本条语句涉及的 (trip_id, category, date)
+  IF TG_OP <> 'INSERT' THEN
+    DELETE FROM expense_rollups r
+    USING (SELECT DISTINCT trip_id, category, date FROM old_rows) touched
+    WHERE r.trip_id = touched.trip_id
+      AND r.category = touched.category
+      AND r.date = touched.date
+      AND r.expense_count <= 0;
+  END IF;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER SET search_path = public, pg_temp;
+
+CREATE TRIGGER maintain_expense_rollups_insert
+  AFTER INSERT ON expenses
+  REFERENCING NEW TABLE AS new_rows
+  FOR EACH STATEMENT
+  EXECUTE FUNCTION maintain_expense_rollups();
+
+CREATE TRIGGER maintain_expense_rollups_update
+  AFTER UPDATE ON expenses
+  REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+  FOR EACH STATEMENT
+  EXECUTE FUNCTION maintain_expense_rollups();
+
+CREATE TRIGGER maintain_expense_rollups_delete
+  AFTER DELETE ON expenses
+  REFERENCING OLD TABLE AS old_rows
+  FOR EACH STATEMENT
+  EXECUTE FUNCTION maintain_expense_rollups();
+
+-- 已有数据回填（首次创建汇总表时执行一次）
+INSERT INTO expense_rollups (trip_id, user_id, category, date, total, expense_count)
+SELECT trip_id, MAX(user_id::text)::uuid, category, date, SUM(amount), COUNT(*)
+FROM expenses
+GROUP BY trip_id, category, date
+ON CONFLICT (trip_id, category, date) DO NOTHING;
+
+-- 汇总查询：一次往返返回总额、条数、按类别和按日期的金额，
+-- 以及最近修改时间（用于 ETag，走 idx_expenses_trip_user_updated 索引）
+CREATE OR REPLACE FUNCTION get_trip_expense_summary(p_trip_id UUID, p_user_id UUID)
+RETURNS JSON AS $$
+  SELECT json_build_object(
+    'total_spent', COALESCE((
+      SELECT SUM(total) FROM expense_rollups
+      WHERE trip_id = p_trip_id AND user_id = p_user_id
+    ), 0),
+    'expense_count', COALESCE((
+      SELECT SUM(expense_count) FROM expense_rollups
+      WHERE trip_id = p_trip_id AND user_id = p_user_id
+    ), 0),
+    'by_category', COALESCE((
+      SELECT json_object_agg(category, category_total)
+      FROM (
+        SELECT category, SUM(total) AS category_total FROM expense_rollups
+        WHERE trip_id = p_trip_id AND user_id = p_user_id
+        GROUP BY category
+      ) c
+    ), '{}'::json),
+    'by_day', COALESCE((
+      SELECT json_object_agg(date, day_total ORDER BY date)
+      FROM (
+        SELECT date, SUM(total) AS day_total FROM expense_rollups
+        WHERE trip_id = p_trip_id AND user_id = p_user_id
+        GROUP BY date
+      ) d
+    ), '{}'::json),
+    'last_updated_at', (
+      SELECT MAX(updated_at) FROM expenses
+      WHERE trip_id = p_trip_id AND user_id = p_user_id
+    )
+  );
+$$ LANGUAGE sql STABLE;
+
 -- 插入一些示例数据（可选，用于测试）
 -- 注意：需要替换 user_id 为实际的用户 ID
 -- INSERT INTO trips (user_id, title, destination, start_date, end_date, total_days, budget, travelers, preferences)
@@ -1,8 +1,8 @@
-import React, { useEffect } from 'react'
-import { MapContainer, TileLayer, Marker, Popup, Polyline, useMap } from 'react-leaflet'
+import React, { useEffect, useMemo, useState } from 'react'
+import { MapContainer, TileLayer, Marker, Popup, Polyline, useMap, useMapEvents } from 'react-leaflet'
 import { Icon, LatLngBounds } from 'leaflet'
 import 'leaflet/dist/leaflet.css'
-import type { Attraction, Accommodation } from '@/types'
+import type { Attraction, Accommodation, DailyItinerary, RouteLeg } from '@/types'
 
 // 自定义景点图标（蓝色）
 const AttractionIcon = new Icon({
@@ -33,11 +33,77 @@ const AccommodationIcon = new Icon({
 interface MapViewProps {
   attractions?: Attraction[]
   accommodations?: Accommodation[]
+  // 传入每日行程时按天绘制路线（使用后端预先计算的路线），否则用直线依次连接所有景点
+  itineraries?: DailyItinerary[]
   center?: [number, number]
   zoom?: number
   className?: string
 }
 
+// 解码 encoded polyline（精度 1e-5），返回 [lat, lng] 序列
+function decodePolyline(encoded: string): [number, number][] {
+  const points: [number, number][] = []
+  let index = 0
+  let lat = 0
+  let lng = 0
+  while (index < encoded.length) {
+    for (let i = 0; i < 2; i++) {
+      let shift = 0
+      let result = 0
+      let byte: number
+      do {
+        byte = encoded.charCodeAt(index++) - 63
+        result |= (byte & 0x1f) << shift
+        shift += 5
+      } while (byte >= 0x20)
+      const delta = result & 1 ? ~(result >> 1) : result >> 1
+      if (i === 0) lat += delta
+      else lng += delta
+    }
+    points.push([lat / 1e5, lng / 1e5])
+  }
+  return points
+}
+
+// 选择不超过当前缩放级别的最精细的一级；比所有级别都小时用最粗的一级
+function pickPolyline(leg: RouteLeg, zoom: number): string | undefined {
+  const levels = Object.keys(leg.polylines).map(Number).sort((a, b) => a - b)
+  if (levels.length === 0) return undefined
+  const level = levels.filter((z) => z <= zoom).pop() ?? levels[0]
+  return leg.polylines[String(level)]
+}
+
+// 按天绘制路线：有预先计算的路段时沿道路绘制，否则用直线连接相邻景点
+function DayRoutes({ itineraries }: { itineraries: DailyItinerary[] }) {
+  const map = useMap()
+  const [zoom, setZoom] = useState(map.getZoom())
+  useMapEvents({ zoomend: () => setZoom(map.getZoom()) })
+
+  const paths = useMemo(
+    () =>
+      itineraries.flatMap((day) => {
+        const stops = day.attractions.map((a) => [a.latitude, a.longitude] as [number, number])
+        return stops.slice(1).map((stop, i) => {
+          const encoded = day.route?.legs[i] && pickPolyline(day.route.legs[i], zoom)
+          return encoded ? decodePolyline(encoded) : [stops[i], stop]
+        })
+      }),
+    [itineraries, zoom]
+  )
+
+  return (
+    <>
+      {paths.map((positions, index) => (
+        <Polyline
+          key={`route-${index}`}
+          positions={positions}
+          pathOptions={{ color: '#1890ff', weight: 4, opacity: 0.8 }}
+        />
+      ))}
+    </>
+  )
+}
+
 // 地图控制组件 - 用于自动调整视野
 function MapController({ attractions, accommodations }: { attractions: Attraction[], accommodations: Accommodation[] }) {
   const map = useMap()
@@ -66,6 +132,7 @@ function MapController({ attractions, accommodations }: { attractions: Attractio
 const MapView: React.FC<MapViewProps> = ({
   attractions = [],
   accommodations = [],
+  itineraries,
   center,
   zoom = 12,
   className = '',
@@ -163,8 +230,9 @@ const MapView: React.FC<MapViewProps> = ({
           </Marker>
         ))}
 
-        {/* 如果有多个景点，绘制路线 */}
-        {attractionPath.length > 1 && (
+        {/* 绘制路线：按天使用预先计算的路线，或直线依次连接景点 */}
+        {itineraries && <DayRoutes itineraries={itineraries} />}
+        {!itineraries && attractionPath.length > 1 && (
           <Polyline
             positions={attractionPath}
             pathOptions={{
@@ -32,7 +32,7 @@ const { Header, Content } = Layout
 const ExpenseManagement: React.FC = () => {
   const navigate = useNavigate()
   const { tripId } = useParams<{ tripId: string }>()
-  const { expenses, summary, fetchExpenses, fetchSummary, updateExpense, deleteExpense, analyzeBudget } =
+  const { expenses, summary, fetchExpenses, fetchSummary, updateExpense, deleteExpense, analyzeBudget, subscribe } =
     useExpenseStore()
   const { fetchTrip } = useTripStore()
   const [expenseFormVisible, setExpenseFormVisible] = useState(false)
@@ -48,6 +48,8 @@ const ExpenseManagement: React.FC = () => {
       fetchTrip(tripId)
       fetchExpenses(tripId)
       fetchSummary(tripId)
+      // 费用变更（包括同行人的修改）由服务端推送增量，无需重新拉取
+      return subscribe(tripId)
     }
   }, [tripId])
 
@@ -78,9 +80,6 @@ const ExpenseManagement: React.FC = () => {
       message.success('费用记录已删除')
       setDeleteModalVisible(false)
       setExpenseToDelete(null)
-      if (tripId) {
-        fetchSummary(tripId)
-      }
     } catch (error) {
       message.error('删除失败')
     }
@@ -98,9 +97,6 @@ const ExpenseManagement: React.FC = () => {
       }
       setExpenseFormVisible(false)
       setEditingExpense(null)
-      if (tripId) {
-        fetchSummary(tripId)
-      }
     } catch (error) {
       message.error('操作失败')
     }
@@ -176,6 +176,7 @@ const TripDetail: React.FC = () => {
           <MapView
             attractions={currentTrip.daily_itineraries.flatMap((day) => day.attractions)}
             accommodations={currentTrip.accommodations}
+            itineraries={currentTrip.daily_itineraries}
             className="h-full rounded-lg overflow-hidden shadow-lg"
           />
         </div>
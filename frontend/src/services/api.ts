@@ -6,11 +6,23 @@ import type {
   Expense,
   ExpenseCreate,
   ExpenseSummary,
+  ExpenseAnalytics,
+  ExpenseEvent,
   AuthResponse,
 } from '@/types'
 
+// 请求结束后这段时间内，相同内容的 POST 仍沿用同一个幂等键（覆盖连点）
+const IDEMPOTENCY_REUSE_MS = 3000
+
+interface IdempotencyEntry {
+  key: string
+  settledAt?: number
+}
+
 class ApiService {
   private api: AxiosInstance
+  // 请求内容 -> 幂等键：进行中或刚结束的相同请求由后端合并为一次执行
+  private idempotencyKeys = new Map<string, IdempotencyEntry>()
 
   constructor() {
     this.api = axios.create({
@@ -33,29 +45,59 @@ class ApiService {
     this.api.interceptors.response.use(
       (response) => response,
       async (error) => {
-        if (error.response?.status === 401) {
-          // Token 过期，尝试刷新
-          const refreshToken = localStorage.getItem('refresh_token')
-          if (refreshToken) {
-            try {
-              const response = await this.refreshToken(refreshToken)
-              localStorage.setItem('access_token', response.access_token)
-              localStorage.setItem('refresh_token', response.refresh_token)
-              // 重试原请求
-              return this.api.request(error.config)
-            } catch {
-              // 刷新失败，清除 token 并跳转登录
-              localStorage.removeItem('access_token')
-              localStorage.removeItem('refresh_token')
-              window.location.href = '/login'
-            }
-          }
+        // Token 过期，刷新后重试原请求
+        if (error.response?.status === 401 && (await this.refreshSession())) {
+          return this.api.request(error.config)
         }
         return Promise.reject(error)
       }
     )
   }
 
+  // 用 refresh token 换新的 token；刷新失败时清除 token 并跳转登录
+  private async refreshSession(): Promise<boolean> {
+    const refreshToken = localStorage.getItem('refresh_token')
+    if (!refreshToken) {
+      return false
+    }
+    try {
+      const response = await this.refreshToken(refreshToken)
+      localStorage.setItem('access_token', response.access_token)
+      localStorage.setItem('refresh_token', response.refresh_token)
+      return true
+    } catch {
+      localStorage.removeItem('access_token')
+      localStorage.removeItem('refresh_token')
+      window.location.href = '/login'
+      return false
+    }
+  }
+
+  // 带 Idempotency-Key 的 POST：连点产生的相同请求、token 刷新后重放的请求只会执行一次
+  private async postIdempotent<T>(url: string, body?: unknown): Promise<T> {
+    const now = Date.now()
+    for (const [fingerprint, entry] of this.idempotencyKeys) {
+      if (entry.settledAt && now - entry.settledAt > IDEMPOTENCY_REUSE_MS) {
+        this.idempotencyKeys.delete(fingerprint)
+      }
+    }
+    const fingerprint = `${url}\n${JSON.stringify(body ?? null)}`
+    let entry = this.idempotencyKeys.get(fingerprint)
+    if (!entry) {
+      entry = { key: crypto.randomUUID() }
+      this.idempotencyKeys.set(fingerprint, entry)
+    }
+    entry.settledAt = undefined
+    try {
+      const response = await this.api.post<T>(url, body, {
+        headers: { 'Idempotency-Key': entry.key },
+      })
+      return response.data
+    } finally {
+      entry.settledAt = Date.now()
+    }
+  }
+
   // 认证相关
   async signUp(email: string, password: string, fullName?: string): Promise<AuthResponse> {
     const response = await this.api.post<AuthResponse>('/auth/signup', {
@@ -90,13 +132,15 @@ class ApiService {
 
   // 行程相关
   async createTripPlan(request: TripPlanRequest): Promise<TripPlan> {
-    const response = await this.api.post<TripPlan>('/trips/plan', request)
-    return response.data
+    return this.postIdempotent<TripPlan>('/trips/plan', request)
   }
 
-  async getTrips(limit = 50, offset = 0): Promise<{ trips: TripPlan[]; total: number }> {
+  async getTrips(
+    limit = 50,
+    cursor?: string
+  ): Promise<{ trips: TripPlan[]; total?: number | null; next_cursor?: string | null }> {
     const response = await this.api.get('/trips/', {
-      params: { limit, offset },
+      params: { limit, cursor },
     })
     return response.data
   }
@@ -117,8 +161,7 @@ class ApiService {
 
   // 费用相关
   async createExpense(expense: ExpenseCreate): Promise<Expense> {
-    const response = await this.api.post<Expense>('/expenses/', expense)
-    return response.data
+    return this.postIdempotent<Expense>('/expenses/', expense)
   }
 
   async getTripExpenses(tripId: string): Promise<Expense[]> {
@@ -131,6 +174,70 @@ class ApiService {
     return response.data
   }
 
+  async getExpenseAnalytics(tripId: string): Promise<ExpenseAnalytics> {
+    const response = await this.api.get<ExpenseAnalytics>(`/expenses/trip/${tripId}/analytics`)
+    return response.data
+  }
+
+  // 订阅行程的费用变更推送（SSE），返回取消订阅函数
+  // EventSource 不能设置请求头，这里用 fetch 读取事件流，token 放在 Authorization 头中；
+  // 断开后按服务端的 retry 间隔重连，每次连接读取最新的 token（过期时先刷新）
+  subscribeExpenseEvents(tripId: string, onEvent: (event: ExpenseEvent) => void): () => void {
+    const controller = new AbortController()
+    const url = `${config.api.baseUrl}/expenses/trip/${tripId}/events`
+    let retryMs = 3000
+
+    const readStream = async (body: ReadableStream<Uint8Array>) => {
+      const reader = body.pipeThrough(new TextDecoderStream()).getReader()
+      let buffer = ''
+      for (;;) {
+        const { value, done } = await reader.read()
+        if (done) return
+        buffer += value
+        let boundary: number
+        while ((boundary = buffer.indexOf('\n\n')) >= 0) {
+          const block = buffer.slice(0, boundary)
+          buffer = buffer.slice(boundary + 2)
+          const data: string[] = []
+          for (const line of block.split('\n')) {
+            if (line.startsWith('data:')) data.push(line.slice(5).trimStart())
+            else if (line.startsWith('retry:')) retryMs = Number(line.slice(6)) || retryMs
+          }
+          if (data.length) onEvent(JSON.parse(data.join('\n')))
+        }
+      }
+    }
+
+    const run = async () => {
+      while (!controller.signal.aborted) {
+        try {
+          const response = await fetch(url, {
+            headers: {
+              Accept: 'text/event-stream',
+              Authorization: `Bearer ${localStorage.getItem('access_token') || ''}`,
+            },
+            signal: controller.signal,
+          })
+          if (response.status === 401) {
+            if (!(await this.refreshSession())) return
+            continue
+          }
+          // 行程不存在或无权访问时重连也没有意义
+          if (response.status === 403 || response.status === 404) return
+          if (response.ok && response.body) {
+            await readStream(response.body)
+          }
+        } catch {
+          if (controller.signal.aborted) return
+        }
+        await new Promise((resolve) => setTimeout(resolve, retryMs))
+      }
+    }
+
+    run()
+    return () => controller.abort()
+  }
+
   async updateExpense(expenseId: string, expense: ExpenseCreate): Promise<Expense> {
     const response = await this.api.put<Expense>(`/expenses/${expenseId}`, expense)
     return response.data
@@ -141,8 +248,7 @@ class ApiService {
   }
 
   async analyzeBudget(tripId: string): Promise<any> {
-    const response = await this.api.post(`/expenses/trip/${tripId}/analyze`)
-    return response.data
+    return this.postIdempotent(`/expenses/trip/${tripId}/analyze`)
   }
 }
 
@@ -1,10 +1,66 @@
 import { create } from 'zustand'
 import { apiService } from '@/services/api'
-import type { Expense, ExpenseCreate, ExpenseSummary } from '@/types'
+import { useTripStore } from '@/store/tripStore'
+import type { Expense, ExpenseCreate, ExpenseEvent, ExpenseSummary, ExpenseSummaryDelta } from '@/types'
+
+// 合并按键累加的统计，去掉归零的键
+const mergeTotals = (base: Record<string, number>, delta: Record<string, number>) => {
+  const result = { ...base }
+  for (const [key, value] of Object.entries(delta)) {
+    const next = Math.round(((result[key] || 0) + value) * 100) / 100
+    if (next === 0) {
+      delete result[key]
+    } else {
+      result[key] = next
+    }
+  }
+  return result
+}
+
+// 用新的统计值更新 summary，并重新计算剩余预算和日均花费
+const withTotals = (summary: ExpenseSummary, totals: ExpenseSummaryDelta): ExpenseSummary => {
+  const totalDays = useTripStore.getState().currentTrip?.total_days || 1
+  return {
+    ...summary,
+    ...totals,
+    remaining: summary.budget - totals.total_spent,
+    daily_average: totals.total_spent / Math.max(totalDays, 1),
+  }
+}
+
+const totalsOf = (summary: ExpenseSummary): ExpenseSummaryDelta => ({
+  total_spent: summary.total_spent,
+  expense_count: summary.expense_count || 0,
+  by_category: summary.by_category,
+  by_day: summary.by_day || {},
+})
+
+// 推送的快照先于统计接口返回时，以当前行程的预算建立 summary
+const emptySummary = (tripId: string): ExpenseSummary => {
+  const trip = useTripStore.getState().currentTrip
+  return {
+    trip_id: tripId,
+    total_spent: 0,
+    budget: trip?.id === tripId ? trip.budget : 0,
+    remaining: 0,
+    by_category: {},
+    daily_average: 0,
+  }
+}
+
+const applySummaryDelta = (summary: ExpenseSummary, delta: ExpenseSummaryDelta): ExpenseSummary =>
+  withTotals(summary, {
+    total_spent: Math.round((summary.total_spent + delta.total_spent) * 100) / 100,
+    expense_count: (summary.expense_count || 0) + delta.expense_count,
+    by_category: mergeTotals(summary.by_category, delta.by_category),
+    by_day: mergeTotals(summary.by_day || {}, delta.by_day),
+  })
 
 interface ExpenseState {
   expenses: Expense[]
   summary: ExpenseSummary | null
+  // 推送已送达快照的行程：此后统计以推送为准
+  liveTripId: string | null
   isLoading: boolean
   error: string | null
   
@@ -14,12 +70,14 @@ interface ExpenseState {
   updateExpense: (expenseId: string, expense: ExpenseCreate) => Promise<void>
   deleteExpense: (expenseId: string) => Promise<void>
   analyzeBudget: (tripId: string) => Promise<any>
+  subscribe: (tripId: string) => () => void
   clearError: () => void
 }
 
-export const useExpenseStore = create<ExpenseState>((set) => ({
+export const useExpenseStore = create<ExpenseState>((set, get) => ({
   expenses: [],
   summary: null,
+  liveTripId: null,
   isLoading: false,
   error: null,
 
@@ -59,7 +117,12 @@ export const useExpenseStore = create<ExpenseState>((set) => ({
   fetchSummary: async (tripId: string) => {
     try {
       const summary = await apiService.getExpenseSummary(tripId)
-      set({ summary })
+      // 推送已在更新统计时，拉取的结果可能早于已应用的变更，只取其中的预算等行程信息
+      set((state) =>
+        state.liveTripId === tripId && state.summary
+          ? { summary: withTotals(summary, totalsOf(state.summary)) }
+          : { summary }
+      )
     } catch (error: any) {
       set({
         error: error.response?.data?.detail || '获取费用统计失败',
@@ -118,6 +181,49 @@ export const useExpenseStore = create<ExpenseState>((set) => ({
     }
   },
 
+  // 订阅服务端推送：费用列表和统计按增量更新，不再重新拉取
+  subscribe: (tripId: string) => {
+    const handleEvent = (event: ExpenseEvent) => {
+      switch (event.type) {
+        case 'snapshot':
+          set((state) => ({
+            summary: withTotals(state.summary?.trip_id === tripId ? state.summary : emptySummary(tripId), event.summary),
+            liveTripId: tripId,
+          }))
+          break
+        case 'resync':
+          // 推送丢失了变更，统计以重新拉取的结果为准，直到下一个快照
+          set({ liveTripId: null })
+          get().fetchExpenses(tripId)
+          get().fetchSummary(tripId)
+          break
+        case 'expense.bulk':
+          get().fetchExpenses(tripId)
+          set((state) => ({ summary: state.summary && applySummaryDelta(state.summary, event.delta) }))
+          break
+        default: {
+          const { expense, delta } = event
+          set((state) => {
+            const others = state.expenses.filter((e) => e.id !== expense.id)
+            return {
+              expenses: event.type === 'expense.deleted'
+                ? others
+                : state.expenses.some((e) => e.id === expense.id)
+                  ? state.expenses.map((e) => (e.id === expense.id ? (expense as Expense) : e))
+                  : [expense as Expense, ...state.expenses],
+              summary: state.summary && applySummaryDelta(state.summary, delta),
+            }
+          })
+        }
+      }
+    }
+    const unsubscribe = apiService.subscribeExpenseEvents(tripId, handleEvent)
+    return () => {
+      unsubscribe()
+      set((state) => (state.liveTripId === tripId ? { liveTripId: null } : {}))
+    }
+  },
+
   clearError: () => set({ error: null }),
 }))
 
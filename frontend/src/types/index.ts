@@ -36,6 +36,7 @@ export interface Attraction {
   duration: number
   estimated_cost: number
   tips?: string
+  pinned?: boolean
 }
 
 export interface Restaurant {
@@ -70,6 +71,23 @@ export interface Accommodation {
   facilities: string[]
 }
 
+export interface RouteLeg {
+  distance: number
+  duration: number
+  // 键为地图缩放级别，值为 encoded polyline；为空表示未取得路线
+  polylines: Record<string, string>
+}
+
+export interface DayRoute {
+  stops_key: string
+  // 第 i 段连接当天第 i 个和第 i+1 个景点
+  legs: RouteLeg[]
+  // 有路段未取得时为 false，服务端在 retry_after 之后重新计算
+  complete?: boolean
+  failures?: number
+  retry_after?: number | null
+}
+
 export interface DailyItinerary {
   day: number
   date: string
@@ -78,6 +96,7 @@ export interface DailyItinerary {
   transportation: Transportation[]
   notes?: string
   total_cost: number
+  route?: DayRoute | null
 }
 
 export interface TripPlan {
@@ -148,6 +167,43 @@ export interface ExpenseSummary {
   remaining: number
   by_category: Record<string, number>
   daily_average: number
+  expense_count?: number
+  by_day?: Record<string, number>
+}
+
+export interface ExpenseSummaryDelta {
+  total_spent: number
+  expense_count: number
+  by_category: Record<string, number>
+  by_day: Record<string, number>
+}
+
+export type ExpenseEvent =
+  | { type: 'snapshot'; trip_id: string; summary: ExpenseSummaryDelta }
+  | { type: 'expense.created' | 'expense.updated'; trip_id: string; expense: Expense; delta: ExpenseSummaryDelta }
+  | { type: 'expense.deleted'; trip_id: string; expense: { id: string }; delta: ExpenseSummaryDelta }
+  | { type: 'expense.bulk'; trip_id: string; expense: null; delta: ExpenseSummaryDelta }
+  | { type: 'resync'; trip_id: string }
+
+export interface ExpenseAnalytics {
+  trip_id: string
+  budget: number
+  total_spent: number
+  expense_count: number
+  total_days: number
+  days_elapsed: number
+  dates: string[]
+  daily: number[]
+  cumulative: number[]
+  budget_line: number[]
+  by_category: Record<string, number[]>
+  category_totals: Record<string, number>
+  spent_to_date: number
+  budget_to_date: number
+  daily_average: number
+  projected_total: number
+  projected_remaining: number
+  on_track: boolean
 }
 
 export interface User {